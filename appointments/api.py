@@ -1,8 +1,14 @@
-from rest_framework import viewsets, permissions, status, filters
+from datetime import timedelta
+
+from rest_framework import viewsets, permissions, status, filters, serializers
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils import timezone
 from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 
@@ -11,12 +17,36 @@ from .serializers import (
     AppointmentSerializer, 
     AppointmentCreateSerializer, 
     AppointmentUpdateSerializer,
-    AppointmentBulkCreateSerializer
+    AppointmentBulkCreateSerializer,
+    AppointmentHoldSerializer,
+    AppointmentBulkTransitionSerializer,
+    appointment_end_time
 )
+from .holds import SlotConflict, acquire_hold, slot_hold
+from .bulk import book_appointments
 from patients.models import Patient, MedicalRecord
 from doctors.models import Doctor
 from healthcare.permissions import IsPatient, IsDoctor, IsPatientOrDoctor
-from healthcare.utils import get_cached_data, invalidate_cache_pattern
+from healthcare.serializers import SPARSE_FIELDSET_PARAMS, list_response
+from healthcare.utils import cache_response, idempotent
+
+# Why a status transition was refused, by target status
+TRANSITION_ERRORS = {
+    'CONFIRMED': 'This appointment cannot be confirmed.',
+    'COMPLETED': 'This appointment cannot be marked as completed.',
+    'CANCELLED': 'This appointment cannot be cancelled.',
+}
+
+# The statuses patients and doctors may move their appointments to in bulk
+BULK_TRANSITIONS = {
+    'patient': ['CANCELLED'],
+    'doctor': ['CONFIRMED', 'COMPLETED', 'CANCELLED'],
+}
+
+class TransitionConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The status of this appointment was changed by another request.'
+    default_code = 'transition_conflict'
 
 class AppointmentViewSet(viewsets.ModelViewSet):
     
@@ -27,18 +57,19 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['patient__user__first_name', 'patient__user__last_name', 'doctor__user__first_name', 'doctor__user__last_name', 'status']
     ordering_fields = ['appointment_date', 'appointment_time', 'created_at', 'updated_at']
+    sparse_fieldset_actions = ['list', 'retrieve', 'upcoming', 'past', 'today']
     
     def get_permissions(self):
         
         #Instantiates and returns the list of permissions that this view requires.
         
-        if self.action == 'create':
+        if self.action in ['create', 'hold']:
             permission_classes = [IsPatient]
         elif self.action in ['update', 'partial_update', 'destroy']:
             permission_classes = [IsPatientOrDoctor]
         elif self.action == 'bulk_create':
             permission_classes = [IsPatient]
-        elif self.action in ['confirm', 'complete', 'cancel']:
+        elif self.action in ['confirm', 'complete', 'cancel', 'bulk_transition']:
             permission_classes = [IsPatientOrDoctor]
         else:
             permission_classes = [permissions.IsAuthenticated]
@@ -48,8 +79,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         #Return appropriate serializer class based on the action.
         
-        if self.action == 'create' or self.action == 'bulk_create':
+        if self.action == 'create':
             return AppointmentCreateSerializer
+        elif self.action == 'bulk_create':
+            return AppointmentBulkCreateSerializer
+        elif self.action == 'hold':
+            return AppointmentHoldSerializer
+        elif self.action == 'bulk_transition':
+            return AppointmentBulkTransitionSerializer
         elif self.action in ['update', 'partial_update']:
             return AppointmentUpdateSerializer
         return AppointmentSerializer
@@ -61,47 +98,86 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         user = self.request.user
         
-        cache_key = f'appointments_user_{user.id}_{self.request.query_params}'
+        if hasattr(user, 'patient'):
+            queryset = Appointment.objects.filter(patient=user.patient)
+        elif hasattr(user, 'doctor'):
+            queryset = Appointment.objects.filter(doctor=user.doctor)
+        else:
+            return Appointment.objects.none()
+        
+        # Listings load only what ?fields= and ?expand= ask for
+        if self.action in self.sparse_fieldset_actions:
+            return queryset.for_display(self.get_serializer())
+        return queryset.for_display()
+    
+    def get_cache_namespaces(self):
         
-        def get_appointments():
-            if hasattr(user, 'patient'):
-                return Appointment.objects.filter(patient=user.patient)
-            elif hasattr(user, 'doctor'):
-                return Appointment.objects.filter(doctor=user.doctor)
-            else:
-                return Appointment.objects.none()
+        #Cached responses are scoped to the requesting patient's or doctor's
+        #appointments, the namespaces registered in appointments/signals.py,
+        #and follow the profiles of the other side, which are nested in them.
         
-        from django.conf import settings
-        return get_cached_data(cache_key, settings.APPOINTMENT_CACHE_TIMEOUT, get_appointments)
+        user = self.request.user
+        if hasattr(user, 'patient'):
+            return [f'appointments_patient_{user.patient.id}', 'doctors']
+        elif hasattr(user, 'doctor'):
+            return [f'appointments_doctor_{user.doctor.id}', 'patients']
+        return []
+    
+    @cache_response('APPOINTMENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def list(self, request, *args, **kwargs):
+        return list_response(self, self.filter_queryset(self.get_queryset()), self.get_serializer())
+    
+    @cache_response('APPOINTMENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    @idempotent('IDEMPOTENCY_KEY_TIMEOUT')
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         
-        #Create a new appointment.
+        #Create a new appointment under a hold on its time (see appointments/holds.py).
         
         patient = get_object_or_404(Patient, user=self.request.user)
+        data = serializer.validated_data
+        token = data.pop('hold_token', None)
         
-        appointment = serializer.save(patient=patient)
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'appointments_user_{self.request.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
+        with slot_hold(data['doctor'], data['appointment_date'], data['appointment_time'], appointment_end_time(data), token):
+            appointment = self.save_booking(lambda: serializer.save(patient=patient))
         
         # Send notification asynchronously
         from .tasks import notify_doctor_of_new_appointment
         notify_doctor_of_new_appointment.delay(appointment.id)
     
+    def save_booking(self, save):
+        
+        #Run a booking's inserts in one transaction. Under the hold nothing
+        #should conflict; if a hold expired mid-request the database
+        #constraint or the model's checks still answer with a 409 or 400
+        #instead of a 500.
+        
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            raise SlotConflict('This time slot is already booked.')
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+    
     def perform_update(self, serializer):
         
         #Update an appointment.
         
-        old_status = self.get_object().status
+        old_status = serializer.instance.status
+        new_status = serializer.validated_data.pop('status', old_status)
         
-        # Save the appointment
-        appointment = serializer.save()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'appointments_user_{appointment.patient.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
+        # Save the notes, then move the status with a compare-and-set, so
+        # an appointment whose status changed meanwhile is left as it is
+        with transaction.atomic():
+            appointment = serializer.save()
+            if new_status != old_status and not appointment.transition(new_status):
+                raise TransitionConflict()
         
         # If status has changed, send notification asynchronously
         if old_status != appointment.status:
@@ -112,44 +188,55 @@ class AppointmentViewSet(viewsets.ModelViewSet):
                 appointment.status
             )
     
-    def perform_destroy(self, instance):
-        
-        #Delete an appointment.
-        
-        patient_user_id = instance.patient.user.id
-        doctor_user_id = instance.doctor.user.id
-        
-        instance.delete()
-        
-        invalidate_cache_pattern(f'appointments_user_{patient_user_id}_*')
-        invalidate_cache_pattern(f'appointments_user_{doctor_user_id}_*')
-    
     @action(detail=False, methods=['post'])
+    @idempotent('IDEMPOTENCY_KEY_TIMEOUT')
     def bulk_create(self, request):
         
-        #Create multiple appointments at once.
+        #Create multiple appointments at once, all or none. The batch is
+        #validated and inserted as a set (see appointments/bulk.py); errors
+        #are reported per appointment, in the order they were sent.
         
         serializer = AppointmentBulkCreateSerializer(data=request.data)
-        if serializer.is_valid():
-            patient = get_object_or_404(Patient, user=request.user)
-            
-            appointments = []
-            for appointment_data in serializer.validated_data['appointments']:
-                appointment = Appointment.objects.create(
-                    patient=patient,
-                    **appointment_data
-                )
-                appointments.append(appointment)
-            
-            invalidate_cache_pattern(f'appointments_user_{request.user.id}_*')
-            for appointment in appointments:
-                invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
-            
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        patient = get_object_or_404(Patient.objects.select_related('user'), user=request.user)
+        appointments, errors, conflict = self.save_booking(
+            lambda: book_appointments(patient, serializer.validated_data['appointments'])
+        )
+        if any(errors):
             return Response(
-                AppointmentSerializer(appointments, many=True).data,
-                status=status.HTTP_201_CREATED
+                {'appointments': errors},
+                status=status.HTTP_409_CONFLICT if conflict else status.HTTP_400_BAD_REQUEST
             )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(
+            AppointmentSerializer(appointments, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=False, methods=['post'])
+    @idempotent('IDEMPOTENCY_KEY_TIMEOUT')
+    def hold(self, request):
+        
+        #Hold a time for SLOT_HOLD_TIMEOUT seconds while the patient completes
+        #the booking; pass the returned hold_token when creating it. Sending
+        #a hold_token renews that hold.
+        
+        serializer = AppointmentHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        end_time = appointment_end_time(data)
+        token = acquire_hold(data['doctor'], data['appointment_date'], data['appointment_time'], end_time, data.get('hold_token'))
+        
+        return Response({
+            'hold_token': token,
+            'doctor': data['doctor'].id,
+            'appointment_date': data['appointment_date'],
+            'appointment_time': data['appointment_time'],
+            'end_time': end_time,
+            'expires_at': timezone.now() + timedelta(seconds=settings.SLOT_HOLD_TIMEOUT)
+        }, status=status.HTTP_201_CREATED)
     
     @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
@@ -157,21 +244,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         #Confirm an appointment.
         
         appointment = self.get_object()
+        old_status = appointment.status
         
-        if appointment.status != 'SCHEDULED':
+        if not appointment.transition('CONFIRMED'):
             return Response(
-                {'error': 'This appointment cannot be confirmed.'},
+                {'error': TRANSITION_ERRORS['CONFIRMED']},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        old_status = appointment.status
-        
-        appointment.status = 'CONFIRMED'
-        appointment.save()
-        
-        invalidate_cache_pattern(f'appointments_user_{appointment.patient.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
-        
         # Send notification asynchronously
         from .tasks import notify_patient_of_appointment_status_change
         notify_patient_of_appointment_status_change.delay(
@@ -189,21 +269,14 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         #Mark an appointment as completed.
         
         appointment = self.get_object()
+        old_status = appointment.status
         
-        if appointment.status != 'CONFIRMED':
+        if not appointment.transition('COMPLETED'):
             return Response(
-                {'error': 'This appointment cannot be marked as completed.'},
+                {'error': TRANSITION_ERRORS['COMPLETED']},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        old_status = appointment.status
-        
-        appointment.status = 'COMPLETED'
-        appointment.save()
-        
-        invalidate_cache_pattern(f'appointments_user_{appointment.patient.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
-        
         # Send notification asynchronously
         from .tasks import notify_patient_of_appointment_status_change
         notify_patient_of_appointment_status_change.delay(
@@ -221,12 +294,6 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         appointment = self.get_object()
         
-        if appointment.status not in ['SCHEDULED', 'CONFIRMED']:
-            return Response(
-                {'error': 'This appointment cannot be cancelled.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         if appointment.appointment_date < timezone.now().date():
             return Response(
                 {'error': 'Past appointments cannot be cancelled.'},
@@ -236,12 +303,12 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         # Store old status for notification
         old_status = appointment.status
         
-        # Cancel appointment
-        appointment.status = 'CANCELLED'
-        appointment.save()
-        
-        invalidate_cache_pattern(f'appointments_user_{appointment.patient.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
+        # Cancel appointment, unless it left SCHEDULED and CONFIRMED meanwhile
+        if not appointment.transition('CANCELLED'):
+            return Response(
+                {'error': TRANSITION_ERRORS['CANCELLED']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Send notification asynchronously
         from .tasks import notify_patient_of_appointment_status_change
@@ -253,7 +320,69 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         
         return Response(AppointmentSerializer(appointment).data)
     
+    @action(detail=False, methods=['post'], url_path='bulk-transition')
+    def bulk_transition(self, request):
+        
+        #Move many of the user's appointments to one status, e.g. to clear a
+        #doctor's day. One query locks and reads the appointments, one
+        #conditional UPDATE moves those whose status allows it, and one task
+        #notifies their patients. Outcomes are reported per id.
+        
+        serializer = AppointmentBulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        new_status = serializer.validated_data['status']
+        today = timezone.now().date()
+        
+        # Patients may only cancel; confirming and completing are for doctors
+        role = 'doctor' if hasattr(request.user, 'doctor') else 'patient'
+        if new_status not in BULK_TRANSITIONS[role]:
+            return Response(
+                {'error': f'You do not have permission to mark appointments as {new_status.lower()}.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        results = {}
+        with transaction.atomic():
+            movable = []
+            for appointment in self.get_queryset().filter(pk__in=ids).for_transition():
+                if new_status == 'CANCELLED' and appointment.appointment_date < today:
+                    error = 'Past appointments cannot be cancelled.'
+                elif appointment.status not in Appointment.TRANSITIONS[new_status]:
+                    error = TRANSITION_ERRORS[new_status]
+                else:
+                    movable.append(appointment)
+                    error = None
+                results[appointment.pk] = {'id': appointment.pk, 'updated': False, 'status': appointment.status}
+                if error:
+                    results[appointment.pk]['error'] = error
+            moved = Appointment.apply_transition(movable, new_status)
+        
+        changes = []
+        for appointment in moved:
+            changes.append((appointment.pk, results[appointment.pk]['status'], new_status))
+            results[appointment.pk] = {
+                'id': appointment.pk,
+                'updated': True,
+                'status': new_status,
+                'previous_status': results[appointment.pk]['status']
+            }
+        if changes:
+            # Send notifications asynchronously, in one task
+            from .tasks import notify_patients_of_appointment_status_changes
+            notify_patients_of_appointment_status_changes.delay(changes)
+        
+        return Response({
+            'status': new_status,
+            'updated': len(moved),
+            'results': [
+                results.get(pk, {'id': pk, 'updated': False, 'status': None, 'error': 'Not found.'})
+                for pk in ids
+            ]
+        })
+    
     @action(detail=False, methods=['get'])
+    @cache_response('APPOINTMENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS, vary_on_date=True)
     def upcoming(self, request):
         
         #Get upcoming appointments.
@@ -265,15 +394,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             status__in=['SCHEDULED', 'CONFIRMED']
         ).order_by('appointment_date', 'appointment_time')
         
-        page = self.paginate_queryset(upcoming_appointments)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(upcoming_appointments, many=True)
-        return Response(serializer.data)
+        return list_response(self, upcoming_appointments, self.get_serializer())
     
     @action(detail=False, methods=['get'])
+    @cache_response('APPOINTMENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS, vary_on_date=True)
     def past(self, request):
         
         #Get past appointments.
@@ -285,15 +409,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             Q(status__in=['COMPLETED', 'CANCELLED', 'NO_SHOW'])
         ).order_by('-appointment_date', '-appointment_time')
         
-        page = self.paginate_queryset(past_appointments)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(past_appointments, many=True)
-        return Response(serializer.data)
+        return list_response(self, past_appointments, self.get_serializer())
     
     @action(detail=False, methods=['get'])
+    @cache_response('APPOINTMENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS, vary_on_date=True)
     def today(self, request):
         
         #Get today's appointments.
@@ -305,12 +424,6 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             appointment_date=timezone.now().date()
         ).order_by('appointment_time')
         
-        page = self.paginate_queryset(today_appointments)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(today_appointments, many=True)
-        return Response(serializer.data)
+        return list_response(self, today_appointments, self.get_serializer())
     
     
\ No newline at end of file
@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from doctors.availability import load_booked_intervals, occupy_slots
+from doctors.intervals import add_minutes, load_exception_index, merge_intervals, overlaps, to_minutes, within_schedule
+from doctors.models import Doctor, DoctorSchedule
+from healthcare.utils import invalidate_cache_namespace_on_commit
+from .holds import bulk_slot_hold
+from .models import Appointment
+from .signals import appointment_cache_namespaces
+
+# Set-based bulk booking. The checks Appointment.clean and
+# AppointmentCreateSerializer.validate run per appointment are run here for a
+# whole batch against data loaded up front: the doctors, their schedules,
+# their exceptions and their existing bookings, one query each. Appointments
+# in the batch are checked against each other first; a batch that overlaps
+# itself is invalid whatever is booked, so it gets a 400 naming the clashing
+# items rather than a 409. The batch is then inserted with one bulk_create;
+# since that bypasses save() and its signals, the materialized day slots and
+# the cache namespaces are updated here, once per day and once per namespace.
+
+BOOKED = 'This time slot is already booked.'
+HELD = 'This time slot is held by another patient.'
+
+class _Rejected(Exception):
+    pass
+
+def _error(message):
+    return {'non_field_errors': [message]}
+
+def _check_items(items, doctors, schedules, now):
+
+    # The format-level checks of each item that need no database access
+    # beyond the preloaded doctors and schedules. Returns the errors and the
+    # end time of each item.
+
+    errors, end_times = [], []
+    for item in items:
+        doctor = doctors.get(item['doctor'])
+        end_time = None
+        if doctor is None:
+            error = {'doctor': [f"Invalid pk \"{item['doctor']}\" - object does not exist."]}
+        else:
+            end_time = add_minutes(item['appointment_time'], item.get('duration_minutes') or doctor.slot_minutes)
+            schedule = schedules.get((doctor.id, item['appointment_date'].weekday()))
+            appointment_datetime = timezone.make_aware(
+                timezone.datetime.combine(item['appointment_date'], item['appointment_time'])
+            )
+            if appointment_datetime <= now:
+                error = _error("Cannot schedule appointment in the past")
+            elif end_time is None:
+                error = _error("Appointment must end on the same day")
+            elif schedule is None:
+                error = _error("Doctor is not available on this day")
+            elif not within_schedule(*schedule, doctor.slot_minutes, item['appointment_time'], end_time):
+                error = _error("Appointment time is outside doctor's schedule")
+            else:
+                error = {}
+        errors.append(error)
+        end_times.append(end_time)
+    return errors, end_times
+
+def _check_overlaps(items, end_times, errors):
+
+    # Flag the items of the batch that overlap another item for the same
+    # doctor and day, each pointing at the item it clashes with: one sort and
+    # a sweep per day, keeping the item reaching furthest so far.
+
+    days = defaultdict(list)
+    for index, (item, end_time) in enumerate(zip(items, end_times)):
+        interval = (to_minutes(item['appointment_time']), to_minutes(end_time))
+        days[item['doctor'], item['appointment_date']].append((interval, index))
+
+    for intervals in days.values():
+        intervals.sort()
+        reaching = None
+        for (start, end), index in intervals:
+            if reaching is not None and start < reaching[0]:
+                other = reaching[1]
+                for this, that in ((index, other), (other, index)):
+                    if not errors[this]:
+                        errors[this] = _error(f'This appointment overlaps appointment {that} of the same request.')
+            if reaching is None or end > reaching[0]:
+                reaching = (end, index)
+
+def book_appointments(patient, items):
+
+    # Book validated AppointmentBulkItemSerializer items for a patient, all
+    # or none. Returns (appointments, errors, conflict): errors has one dict
+    # per item, empty for valid items, and nothing is saved unless every item
+    # is valid; conflict is True when every error is a clash with a booking
+    # or hold of someone else, which the API answers with a 409.
+
+    doctors = Doctor.objects.select_related('user').in_bulk({item['doctor'] for item in items})
+    schedules = {
+        (doctor_id, day_of_week): (start_time, end_time)
+        for doctor_id, day_of_week, start_time, end_time in DoctorSchedule.objects.filter(
+            doctor_id__in=doctors,
+            is_available=True
+        ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time')
+    }
+    errors, end_times = _check_items(items, doctors, schedules, timezone.now())
+    if not any(errors):
+        _check_overlaps(items, end_times, errors)
+    if any(errors):
+        return [], errors, False
+
+    hold_requests = [
+        (
+            doctors[item['doctor']],
+            item['appointment_date'],
+            schedules[item['doctor'], item['appointment_date'].weekday()][0],
+            item['appointment_time'],
+            end_time,
+        )
+        for item, end_time in zip(items, end_times)
+    ]
+    try:
+        with bulk_slot_hold(hold_requests) as held:
+            return _book(patient, items, doctors, end_times, errors, held), errors, False
+    except _Rejected:
+        # The holds were released on the way out
+        conflict = all(not error or error['non_field_errors'][0] in (BOOKED, HELD) for error in errors)
+        return [], errors, conflict
+
+def _book(patient, items, doctors, end_times, errors, held):
+
+    # Check the batch against the bookings and exceptions of its days, which
+    # under the holds cannot change for these times, and insert it. Fills in
+    # errors and raises _Rejected if any item fails.
+
+    first_day = min(item['appointment_date'] for item in items)
+    last_day = max(item['appointment_date'] for item in items)
+    exceptions = load_exception_index(list(doctors), first_day, last_day)
+    booked = defaultdict(list, {
+        key: merge_intervals(intervals)
+        for key, intervals in load_booked_intervals(list(doctors), first_day, last_day).items()
+    })
+
+    for index, (item, end_time) in enumerate(zip(items, end_times)):
+        doctor_id, day = item['doctor'], item['appointment_date']
+        interval = (to_minutes(item['appointment_time']), to_minutes(end_time))
+        if index in held:
+            errors[index] = _error(HELD)
+        elif exceptions.blocks(doctor_id, day, *interval):
+            errors[index] = _error("Doctor is not available at this time")
+        elif overlaps(booked[doctor_id, day], *interval):
+            errors[index] = _error(BOOKED)
+    if any(errors):
+        raise _Rejected()
+
+    appointments = [
+        Appointment(
+            patient=patient,
+            doctor=doctors[item['doctor']],
+            appointment_date=item['appointment_date'],
+            appointment_time=item['appointment_time'],
+            duration_minutes=item.get('duration_minutes') or doctors[item['doctor']].slot_minutes,
+            end_time=end_time,
+            reason=item['reason'],
+            notes=item.get('notes', '')
+        )
+        for item, end_time in zip(items, end_times)
+    ]
+    with transaction.atomic():
+        Appointment.objects.bulk_create(appointments, batch_size=500)
+        occupy_slots(appointment.booked_slot() for appointment in appointments)
+        invalidate_cache_namespace_on_commit(*{
+            namespace
+            for appointment in appointments
+            for namespace in appointment_cache_namespaces(appointment)
+        })
+    return appointments
@@ -0,0 +1,120 @@
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from doctors.intervals import to_minutes
+from doctors.models import DoctorSchedule
+from .models import Appointment
+
+# Short-lived holds on appointment slots. A hold is one cache key per slot of
+# the doctor's grid that the appointment overlaps, each taken with cache.add,
+# so of two bookers whose times overlap exactly one gets the shared key and
+# the other fails at once: nobody waits or retries. Bookings run under a hold,
+# either one the patient took beforehand through the hold endpoint or one
+# taken for the request, and insert in a transaction; the hold is released
+# once that transaction commits, when the appointment itself blocks the time.
+
+class SlotConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This time slot is already booked or held by another patient.'
+    default_code = 'slot_conflict'
+
+def grid_hold_keys(doctor, day, grid_start, start_time, end_time):
+    
+    # Keys of the grid slots, counted from grid_start, the schedule's start
+    # time, that the time from start_time to end_time overlaps
+    
+    first = to_minutes(grid_start) if grid_start else 0
+    start, end = to_minutes(start_time), to_minutes(end_time)
+    return [
+        f'slot_hold:{doctor.id}:{day.isoformat()}:{slot}'
+        for slot in range((start - first) // doctor.slot_minutes, -((first - end) // doctor.slot_minutes))
+    ]
+
+def hold_keys(doctor, day, start_time, end_time):
+    grid_start = DoctorSchedule.objects.filter(
+        doctor=doctor,
+        day_of_week=day.weekday(),
+        is_available=True
+    ).values_list('start_time', flat=True).first()
+    return grid_hold_keys(doctor, day, grid_start, start_time, end_time)
+
+def _acquire(keys, token, timeout):
+    
+    # All of the keys or none of them. Keys the token already holds count as
+    # acquired, so a patient can renew or confirm their own hold.
+    
+    added = []
+    for key in keys:
+        if cache.add(key, token, timeout):
+            added.append(key)
+        elif cache.get(key) != token:
+            cache.delete_many(added)
+            return False
+    return True
+
+def _release(keys, token):
+    held = cache.get_many(keys)
+    cache.delete_many([key for key, value in held.items() if value == token])
+
+def _hold(doctor, day, start_time, end_time, keys, token, timeout):
+    if not _acquire(keys, token, timeout):
+        raise SlotConflict()
+    
+    # Booked before the hold was taken; under the hold nobody else can book it
+    if Appointment.overlapping(doctor.id, day, start_time, end_time).exists():
+        _release(keys, token)
+        raise SlotConflict('This time slot is already booked.')
+
+def acquire_hold(doctor, day, start_time, end_time, token=None, timeout=None):
+    """Hold the time from start_time to end_time and return the hold token; raises SlotConflict"""
+    token = token or uuid.uuid4().hex
+    keys = hold_keys(doctor, day, start_time, end_time)
+    _hold(doctor, day, start_time, end_time, keys, token, timeout or settings.SLOT_HOLD_TIMEOUT)
+    return token
+
+@contextmanager
+def slot_hold(doctor, day, start_time, end_time, token=None):
+    
+    # Hold the time for a booking. The hold is released once the surrounding
+    # transaction commits; if the booking fails, a hold taken here is released
+    # at once while a patient's own hold is kept for another attempt.
+    
+    keys = hold_keys(doctor, day, start_time, end_time)
+    own_token = token or uuid.uuid4().hex
+    _hold(doctor, day, start_time, end_time, keys, own_token, settings.SLOT_HOLD_TIMEOUT)
+    try:
+        yield own_token
+    except Exception:
+        if token is None:
+            _release(keys, own_token)
+        raise
+    transaction.on_commit(lambda: _release(keys, own_token))
+
+@contextmanager
+def bulk_slot_hold(requests):
+    
+    # Hold many times under one token without touching the database;
+    # `requests` are (doctor, day, grid start, start time, end time) tuples.
+    # Yields the indexes of the requests someone else holds. Released like
+    # slot_hold, once the surrounding transaction commits.
+    
+    token = uuid.uuid4().hex
+    acquired, conflicts = [], set()
+    for index, request in enumerate(requests):
+        keys = grid_hold_keys(*request)
+        if _acquire(keys, token, settings.SLOT_HOLD_TIMEOUT):
+            acquired.extend(keys)
+        else:
+            conflicts.add(index)
+    try:
+        yield conflicts
+    except Exception:
+        _release(acquired, token)
+        raise
+    transaction.on_commit(lambda: _release(acquired, token))
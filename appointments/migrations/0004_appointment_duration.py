@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+import datetime
+
+from django.db import migrations, models
+
+
+def set_end_times(apps, schema_editor):
+    # Existing appointments last one slot of their doctor
+    Appointment = apps.get_model('appointments', 'Appointment')
+    appointments = list(Appointment.objects.select_related('doctor'))
+    for appointment in appointments:
+        appointment.duration_minutes = appointment.doctor.slot_minutes
+        start = datetime.datetime.combine(datetime.date.min, appointment.appointment_time)
+        end = start + datetime.timedelta(minutes=appointment.duration_minutes)
+        appointment.end_time = end.time() if end.date() == start.date() else datetime.time.max
+    Appointment.objects.bulk_update(appointments, ['duration_minutes', 'end_time'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_appointment_unique_active_slot'),
+        ('doctors', '0006_doctor_slot_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='duration_minutes',
+            field=models.PositiveSmallIntegerField(blank=True, default=30),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='end_time',
+            field=models.TimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(set_end_times, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='end_time',
+            field=models.TimeField(editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'appointment_date', 'appointment_time', 'end_time'], name='appointment_overlap_idx'),
+        ),
+    ]
@@ -3,9 +3,49 @@ from django.db import models
 # Create your models here.
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.dispatch import Signal
 from django.utils import timezone
 from patients.models import Patient
 from doctors.models import Doctor
+from doctors.intervals import add_minutes, is_slot_blocked, within_schedule
+
+# Sent with the moved appointments and their new status after a status
+# transition. Transitions are conditional UPDATEs that bypass post_save, so
+# the receivers in appointments/signals.py free slots and invalidate caches.
+status_changed = Signal()
+
+class AppointmentQuerySet(models.QuerySet):
+    
+    def for_display(self, serializer=None):
+        
+        # The shared queryset of every path that renders appointments, through
+        # AppointmentSerializer or a template: the patient, the doctor and
+        # their users come from one JOINed query, so a page costs the same
+        # number of queries whatever its size. Only the relations and columns
+        # `serializer` renders are loaded, by default those of a full
+        # AppointmentSerializer, which cover the templates as well.
+        
+        from healthcare.serializers import select_for_serializer
+        from .serializers import AppointmentSerializer
+        
+        return select_for_serializer(self, serializer or AppointmentSerializer())
+    
+    def for_transition(self):
+        """Lock the rows and load only the columns transitions and their receivers read"""
+        return self.select_related(None).select_for_update().only(
+            'id', 'patient_id', 'doctor_id', 'appointment_date', 'appointment_time', 'end_time', 'status'
+        )
+    
+    def transition(self, status):
+        
+        # Move every appointment of the queryset whose status allows it to
+        # `status`: one query locks and reads the rows, one conditional
+        # UPDATE moves them. Returns the moved appointments.
+        
+        with transaction.atomic():
+            appointments = self.for_transition().filter(status__in=self.model.TRANSITIONS[status])
+            return self.model.apply_transition(list(appointments), status)
 
 class Appointment(models.Model):
     STATUS_CHOICES = [
@@ -16,21 +56,148 @@ class Appointment(models.Model):
         ('NO_SHOW', 'No Show'),
     ]
     
+    # The statuses each status can be reached from
+    TRANSITIONS = {
+        'CONFIRMED': ['SCHEDULED'],
+        'COMPLETED': ['CONFIRMED'],
+        'CANCELLED': ['SCHEDULED', 'CONFIRMED'],
+        'NO_SHOW': ['SCHEDULED', 'CONFIRMED'],
+    }
+    
+    # Fields whose changes move an appointment to another time, and are
+    # validated against the doctor's schedule and bookings
+    SCHEDULING_FIELDS = {'doctor_id', 'appointment_date', 'appointment_time', 'duration_minutes'}
+    TRACKED_FIELDS = SCHEDULING_FIELDS | {'status'}
+    
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='appointments')
     appointment_date = models.DateField()
     appointment_time = models.TimeField()
+    # Defaults to the doctor's slot length; end_time is derived on save
+    duration_minutes = models.PositiveSmallIntegerField(blank=True)
+    end_time = models.TimeField(editable=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='SCHEDULED')
     reason = models.TextField()
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AppointmentQuerySet.as_manager()
+    
     class Meta:
-        unique_together = ['doctor', 'appointment_date', 'appointment_time']
+        # A cancelled appointment frees its slot for another booking
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='CANCELLED'),
+                name='unique_active_appointment_slot',
+            ),
+        ]
+        indexes = [
+            # Overlap queries: same doctor and day, starting before an end and ending after a start
+            models.Index(fields=['doctor', 'appointment_date', 'appointment_time', 'end_time'], name='appointment_overlap_idx'),
+        ]
         ordering = ['appointment_date', 'appointment_time']
     
+    @classmethod
+    def overlapping(cls, doctor_id, day, start_time, end_time):
+        """Active appointments of a doctor that overlap start_time to end_time on a day"""
+        return cls.objects.filter(
+            doctor_id=doctor_id,
+            appointment_date=day,
+            appointment_time__lt=end_time,
+            end_time__gt=start_time
+        ).exclude(status='CANCELLED')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Slot held as loaded, to release it when the appointment moves or is cancelled
+        if not instance.get_deferred_fields():
+            instance._loaded_slot = instance.booked_slot()
+        instance._loaded_values = instance._tracked_values()
+        return instance
+    
+    def _tracked_values(self):
+        return {name: self.__dict__[name] for name in self.TRACKED_FIELDS if name in self.__dict__}
+    
+    def changed_fields(self):
+        """Tracked fields that differ from the stored row; all of them for a new appointment"""
+        if self._state.adding or not hasattr(self, '_loaded_values'):
+            return set(self.TRACKED_FIELDS)
+        # Fields deferred at load count as changed once they have a value
+        current = self._tracked_values()
+        return {
+            name for name, value in current.items()
+            if name not in self._loaded_values or self._loaded_values[name] != value
+        }
+    
+    def is_rescheduled(self):
+        """Whether saving books a time the stored row does not hold: new, moved or no longer cancelled"""
+        changed = self.changed_fields()
+        if changed & self.SCHEDULING_FIELDS:
+            return True
+        return 'status' in changed and self._loaded_values.get('status') == 'CANCELLED'
+    
+    @classmethod
+    def apply_transition(cls, appointments, status):
+        
+        # Move those of some loaded appointments, locked by the caller's
+        # transaction, whose status allows it to `status` with one
+        # conditional UPDATE. Returns the moved appointments.
+        
+        appointments = [appointment for appointment in appointments if appointment.status in cls.TRANSITIONS[status]]
+        if not appointments:
+            return []
+        
+        updated_at = timezone.now()
+        cls.objects.filter(
+            pk__in=[appointment.pk for appointment in appointments],
+            status__in=cls.TRANSITIONS[status]
+        ).update(status=status, updated_at=updated_at)
+        for appointment in appointments:
+            appointment.status, appointment.updated_at = status, updated_at
+        status_changed.send(sender=cls, appointments=appointments, status=status)
+        return appointments
+    
+    def transition(self, status):
+        
+        # Compare-and-set the status: one UPDATE that only matches while the
+        # stored status allows the move, so of two concurrent transitions of
+        # an appointment exactly one wins. Returns whether this one did.
+        
+        updated_at = timezone.now()
+        moved = Appointment.objects.filter(
+            pk=self.pk,
+            status__in=self.TRANSITIONS[status]
+        ).update(status=status, updated_at=updated_at)
+        if not moved:
+            return False
+        
+        self.status, self.updated_at = status, updated_at
+        status_changed.send(sender=Appointment, appointments=[self], status=status)
+        self._loaded_values['status'] = status
+        self._loaded_slot = self.booked_slot()
+        return True
+    
+    def booked_slot(self):
+        """The (doctor_id, date, start time, end time) this appointment holds, if any"""
+        if self.status == 'CANCELLED':
+            return None
+        return (self.doctor_id, self.appointment_date, self.appointment_time, self.end_time)
+    
+    def set_end_time(self):
+        """Fill in the default duration and derive the end time"""
+        if not self.duration_minutes:
+            self.duration_minutes = self.doctor.slot_minutes
+        self.end_time = add_minutes(self.appointment_time, self.duration_minutes)
+    
     def clean(self):
+        # Scheduling is validated when an appointment takes a time; saving
+        # its status or notes alone needs no schedule or overlap queries
+        if not self.is_rescheduled():
+            return
+        
         # Check if appointment is in the past
         appointment_datetime = timezone.make_aware(
             timezone.datetime.combine(self.appointment_date, self.appointment_time)
@@ -38,6 +205,9 @@ class Appointment(models.Model):
         if appointment_datetime <= timezone.now():
             raise ValidationError("Cannot schedule appointment in the past")
         
+        if self.end_time is None:
+            raise ValidationError("Appointment must end on the same day")
+        
         # Check doctor availability
         day_of_week = self.appointment_date.weekday()
         schedule = self.doctor.schedules.filter(
@@ -48,12 +218,26 @@ class Appointment(models.Model):
         if not schedule:
             raise ValidationError("Doctor is not available on this day")
         
-        if not (schedule.start_time <= self.appointment_time <= schedule.end_time):
+        if not within_schedule(
+            schedule.start_time, schedule.end_time, self.doctor.slot_minutes, self.appointment_time, self.end_time
+        ):
             raise ValidationError("Appointment time is outside doctor's schedule")
+        
+        # Check vacations, holidays and blocked hours, and overlaps, unless cancelled
+        slot = self.booked_slot()
+        if slot:
+            if is_slot_blocked(*slot):
+                raise ValidationError("Doctor is not available at this time")
+            
+            # Check for overlapping appointments
+            if Appointment.overlapping(*slot).exclude(pk=self.pk).exists():
+                raise ValidationError("This time slot is already booked")
     
     def save(self, *args, **kwargs):
+        self.set_end_time()
         self.clean()
         super().save(*args, **kwargs)
+        self._loaded_values = self._tracked_values()
     
     def __str__(self):
         return f"{self.patient} with {self.doctor} on {self.appointment_date} at {self.appointment_time}"
@@ -1,23 +1,38 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import Appointment
+from .holds import SlotConflict
 from patients.serializers import PatientSerializer
 from doctors.serializers import DoctorSerializer
+from doctors.intervals import add_minutes, is_slot_blocked, within_schedule
+from healthcare.serializers import DynamicFieldsMixin
 
-class AppointmentSerializer(serializers.ModelSerializer):
-    patient = PatientSerializer(read_only=True)
-    doctor = DoctorSerializer(read_only=True)
+class AppointmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     
+    # Patient and doctor are nested unless ?expand= says otherwise (see healthcare/serializers.py)
+    expandable_fields = {'patient': PatientSerializer, 'doctor': DoctorSerializer}
+    default_expand = ('patient', 'doctor')
+    field_sources = {'status_display': ['status']}
+    
     class Meta:
         model = Appointment
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
 
+def appointment_end_time(data):
+    """End time of validated appointment data, or None past the end of the day"""
+    return add_minutes(data['appointment_time'], data.get('duration_minutes') or data['doctor'].slot_minutes)
+
 class AppointmentCreateSerializer(serializers.ModelSerializer):
+    # Token of a hold taken with POST /api/v1/appointments/hold/
+    hold_token = serializers.CharField(write_only=True, required=False)
+    
     class Meta:
         model = Appointment
-        fields = ['patient', 'doctor', 'appointment_date', 'appointment_time', 'reason', 'notes']
+        fields = ['patient', 'doctor', 'appointment_date', 'appointment_time', 'duration_minutes', 'reason', 'notes', 'hold_token']
+        extra_kwargs = {'duration_minutes': {'required': False, 'min_value': 5}}
     
     def validate(self, data):
         """
@@ -31,6 +46,10 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
         if appointment_datetime <= timezone.now():
             raise serializers.ValidationError("Cannot schedule appointment in the past")
         
+        end_time = appointment_end_time(data)
+        if end_time is None:
+            raise serializers.ValidationError("Appointment must end on the same day")
+        
         # Check doctor availability
         day_of_week = data['appointment_date'].weekday()
         schedule = data['doctor'].schedules.filter(
@@ -41,36 +60,72 @@ class AppointmentCreateSerializer(serializers.ModelSerializer):
         if not schedule:
             raise serializers.ValidationError("Doctor is not available on this day")
         
-        if not (schedule.start_time <= data['appointment_time'] <= schedule.end_time):
+        if not within_schedule(
+            schedule.start_time, schedule.end_time, data['doctor'].slot_minutes, data['appointment_time'], end_time
+        ):
             raise serializers.ValidationError("Appointment time is outside doctor's schedule")
         
-        # Check for conflicting appointments
-        existing_appointment = Appointment.objects.filter(
-            doctor=data['doctor'],
-            appointment_date=data['appointment_date'],
-            appointment_time=data['appointment_time']
+        # Check vacations, holidays and blocked hours
+        if is_slot_blocked(data['doctor'].id, data['appointment_date'], data['appointment_time'], end_time):
+            raise serializers.ValidationError("Doctor is not available at this time")
+        
+        # Check for overlapping appointments
+        existing_appointment = Appointment.overlapping(
+            data['doctor'].id,
+            data['appointment_date'],
+            data['appointment_time'],
+            end_time
         ).exists()
         
         if existing_appointment:
-            raise serializers.ValidationError("This time slot is already booked")
+            raise SlotConflict('This time slot is already booked.')
         
         return data
 
+class AppointmentHoldSerializer(AppointmentCreateSerializer):
+    
+    # The time of an appointment about to be booked, validated like a booking
+    
+    class Meta:
+        model = Appointment
+        fields = ['doctor', 'appointment_date', 'appointment_time', 'duration_minutes', 'hold_token']
+
 class AppointmentUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = ['status', 'notes']
         read_only_fields = ['patient', 'doctor', 'appointment_date', 'appointment_time', 'reason', 'created_at', 'updated_at']
+    
+    def validate_status(self, value):
+        """Only allow the status changes of Appointment.TRANSITIONS"""
+        current = self.instance.status if self.instance else None
+        if current is not None and value != current and current not in Appointment.TRANSITIONS.get(value, []):
+            raise serializers.ValidationError(f"Cannot change the status from {current} to {value}.")
+        return value
 
-class AppointmentBulkCreateSerializer(serializers.Serializer):
-    appointments = AppointmentCreateSerializer(many=True)
+class AppointmentBulkItemSerializer(serializers.Serializer):
     
-    def create(self, validated_data):
-        appointments_data = validated_data.pop('appointments')
-        appointments = []
-        
-        for appointment_data in appointments_data:
-            appointment = Appointment.objects.create(**appointment_data)
-            appointments.append(appointment)
-        
-        return {'appointments': appointments}
+    # One appointment of a bulk booking. Only the format is checked here;
+    # appointments/bulk.py checks the whole batch against the database at once.
+    
+    doctor = serializers.IntegerField()
+    appointment_date = serializers.DateField()
+    appointment_time = serializers.TimeField()
+    duration_minutes = serializers.IntegerField(required=False, min_value=5, max_value=32767)
+    reason = serializers.CharField()
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+class AppointmentBulkCreateSerializer(serializers.Serializer):
+    appointments = AppointmentBulkItemSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=settings.BULK_APPOINTMENT_MAX_ITEMS
+    )
+
+class AppointmentBulkTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BULK_APPOINTMENT_MAX_ITEMS
+    )
+    status = serializers.ChoiceField(choices=['CONFIRMED', 'COMPLETED', 'CANCELLED'])
@@ -0,0 +1,65 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from doctors.availability import materialize_day_slots, occupy_slot, release_slot, release_slots
+from doctors.models import Doctor
+from healthcare.utils import invalidate_cache_namespace_on_commit, register_cache_namespaces
+from patients.models import Patient
+
+from .models import Appointment, status_changed
+
+def appointment_cache_namespaces(appointment):
+    return [
+        f'appointments_patient_{appointment.patient_id}',
+        f'appointments_doctor_{appointment.doctor_id}',
+        f'available_slots_doctor_{appointment.doctor_id}',
+    ]
+
+# Cache namespaces fed by each model; invalidated after commit on every save and delete.
+register_cache_namespaces(Appointment, appointment_cache_namespaces)
+# Appointments are listed with their patient and doctor nested
+register_cache_namespaces(Doctor, lambda doctor: [f'appointments_doctor_{doctor.id}'])
+register_cache_namespaces(Patient, lambda patient: [f'appointments_patient_{patient.id}'])
+
+_UNKNOWN = object()
+
+@receiver(post_save, sender=Appointment)
+def update_day_slots(sender, instance, created, **kwargs):
+    
+    #Update the materialized slots of the time the appointment left and the time it took.
+    
+    old_slot = None if created else getattr(instance, '_loaded_slot', _UNKNOWN)
+    new_slot = instance.booked_slot()
+    
+    if old_slot is _UNKNOWN:
+        # Saved without being loaded first; recompute the whole day instead
+        materialize_day_slots([instance.doctor_id], instance.appointment_date, instance.appointment_date)
+    elif old_slot != new_slot:
+        if old_slot:
+            release_slot(*old_slot)
+        if new_slot:
+            occupy_slot(*new_slot)
+    instance._loaded_slot = new_slot
+
+@receiver(post_delete, sender=Appointment)
+def release_day_slot(sender, instance, **kwargs):
+    slot = getattr(instance, '_loaded_slot', instance.booked_slot())
+    if slot:
+        release_slot(*slot)
+
+@receiver(status_changed, sender=Appointment)
+def apply_status_change(sender, appointments, status, **kwargs):
+    
+    #Status transitions update rows without post_save: invalidate the caches
+    #they feed and free the slots of cancelled appointments, each day once.
+    
+    invalidate_cache_namespace_on_commit(*{
+        namespace
+        for appointment in appointments
+        for namespace in appointment_cache_namespaces(appointment)
+    })
+    if status == 'CANCELLED':
+        release_slots(
+            (appointment.doctor_id, appointment.appointment_date, appointment.appointment_time, appointment.end_time)
+            for appointment in appointments
+        )
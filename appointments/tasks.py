@@ -1,15 +1,13 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import send_mail, send_mass_mail
 from django.utils import timezone
 from django.core.cache import cache
 from django.db.models import Count, Q
 from django.conf import settings
 import logging
-import json
 from datetime import timedelta
 
 from .models import Appointment
-from healthcare.utils import invalidate_cache_pattern
 
 logger = logging.getLogger('django')
 
@@ -54,16 +52,8 @@ def process_appointment_status_updates():
         status__in=['SCHEDULED', 'CONFIRMED']
     )
     
-    updated_count = 0
-    for appointment in past_appointments:
-        appointment.status = 'NO_SHOW'
-        appointment.save()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'appointments_user_{appointment.patient.user.id}_*')
-        invalidate_cache_pattern(f'appointments_user_{appointment.doctor.user.id}_*')
-        
-        updated_count += 1
+    # One conditional UPDATE; each affected cache namespace is invalidated once
+    updated_count = len(past_appointments.transition('NO_SHOW'))
     
     return f"Updated {updated_count} past appointments to NO_SHOW"
 
@@ -98,7 +88,8 @@ def generate_appointment_analytics():
         'generated_at': timezone.now().isoformat()
     }
     
-    cache.set('appointment_analytics', json.dumps(analytics), timeout=86400)  # Cache for 24 hours
+    # Stored as a dict; the cache backend pickles and, above its threshold, compresses it
+    cache.set('appointment_analytics', analytics, timeout=86400)  # Cache for 24 hours
     
     return "Generated appointment analytics"
 
@@ -153,3 +144,34 @@ def notify_patient_of_appointment_status_change(appointment_id, old_status, new_
     except Exception as e:
         logger.error(f"Failed to notify patient of status change for appointment {appointment_id}: {str(e)}")
         return f"Failed to notify patient: {str(e)}"
+
+@shared_task
+def notify_patients_of_appointment_status_changes(changes):
+    """Notify patients of many appointment status changes, as (appointment id, old status, new status)"""
+    appointments = Appointment.objects.select_related('patient__user', 'doctor__user').in_bulk(
+        [appointment_id for appointment_id, old_status, new_status in changes]
+    )
+    
+    messages = []
+    for appointment_id, old_status, new_status in changes:
+        appointment = appointments.get(appointment_id)
+        # Skip appointments deleted or moved on since, as the single notification does
+        if appointment is None or appointment.status != new_status:
+            continue
+        messages.append((
+            f'Appointment Status Updated: {appointment.get_status_display()}',
+            f'Dear {appointment.patient.user.first_name}, '
+            f'your appointment with Dr. {appointment.doctor.user.first_name} {appointment.doctor.user.last_name} '
+            f'on {appointment.appointment_date} at {appointment.appointment_time} '
+            f'has been updated from {old_status} to {appointment.get_status_display()}.',
+            'noreply@healthcare.com',
+            [appointment.patient.user.email],
+        ))
+    
+    # One connection to the mail server for the whole batch
+    try:
+        sent = send_mass_mail(messages, fail_silently=False)
+    except Exception as e:
+        logger.error(f"Failed to notify patients of {len(messages)} status changes: {str(e)}")
+        return f"Failed to notify patients: {str(e)}"
+    return f"Notified patients of {sent} status changes, skipped {len(changes) - len(messages)}"
@@ -2,14 +2,21 @@ from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 from rest_framework import status
 import json
+from unittest.mock import patch
 from datetime import timedelta, time  
 
 from .models import Appointment
 from patients.models import Patient
-from doctors.models import Doctor, DoctorSchedule
+from doctors.models import Doctor, DoctorSchedule, DoctorDaySlots
+from doctors.availability import ensure_day_slots_horizon
+from healthcare.utils import get_cache_generation, invalidate_cache_namespace_on_commit
 
 class AppointmentModelTests(TestCase):
     def setUp(self):
@@ -316,9 +323,48 @@ class AppointmentModelTests(TestCase):
         self.appointment.status = 'COMPLETED'
         self.appointment.save()
         self.assertEqual(self.appointment.status, 'COMPLETED')
+    
+    def test_status_only_save_skips_scheduling_checks(self):
+        """Test that saving a loaded appointment's status runs no schedule or overlap queries"""
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        appointment.status = 'CONFIRMED'
+        appointment.notes = 'Confirmed by phone'
+        self.assertFalse(appointment.is_rescheduled())
+        with self.assertNumQueries(1):
+            appointment.save()
+        
+        appointment.appointment_time = time(11, 0)
+        self.assertEqual(appointment.changed_fields(), {'appointment_time'})
+        self.assertTrue(appointment.is_rescheduled())
+    
+    def test_transition_is_compare_and_set(self):
+        """Test that a transition only applies while the stored status allows it"""
+        stale = Appointment.objects.get(pk=self.appointment.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.appointment.transition('CONFIRMED'))
+        self.assertTrue(self.appointment.transition('COMPLETED'))
+        
+        # Loaded as SCHEDULED, but the row has moved on
+        self.assertFalse(stale.transition('CANCELLED'))
+        self.assertEqual(stale.status, 'SCHEDULED')
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).status, 'COMPLETED')
+    
+    def test_past_appointments_marked_no_show(self):
+        """Test that the status task moves past appointments to NO_SHOW without validating them"""
+        from .tasks import process_appointment_status_updates
+        
+        last_monday = self.next_monday - timedelta(days=7)
+        Appointment.objects.filter(pk=self.appointment.pk).update(appointment_date=last_monday)
+        process_appointment_status_updates()
+        
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).status, 'NO_SHOW')
+        # Final statuses are kept
+        self.assertEqual(Appointment.objects.filter(pk=self.appointment.pk).transition('CANCELLED'), [])
 
 class AppointmentAPITests(APITestCase):
     def setUp(self):
+        cache.clear()
+        
         # Create test users
         self.patient_user = User.objects.create_user(
             username='testpatient',
@@ -442,6 +488,26 @@ class AppointmentAPITests(APITestCase):
         self.appointment.refresh_from_db()
         self.assertEqual(self.appointment.status, 'CANCELLED')
     
+    def test_update_follows_status_transitions(self):
+        """Test that PATCHing the status only allows the moves of Appointment.TRANSITIONS"""
+        self.client.force_authenticate(user=self.doctor_user)
+        response = self.client.patch(self.detail_url, {'status': 'CONFIRMED', 'notes': 'By phone'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.appointment.refresh_from_db()
+        self.assertEqual((self.appointment.status, self.appointment.notes), ('CONFIRMED', 'By phone'))
+        
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='COMPLETED')
+        response = self.client.patch(self.detail_url, {'status': 'SCHEDULED'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).status, 'COMPLETED')
+        
+        # A status changed by another request since the appointment was read
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='SCHEDULED')
+        with patch.object(Appointment, 'transition', return_value=False):
+            response = self.client.patch(self.detail_url, {'status': 'CANCELLED', 'notes': 'Lost'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).notes, 'By phone')
+    
     def test_create_appointment(self):
         """Test creating a new appointment"""
         self.client.force_authenticate(user=self.patient_user)
@@ -480,3 +546,626 @@ class AppointmentAPITests(APITestCase):
         self.assertEqual(Appointment.objects.count(), 2)
         new_appointment = Appointment.objects.get(appointment_date=next_tuesday)
         self.assertEqual(new_appointment.reason, 'New test appointment')
+    
+    def test_booking_past_schedule_end_is_rejected(self):
+        """Test that an appointment has to end by the end of the schedule's last slot"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '17:00:00',
+            'duration_minutes': 120,
+            'reason': 'Runs late'
+        }
+        
+        response = self.client.post(self.list_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("outside doctor's schedule", str(response.data))
+        response = self.client.post(reverse('appointment-bulk-create'), {'appointments': [data]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("outside doctor's schedule", str(response.data))
+        with self.assertRaises(ValidationError):
+            Appointment.objects.create(
+                patient=self.patient,
+                doctor=self.doctor,
+                appointment_date=self.next_monday,
+                appointment_time=time(17, 0),
+                duration_minutes=120,
+                reason='Runs late'
+            )
+        
+        # The last slot starts at the schedule's end time
+        response = self.client.post(self.list_url, dict(data, duration_minutes=30), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def test_list_response_is_cached(self):
+        """Test that a repeated list request is served from the response cache"""
+        self.client.force_authenticate(user=self.patient_user)
+        first = self.client.get(self.list_url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_url)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json(), first.json())
+    
+    def test_cached_response_invalidated_by_status_change(self):
+        """Test that a status change invalidates the cached list of both parties"""
+        self.client.force_authenticate(user=self.patient_user)
+        self.client.get(self.list_url)
+        
+        self.client.force_authenticate(user=self.doctor_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.confirm_url)
+        
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.json()['results'][0]['status'], 'CONFIRMED')
+    
+    def test_cached_response_follows_profile_edits(self):
+        """Test that editing a doctor's or patient's user or profile invalidates the lists nesting them"""
+        # Flush the invalidations setUp queued, which never committed
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_cache_namespace_on_commit()
+        self.client.force_authenticate(user=self.patient_user)
+        self.client.get(self.list_url)
+        self.client.force_authenticate(user=self.doctor_user)
+        self.client.get(self.list_url)
+        self.client.get(reverse('doctor-list'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor_user.last_name = 'Renamed'
+            self.doctor_user.save()
+            self.patient.phone_number = '+1987654321'
+            self.patient.save()
+        
+        response = self.client.get(reverse('doctor-list'))
+        self.assertEqual(response.json()['results'][0]['user']['last_name'], 'Renamed')
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.json()['results'][0]['patient']['phone_number'], '+1987654321')
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.json()['results'][0]['doctor']['user']['last_name'], 'Renamed')
+        
+        # Logging in only touches last_login
+        generation = get_cache_generation('doctors')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor_user.last_login = timezone.now()
+            self.doctor_user.save(update_fields=['last_login'])
+        self.assertEqual(get_cache_generation('doctors'), generation)
+    
+    def test_invalidation_waits_for_commit(self):
+        """Test that saving an appointment invalidates its namespaces only after commit"""
+        namespace = f'appointments_doctor_{self.doctor.id}'
+        generation = get_cache_generation(namespace)
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.appointment.status = 'CONFIRMED'
+            self.appointment.save()
+            self.assertEqual(get_cache_generation(namespace), generation)
+        
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_cache_generation(namespace), generation + 1)
+    
+    def test_bulk_create_invalidates_each_namespace_once(self):
+        """Test that invalidations from one bulk create are coalesced"""
+        self.client.force_authenticate(user=self.patient_user)
+        namespaces = [
+            f'appointments_patient_{self.patient.id}',
+            f'appointments_doctor_{self.doctor.id}',
+            f'available_slots_doctor_{self.doctor.id}',
+        ]
+        generations = [get_cache_generation(namespace) for namespace in namespaces]
+        
+        data = {'appointments': [
+            {
+                'patient': self.patient.id,
+                'doctor': self.doctor.id,
+                'appointment_date': self.next_monday.isoformat(),
+                'appointment_time': f'{hour}:00:00',
+                'reason': 'Bulk appointment'
+            }
+            for hour in (11, 12, 13)
+        ]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('appointment-bulk-create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        self.assertEqual(
+            [get_cache_generation(namespace) for namespace in namespaces],
+            [generation + 1 for generation in generations]
+        )
+    
+    def test_query_parameter_order_shares_cache_entry(self):
+        """Test that reordered query parameters hit the same cache entry"""
+        self.client.force_authenticate(user=self.patient_user)
+        self.client.get(self.list_url, {'ordering': 'created_at', 'search': 'Test'})
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.list_url}?search=Test&ordering=created_at')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_unknown_query_parameters_share_cache_entry(self):
+        """Test that junk query parameters cannot mint new cache entries"""
+        self.client.force_authenticate(user=self.patient_user)
+        self.client.get(self.list_url)
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url, {'cachebuster': '12345'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_conditional_get_returns_not_modified(self):
+        """Test that a matching If-None-Match is answered with 304 without any query"""
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.get(self.list_url)
+        etag = response['ETag']
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_conditional_get_after_change(self):
+        """Test that the ETag changes once the user's appointments change"""
+        self.client.force_authenticate(user=self.patient_user)
+        etag = self.client.get(self.list_url)['ETag']
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.cancel_url)
+        
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_booked_slot_returns_conflict(self):
+        """Test that booking a time that is already taken answers 409"""
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.post(self.list_url, {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '09:45:00',
+            'reason': 'Overlaps the 10:00 appointment'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['error'], 'Conflict')
+    
+    def test_hold_reserves_slot_for_its_holder(self):
+        """Test that a hold keeps other patients off a slot until its holder books it"""
+        other_user = User.objects.create_user(username='otherpatient', password='testpass123')
+        other_patient = Patient.objects.create(
+            user=other_user,
+            date_of_birth='1990-01-01',
+            gender='F',
+            phone_number='+1234567890',
+            address='456 Test St',
+            emergency_contact_name='Emergency Contact',
+            emergency_contact_phone='+0987654321'
+        )
+        slot = {
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '11:00:00',
+        }
+        
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.post(reverse('appointment-hold'), slot, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        hold_token = response.data['hold_token']
+        
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(reverse('appointment-hold'), slot, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.post(self.list_url, dict(slot, patient=other_patient.id, reason='Checkup'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        self.client.force_authenticate(user=self.patient_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.list_url,
+                dict(slot, patient=self.patient.id, reason='Checkup', hold_token=hold_token),
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        # Released once booked; the appointment itself now blocks the slot
+        self.assertEqual(cache.get(f'slot_hold:{self.doctor.id}:{self.next_monday.isoformat()}:4'), None)
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(reverse('appointment-hold'), slot, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+    
+    def test_lost_race_returns_conflict(self):
+        """Test that a booking losing the race to the database constraint answers 409, not 500"""
+        self.client.force_authenticate(user=self.patient_user)
+        # As if the 10:00 appointment committed after every check had run
+        with patch.object(Appointment, 'overlapping', return_value=Appointment.objects.none()):
+            response = self.client.post(self.list_url, {
+                'patient': self.patient.id,
+                'doctor': self.doctor.id,
+                'appointment_date': self.next_monday.isoformat(),
+                'appointment_time': '10:00:00',
+                'reason': 'Same time'
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Appointment.objects.count(), 1)
+    
+    def bulk_data(self, day, times, **extra):
+        return {'appointments': [
+            dict({
+                'doctor': self.doctor.id,
+                'appointment_date': day.isoformat(),
+                'appointment_time': appointment_time,
+                'reason': 'Bulk appointment'
+            }, **extra)
+            for appointment_time in times
+        ]}
+    
+    def test_bulk_create_reports_errors_per_appointment(self):
+        """Test that a bulk create saves nothing and reports each invalid appointment"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = self.bulk_data(self.next_monday, ['08:00:00', '11:00:00', '11:30:00'], duration_minutes=60)
+        data['appointments'].append(dict(data['appointments'][1], doctor=0))
+        
+        response = self.client.post(reverse('appointment-bulk-create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data['appointments']
+        self.assertEqual(len(errors), 4)
+        self.assertIn('non_field_errors', errors[0])
+        self.assertEqual(errors[1:3], [{}, {}])
+        self.assertIn('doctor', errors[3])
+        self.assertEqual(Appointment.objects.count(), 1)
+    
+    def test_bulk_create_conflicts_return_conflict(self):
+        """Test that clashes with a booking answer 409"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = self.bulk_data(self.next_monday, ['09:45:00', '11:00:00', '13:00:00'])
+        
+        response = self.client.post(reverse('appointment-bulk-create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        errors = response.data['appointments']
+        self.assertIn('already booked', errors[0]['non_field_errors'][0])
+        self.assertEqual(errors[1:], [{}, {}])
+        self.assertEqual(Appointment.objects.count(), 1)
+        
+        # The holds of the failed batch are gone
+        response = self.client.post(
+            reverse('appointment-bulk-create'), {'appointments': data['appointments'][1:]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def test_bulk_create_clashing_with_itself_is_invalid(self):
+        """Test that appointments of a batch overlapping each other answer 400 naming each other"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = self.bulk_data(self.next_monday, ['11:00:00', '11:30:00', '13:00:00', '13:00:00', '14:00:00'])
+        data['appointments'][0]['duration_minutes'] = 60
+        
+        response = self.client.post(reverse('appointment-bulk-create'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = [error.get('non_field_errors', [''])[0] for error in response.data['appointments']]
+        self.assertIn('overlaps appointment 1 ', errors[0])
+        self.assertIn('overlaps appointment 0 ', errors[1])
+        self.assertIn('overlaps appointment 3 ', errors[2])
+        self.assertIn('overlaps appointment 2 ', errors[3])
+        self.assertEqual(errors[4], '')
+        self.assertEqual(Appointment.objects.count(), 1)
+    
+    def test_bulk_create_updates_day_slots(self):
+        """Test that bulk-created appointments take their materialized slots"""
+        ensure_day_slots_horizon()
+        self.client.force_authenticate(user=self.patient_user)
+        day = self.next_monday + timedelta(days=7)
+        free_mask = DoctorDaySlots.objects.get(doctor=self.doctor, date=day).free_mask
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('appointment-bulk-create'), self.bulk_data(day, ['09:00:00', '12:00:00']), format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+        
+        # The 09:00 and 12:00 slots of the 09:00 grid
+        self.assertEqual(
+            DoctorDaySlots.objects.get(doctor=self.doctor, date=day).free_mask,
+            free_mask & ~(1 | 1 << 6)
+        )
+    
+    def test_bulk_create_query_count_is_constant(self):
+        """Test that the number of queries of a bulk create does not grow with its size"""
+        self.client.force_authenticate(user=self.patient_user)
+        
+        counts = []
+        for weeks, size in ((1, 2), (2, 12)):
+            day = self.next_monday + timedelta(weeks=weeks)
+            data = self.bulk_data(day, [f'{9 + i // 2:02d}:{30 * (i % 2):02d}:00' for i in range(size)])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('appointment-bulk-create'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries))
+        
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Appointment.objects.count(), 15)
+    
+    def test_bulk_transition_reports_each_appointment(self):
+        """Test moving many appointments at once with an outcome per id"""
+        second = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.next_monday,
+            appointment_time=time(11, 0),
+            reason='Second appointment'
+        )
+        done = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.next_monday,
+            appointment_time=time(12, 0),
+            status='COMPLETED',
+            reason='Done already'
+        )
+        ids = [self.appointment.id, second.id, done.id, 0, second.id]
+        
+        self.client.force_authenticate(user=self.doctor_user)
+        with patch('appointments.tasks.notify_patients_of_appointment_status_changes.delay') as notify:
+            response = self.client.post(
+                reverse('appointment-bulk-transition'), {'ids': ids, 'status': 'CONFIRMED'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], [self.appointment.id, second.id, done.id, 0])
+        self.assertEqual([result['updated'] for result in results], [True, True, False, False])
+        self.assertEqual(results[0]['previous_status'], 'SCHEDULED')
+        self.assertEqual(results[2]['status'], 'COMPLETED')
+        self.assertIn('error', results[3])
+        notify.assert_called_once_with([
+            (self.appointment.id, 'SCHEDULED', 'CONFIRMED'),
+            (second.id, 'SCHEDULED', 'CONFIRMED'),
+        ])
+        self.assertEqual(
+            list(Appointment.objects.order_by('appointment_time').values_list('status', flat=True)),
+            ['CONFIRMED', 'CONFIRMED', 'COMPLETED']
+        )
+    
+    def test_bulk_transition_is_scoped_to_user(self):
+        """Test that appointments of other doctors are reported as not found"""
+        other_user = User.objects.create_user(username='otherdoctor', password='testpass123')
+        Doctor.objects.create(
+            user=other_user,
+            specialization='GENERAL',
+            license_number='DOC654321',
+            phone_number='+1234567890'
+        )
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(
+            reverse('appointment-bulk-transition'), {'ids': [self.appointment.id], 'status': 'CANCELLED'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['error'], 'Not found.')
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'SCHEDULED')
+    
+    def test_patients_may_only_cancel_in_bulk(self):
+        """Test that patients cannot confirm or complete their own appointments in bulk"""
+        self.client.force_authenticate(user=self.patient_user)
+        url = reverse('appointment-bulk-transition')
+        for new_status in ('CONFIRMED', 'COMPLETED'):
+            response = self.client.post(url, {'ids': [self.appointment.id], 'status': new_status}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'SCHEDULED')
+        
+        response = self.client.post(url, {'ids': [self.appointment.id], 'status': 'CANCELLED'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 1)
+    
+    def test_batched_status_notifications(self):
+        """Test that one task mails every patient whose appointment moved"""
+        from django.core import mail
+        from .tasks import notify_patients_of_appointment_status_changes
+        
+        self.appointment.transition('CONFIRMED')
+        result = notify_patients_of_appointment_status_changes([
+            (self.appointment.id, 'SCHEDULED', 'CONFIRMED'),
+            (self.appointment.id, 'CONFIRMED', 'COMPLETED'),
+        ])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['patient@example.com'])
+        self.assertIn('skipped 1', result)
+    
+    def test_idempotency_key_replays_booking(self):
+        """Test that a retried booking with the same Idempotency-Key is replayed, not booked again"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '11:00:00',
+            'reason': 'Checkup'
+        }
+        response = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        with self.assertNumQueries(0):
+            replay = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(replay.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(replay.content), response.json())
+        self.assertEqual(Appointment.objects.count(), 2)
+        
+        # The same key for another request is refused
+        response = self.client.post(
+            self.list_url, dict(data, appointment_time='12:00:00'), format='json', HTTP_IDEMPOTENCY_KEY='retry-1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    def test_idempotency_key_not_kept_for_raised_errors(self):
+        """Test that a request that raised can be retried under the same key"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '10:00:00',
+            'reason': 'Taken'
+        }
+        response = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-2')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.get(pk=self.appointment.pk).transition('CANCELLED')
+        response = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def test_idempotency_key_replays_validation_errors(self):
+        """Test that an invalid booking is answered from the stored 400 when retried"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '20:00:00',
+            'reason': 'Too late'
+        }
+        response = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-6')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        with self.assertNumQueries(0):
+            replay = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-6')
+        self.assertEqual(replay.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), response.json())
+    
+    def test_idempotency_key_not_kept_for_conflicts(self):
+        """Test that a batch refused with 409 runs again when retried under the same key"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = self.bulk_data(self.next_monday, ['10:00:00', '11:00:00'])
+        url = reverse('appointment-bulk-create')
+        response = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-3')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.get(pk=self.appointment.pk).transition('CANCELLED')
+        response = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-3')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+    
+    def expire_idempotency_claims(self, *claims):
+        """Patch the cache so idempotency claims read back as expired and add() answers `claims` in turn"""
+        claims, real_add, real_get = iter(claims), cache.add, cache.get
+        
+        def add(key, *args, **kwargs):
+            return next(claims) if key.startswith('idempotency:') else real_add(key, *args, **kwargs)
+        
+        def get(key, *args, **kwargs):
+            return None if key.startswith('idempotency:') else real_get(key, *args, **kwargs)
+        
+        return patch.multiple(cache, add=add, get=get)
+    
+    def test_idempotency_key_claim_expiring_mid_check(self):
+        """Test that a claim that expired between add and get is claimed again, never skipped"""
+        self.client.force_authenticate(user=self.patient_user)
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.next_monday.isoformat(),
+            'appointment_time': '11:00:00',
+            'reason': 'Checkup'
+        }
+        with self.expire_idempotency_claims(False, True):
+            response = self.client.post(self.list_url, data, format='json', HTTP_IDEMPOTENCY_KEY='retry-4')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        # Lost to another request both times: treated as still in progress
+        with self.expire_idempotency_claims(False, False):
+            response = self.client.post(
+                self.list_url, dict(data, appointment_time='12:00:00'), format='json', HTTP_IDEMPOTENCY_KEY='retry-5'
+            )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Appointment.objects.count(), 2)
+    
+    def book_mondays(self, count):
+        # One appointment on each of the `count` Mondays after next Monday
+        for week in range(1, count + 1):
+            Appointment.objects.create(
+                patient=self.patient,
+                doctor=self.doctor,
+                appointment_date=self.next_monday + timedelta(weeks=week),
+                appointment_time=time(10, 0),
+                reason='Weekly checkup'
+            )
+    
+    def test_appointment_pages_cost_constant_queries(self):
+        """Test that listing appointments does not query per appointment"""
+        urls = [
+            self.list_url,
+            reverse('appointment-upcoming'),
+            reverse('appointment-past'),
+            reverse('appointment-today'),
+            reverse('doctor-appointments', args=[self.doctor.id]),
+        ]
+        
+        def count_queries():
+            counts = []
+            for user_id in (self.patient_user.id, self.doctor_user.id):
+                for url in urls:
+                    cache.clear()
+                    # A fresh user, so profile lookups count as in a real request
+                    self.client.force_authenticate(user=User.objects.get(pk=user_id))
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    counts.append(len(queries))
+            return counts
+        
+        one_appointment = count_queries()
+        self.book_mondays(9)
+        self.assertEqual(count_queries(), one_appointment)
+        # Profile lookups, a page count and one JOINed page query
+        self.assertLessEqual(max(one_appointment), 5)
+    
+    def test_appointment_detail_query_budget(self):
+        """Test that an appointment with its patient, doctor and their users is read in one query"""
+        self.client.force_authenticate(user=User.objects.get(pk=self.patient_user.id))
+        # The patient profile, then the appointment
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['doctor']['user']['first_name'], 'Test')
+        self.assertEqual(response.data['patient']['full_name'], 'Test Patient')
+    
+    def test_sparse_fieldsets(self):
+        """Test that ?fields= renders and reads only the requested fields"""
+        self.client.force_authenticate(user=self.patient_user)
+        full = self.client.get(self.detail_url)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url, {'fields': 'id,status'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.appointment.id, 'status': 'SCHEDULED'})
+        # The appointment is read without JOINing its patient or doctor
+        self.assertNotIn('JOIN', queries[-1]['sql'])
+        self.assertNotIn('reason', queries[-1]['sql'])
+        
+        # Dotted names pick fields of nested serializers
+        response = self.client.get(self.detail_url, {'fields': 'id,patient.full_name'})
+        self.assertEqual(response.data, {'id': self.appointment.id, 'patient': {'full_name': 'Test Patient'}})
+        
+        # Each field set is cached on its own
+        self.assertEqual(self.client.get(self.detail_url).json(), full.json())
+    
+    def test_opt_in_expansion(self):
+        """Test that ?expand= nests only the requested relations"""
+        self.client.force_authenticate(user=self.patient_user)
+        
+        response = self.client.get(self.detail_url, {'expand': ''})
+        self.assertEqual(response.data['patient'], self.patient.id)
+        self.assertEqual(response.data['doctor'], self.doctor.id)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url, {'expand': 'doctor'})
+        self.assertEqual(response.data['patient'], self.patient.id)
+        self.assertEqual(response.data['doctor']['user']['first_name'], 'Test')
+        self.assertNotIn('patients_patient', queries[-1]['sql'])
@@ -175,12 +175,12 @@ def appointment_list(request):
     if hasattr(request.user, 'patient'):
         # User is a patient
         patient = request.user.patient
-        upcoming_appointments = Appointment.objects.filter(
+        upcoming_appointments = Appointment.objects.for_display().filter(
             patient=patient,
             appointment_date__gte=timezone.now().date()
         ).order_by('appointment_date', 'appointment_time')
         
-        past_appointments = Appointment.objects.filter(
+        past_appointments = Appointment.objects.for_display().filter(
             patient=patient,
             appointment_date__lt=timezone.now().date()
         ).order_by('-appointment_date', '-appointment_time')
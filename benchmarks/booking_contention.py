@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Load test concurrent bookings through the appointments API: every round,
+a group of patients books overlapping times of the same doctor at once.
+
+Usage: python benchmarks/booking_contention.py [--bookers N] [--rounds N]
+
+Runs against a throwaway SQLite database in WAL mode and the configured
+cache (set REDIS_CACHE_URL to exercise holds on Redis). Exits non-zero if
+any time was double booked or any request failed with a server error.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcare.settings')
+
+
+def setup(database):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': database,
+            'OPTIONS': {
+                'timeout': 30,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL;',
+            },
+        }
+    }
+    settings.ALLOWED_HOSTS = ['*']
+    settings.CELERY_BROKER_URL = 'memory://'
+    settings.CELERY_RESULT_BACKEND = 'cache+memory://'
+    settings.REST_FRAMEWORK = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_CLASSES=[])
+    django.setup()
+    # Conflicts are expected here; only server errors are worth logging
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def create_fixtures(bookers):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from doctors.models import Doctor, DoctorSchedule
+    from patients.models import Patient
+
+    doctor = Doctor.objects.create(
+        user=User.objects.create_user(username='loaddoctor', password='LoadTest123!'),
+        specialization='GENERAL',
+        license_number='LOAD000001',
+        phone_number='+1234567890'
+    )
+    for day_of_week in range(7):
+        DoctorSchedule.objects.create(doctor=doctor, day_of_week=day_of_week, start_time='08:00', end_time='18:00')
+
+    patients = [
+        Patient.objects.create(
+            user=User.objects.create_user(username=f'loadpatient{i}', password='LoadTest123!'),
+            date_of_birth='1990-01-01',
+            gender='O',
+            phone_number='+1234567890',
+            address='1 Load Street',
+            emergency_contact_name='Contact',
+            emergency_contact_phone='+1234567890'
+        )
+        for i in range(bookers)
+    ]
+    return doctor, patients, timezone.now().date() + timedelta(days=1)
+
+
+def run_round(doctor, patients, day, start_hour):
+    """Every patient books one hour at once, half of them half an hour later."""
+    from django.db import connection
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    barrier = threading.Barrier(len(patients))
+    statuses = []
+
+    def book(patient, appointment_time):
+        client = APIClient()
+        client.force_authenticate(user=patient.user)
+        barrier.wait()
+        try:
+            response = client.post(reverse('appointment-list'), {
+                'patient': patient.id,
+                'doctor': doctor.id,
+                'appointment_date': day.isoformat(),
+                'appointment_time': appointment_time,
+                'duration_minutes': 60,
+                'reason': 'Load test'
+            }, format='json')
+            statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=book, args=(patient, f'{start_hour:02d}:{30 * (i % 2):02d}'))
+        for i, patient in enumerate(patients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def double_bookings(doctor):
+    """Pairs of active appointments of the doctor that overlap."""
+    from appointments.models import Appointment
+
+    overlaps = 0
+    for appointment in Appointment.objects.filter(doctor=doctor).exclude(status='CANCELLED'):
+        overlaps += Appointment.overlapping(
+            doctor.id, appointment.appointment_date, appointment.appointment_time, appointment.end_time
+        ).exclude(pk=appointment.pk).count()
+    return overlaps // 2
+
+
+def run_benchmark(bookers, rounds):
+    doctor, patients, day = create_fixtures(bookers)
+    statuses = Counter()
+
+    started = time.perf_counter()
+    for round_number in range(rounds):
+        # Rounds take turns over the working hours of consecutive days
+        round_day = day + timedelta(days=round_number // 9)
+        statuses.update(run_round(doctor, patients, round_day, 8 + round_number % 9))
+    elapsed = time.perf_counter() - started
+
+    requests = sum(statuses.values())
+    print(f"{requests} bookings by {bookers} concurrent patients in {rounds} rounds, "
+          f"{elapsed:.2f}s ({requests / elapsed:.0f} requests/s)")
+    for code, count in sorted(statuses.items()):
+        print(f"  HTTP {code}: {count}")
+    overlaps = double_bookings(doctor)
+    print(f"  double bookings: {overlaps}")
+
+    server_errors = sum(count for code, count in statuses.items() if code >= 500)
+    return overlaps == 0 and server_errors == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bookers', type=int, default=16, help='Concurrent patients per round')
+    parser.add_argument('--rounds', type=int, default=20, help='Rounds of concurrent bookings')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'booking_contention.sqlite3'))
+        sys.exit(0 if run_benchmark(args.bookers, args.rounds) else 1)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Benchmark bulk appointment booking: the set-based path of appointments/bulk.py
+against validating and saving the appointments one by one, as a loop over
+the single booking endpoint's serializer would.
+
+Usage: python benchmarks/bulk_appointments.py [--sizes 10 100 1000] [--doctors N]
+
+Runs against a throwaway SQLite database in WAL mode and the configured
+cache. Reports the queries and the time each batch takes.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcare.settings')
+
+# Appointments per doctor and day: 08:00 to 18:00 in 30 minute slots
+SLOTS_PER_DAY = 20
+
+
+def setup(database):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': database,
+            'OPTIONS': {'init_command': 'PRAGMA journal_mode=WAL;'},
+        }
+    }
+    settings.CELERY_BROKER_URL = 'memory://'
+    settings.CELERY_RESULT_BACKEND = 'cache+memory://'
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def create_fixtures(doctors):
+    from django.contrib.auth.models import User
+    from doctors.availability import ensure_day_slots_horizon
+    from doctors.models import Doctor, DoctorSchedule
+    from patients.models import Patient
+
+    created = []
+    for i in range(doctors):
+        doctor = Doctor.objects.create(
+            user=User.objects.create_user(username=f'benchdoctor{i}', password='Bench123!'),
+            specialization='GENERAL',
+            license_number=f'BENCH{i:05d}',
+            phone_number='+1234567890'
+        )
+        DoctorSchedule.objects.bulk_create(
+            DoctorSchedule(doctor=doctor, day_of_week=day_of_week, start_time='08:00', end_time='18:00')
+            for day_of_week in range(7)
+        )
+        created.append(doctor)
+    ensure_day_slots_horizon()
+
+    patient = Patient.objects.create(
+        user=User.objects.create_user(username='benchpatient', password='Bench123!'),
+        date_of_birth='1990-01-01',
+        gender='O',
+        phone_number='+1234567890',
+        address='1 Bench Street',
+        emergency_contact_name='Contact',
+        emergency_contact_phone='+1234567890'
+    )
+    return created, patient
+
+
+def batch(doctors, first_day, size):
+    """`size` appointments spread over the doctors from first_day on, and the days they take"""
+    items = []
+    for i in range(size):
+        slot = i // len(doctors)
+        minutes = 8 * 60 + 30 * (slot % SLOTS_PER_DAY)
+        items.append({
+            'doctor': doctors[i % len(doctors)].id,
+            'appointment_date': first_day + timedelta(days=slot // SLOTS_PER_DAY),
+            'appointment_time': f'{minutes // 60:02d}:{minutes % 60:02d}',
+            'reason': 'Benchmark'
+        })
+    days = -(-size // (len(doctors) * SLOTS_PER_DAY))
+    return items, days
+
+
+def book_one_by_one(patient, items):
+    from django.db import transaction
+    from appointments.holds import slot_hold
+    from appointments.serializers import AppointmentCreateSerializer, appointment_end_time
+
+    with transaction.atomic():
+        for item in items:
+            serializer = AppointmentCreateSerializer(data=dict(item, patient=patient.id))
+            serializer.is_valid(raise_exception=True)
+            data = serializer.validated_data
+            with slot_hold(data['doctor'], data['appointment_date'], data['appointment_time'], appointment_end_time(data)):
+                serializer.save(patient=patient)
+
+
+def book_as_set(patient, items):
+    from appointments.bulk import book_appointments
+    from appointments.serializers import AppointmentBulkCreateSerializer
+
+    serializer = AppointmentBulkCreateSerializer(data={'appointments': items})
+    serializer.is_valid(raise_exception=True)
+    appointments, errors, conflict = book_appointments(patient, serializer.validated_data['appointments'])
+    if any(errors):
+        raise RuntimeError(f'Bulk booking failed: {errors}')
+
+
+def run_benchmark(sizes, doctor_count):
+    from django.db import connection
+    from django.utils import timezone
+
+    doctors, patient = create_fixtures(doctor_count)
+    day = timezone.now().date() + timedelta(days=1)
+
+    print(f"{'items':>6} {'path':<12} {'queries':>8} {'seconds':>9} {'items/s':>9}")
+    for size in sizes:
+        for name, book in (('one by one', book_one_by_one), ('set-based', book_as_set)):
+            items, days = batch(doctors, day, size)
+            day += timedelta(days=days)
+            queries = []
+            with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                started = time.perf_counter()
+                book(patient, items)
+                elapsed = time.perf_counter() - started
+            print(f"{size:>6} {name:<12} {len(queries):>8} {elapsed:>9.3f} {size / elapsed:>9.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Appointments per batch')
+    parser.add_argument('--doctors', type=int, default=10, help='Doctors the appointments are spread over')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'bulk_appointments.sqlite3'))
+        run_benchmark(args.sizes, args.doctors)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Benchmark bytes per cache entry and encode/decode latency of the cache
+compression in healthcare/cache.py.
+
+Usage: python benchmarks/cache_compression.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def doctor(i):
+    return {
+        'id': i,
+        'user': {
+            'id': 1000 + i,
+            'username': f'doctor{i}',
+            'first_name': f'First{i}',
+            'last_name': f'Last{i}',
+            'email': f'doctor{i}@example.com',
+        },
+        'specialization': ['GENERAL', 'CARDIOLOGY', 'DERMATOLOGY', 'PEDIATRICS'][i % 4],
+        'license_number': f'DOC{i:06d}',
+        'phone_number': f'+1555{i:07d}',
+        'years_of_experience': i % 30,
+        'consultation_fee': f'{100 + i % 50}.00',
+        'bio': 'Board certified physician with a focus on preventive care.',
+        'created_at': '2025-01-01T09:00:00Z',
+        'updated_at': '2025-01-01T09:00:00Z',
+    }
+
+
+def patient(i):
+    return {
+        'id': i,
+        'user': {
+            'id': 5000 + i,
+            'username': f'patient{i}',
+            'email': f'patient{i}@example.com',
+            'first_name': f'First{i}',
+            'last_name': f'Last{i}',
+        },
+        'full_name': f'First{i} Last{i}',
+        'date_of_birth': '1990-01-01',
+        'gender': 'F',
+        'phone_number': f'+1666{i:07d}',
+        'address': f'{i} Main Street',
+        'emergency_contact_name': 'Emergency Contact',
+        'emergency_contact_phone': '+15550000000',
+        'insurance_provider': 'Test Insurance',
+        'insurance_policy_number': f'POL{i:06d}',
+        'created_at': '2025-01-01T09:00:00Z',
+        'updated_at': '2025-01-01T09:00:00Z',
+    }
+
+
+def page(results):
+    return {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+
+def payloads():
+    """Representative cached values, as the cache layer stores them."""
+    appointments = [
+        {
+            'id': i,
+            'patient': patient(i % 7),
+            'doctor': doctor(i % 5),
+            'status_display': 'Scheduled',
+            'appointment_date': '2025-06-02',
+            'appointment_time': f'{9 + i % 8:02d}:00:00',
+            'status': 'SCHEDULED',
+            'reason': 'Follow-up visit',
+            'notes': '',
+            'created_at': '2025-05-01T09:00:00Z',
+            'updated_at': '2025-05-01T09:00:00Z',
+        }
+        for i in range(20)
+    ]
+    analytics = {
+        'status_counts': {'SCHEDULED': 1200, 'CONFIRMED': 800, 'COMPLETED': 5400, 'CANCELLED': 300, 'NO_SHOW': 90},
+        'specialization_counts': {'General Practice': 3000, 'Cardiology': 1500, 'Dermatology': 1200, 'Pediatrics': 2090},
+        'day_counts': {day: 1100 for day in ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']},
+        'total_appointments': 7790,
+        'generated_at': '2025-06-01T00:00:00Z',
+    }
+    return {
+        'generation counter': 1700000000000,
+        'analytics dict': analytics,
+        'doctor detail (JSON)': json.dumps(doctor(1)).encode(),
+        'doctor list page (JSON)': json.dumps(page([doctor(i) for i in range(20)])).encode(),
+        'appointment list page (JSON)': json.dumps(page(appointments)).encode(),
+    }
+
+
+def encode(value, level):
+    pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return pickled if level is None else zlib.compress(pickled, level)
+
+
+def decode(data, level):
+    return pickle.loads(data if level is None else zlib.decompress(data))
+
+
+def run_benchmark(repeat):
+    """Print size and round-trip latency per payload and compression level."""
+    levels = [None, 1, 6, 9]
+    header = f"{'payload':<30} {'level':>5} {'bytes':>8} {'ratio':>6} {'encode us':>10} {'decode us':>10}"
+    print(header)
+    print('-' * len(header))
+
+    for name, value in payloads().items():
+        raw_size = len(encode(value, None))
+        for level in levels:
+            data = encode(value, level)
+            encode_us = timeit.timeit(lambda: encode(value, level), number=repeat) / repeat * 1e6
+            decode_us = timeit.timeit(lambda: decode(data, level), number=repeat) / repeat * 1e6
+            print(f"{name:<30} {level if level is not None else '-':>5} {len(data):>8} "
+                  f"{raw_size / len(data):>6.1f} {encode_us:>10.1f} {decode_us:>10.1f}")
+        print()
+
+    print("Values below CACHE_COMPRESS_MIN_LENGTH (1024 bytes by default) are stored uncompressed.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000, help='Iterations per measurement')
+    args = parser.parse_args()
+
+    run_benchmark(args.repeat)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Benchmark JSON rendering and parsing of the appointment list payload: DRF's
+JSONRenderer and JSONParser against healthcare.renderers' orjson ones.
+
+Usage: python benchmarks/json_rendering.py [--sizes 100 1000 10000] [--repeat N]
+
+Uses the fixtures of benchmarks/list_serialization.py on a throwaway SQLite
+database. Serializes the appointments as the list endpoints do, then times
+rendering the result with each renderer and parsing it back with each
+parser, best of --repeat runs.
+"""
+import argparse
+import os
+import tempfile
+from io import BytesIO
+
+from list_serialization import best_of, create_fixtures, setup
+
+
+def run_benchmark(sizes, repeat):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from appointments.models import Appointment
+    from appointments.serializers import AppointmentSerializer
+    from healthcare.renderers import ORJSONParser, ORJSONRenderer
+    from healthcare.serializers import values_renderer
+
+    create_fixtures(max(sizes))
+    columns, represent = values_renderer(AppointmentSerializer())
+
+    print(f"{'rows':>6} {'serialize s':>12} {'json s':>8} {'orjson s':>9} {'render':>7} {'parse':>7} {'total':>7}")
+    for size in sizes:
+        rows = Appointment.objects.order_by('id')[:size].values_list(*columns)
+        serialize_time, data = best_of(repeat, lambda: [represent(row) for row in rows])
+
+        json_time, rendered = best_of(repeat, lambda: JSONRenderer().render(data))
+        orjson_time, fast_rendered = best_of(repeat, lambda: ORJSONRenderer().render(data))
+        if fast_rendered != rendered:
+            raise RuntimeError('ORJSONRenderer renders differently')
+
+        json_parse_time, _ = best_of(repeat, lambda: JSONParser().parse(BytesIO(rendered)))
+        orjson_parse_time, _ = best_of(repeat, lambda: ORJSONParser().parse(BytesIO(rendered)))
+
+        print(
+            f"{size:>6} {serialize_time:>12.4f} {json_time:>8.4f} {orjson_time:>9.4f}"
+            f" {json_time / orjson_time:>6.1f}x {json_parse_time / orjson_parse_time:>6.1f}x"
+            f" {(serialize_time + json_time) / (serialize_time + orjson_time):>6.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Appointments in the payload')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'json_rendering.sqlite3'))
+        run_benchmark(args.sizes, args.repeat)
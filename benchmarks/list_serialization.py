@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Benchmark list serialization: the DRF serializers of the doctor, appointment
+and medical record lists against rendering the same rows straight from
+values_list() with healthcare.serializers.values_renderer.
+
+Usage: python benchmarks/list_serialization.py [--sizes 100 1000 10000] [--repeat N]
+
+Runs against a throwaway SQLite database. Times the query and the building
+of the response data together, best of --repeat runs, and checks that both
+paths produce the same data.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, time as dt_time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthcare.settings')
+
+
+def setup(database):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': database,
+        }
+    }
+    settings.CELERY_BROKER_URL = 'memory://'
+    settings.CELERY_RESULT_BACKEND = 'cache+memory://'
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def create_fixtures(count):
+    """`count` doctors, appointments and medical records, inserted in bulk"""
+    from django.contrib.auth.models import User
+    from appointments.models import Appointment
+    from doctors.models import Doctor
+    from patients.models import Patient, MedicalRecord
+
+    users = User.objects.bulk_create(
+        User(username=f'benchdoctor{i}', first_name='Bench', last_name=f'Doctor{i}', email=f'doctor{i}@example.com')
+        for i in range(count)
+    )
+    doctors = Doctor.objects.bulk_create(
+        Doctor(
+            user=user,
+            specialization='GENERAL',
+            license_number=f'BENCH{i:05d}',
+            phone_number='+1234567890',
+            years_of_experience=10,
+            consultation_fee='120.00',
+            bio='Board certified physician'
+        )
+        for i, user in enumerate(users)
+    )
+    patient = Patient.objects.create(
+        user=User.objects.create_user(username='benchpatient', first_name='Bench', last_name='Patient'),
+        date_of_birth='1990-01-01',
+        gender='O',
+        phone_number='+1234567890',
+        address='1 Bench Street',
+        emergency_contact_name='Contact',
+        emergency_contact_phone='+1234567890'
+    )
+    # bulk_create skips save(), which would check each doctor's schedule
+    Appointment.objects.bulk_create(
+        Appointment(
+            patient=patient,
+            doctor=doctor,
+            appointment_date=date(2030, 1, 7) + timedelta(days=i % 365),
+            appointment_time=dt_time(9, 30),
+            duration_minutes=30,
+            end_time=dt_time(10, 0),
+            reason='Benchmark'
+        )
+        for i, doctor in enumerate(doctors)
+    )
+    MedicalRecord.objects.bulk_create(
+        MedicalRecord(patient=patient, doctor=doctor, diagnosis='Healthy', treatment='Rest')
+        for doctor in doctors
+    )
+
+
+def endpoints():
+    """The querysets and serializers of the lists, as the views build them"""
+    from appointments.models import Appointment
+    from appointments.serializers import AppointmentSerializer
+    from doctors.models import Doctor
+    from doctors.serializers import DoctorSerializer
+    from healthcare.serializers import select_for_serializer
+    from patients.models import MedicalRecord
+    from patients.serializers import MedicalRecordSerializer
+
+    return [
+        ('doctors', DoctorSerializer, select_for_serializer(Doctor.objects.order_by('id'), DoctorSerializer())),
+        ('appointments', AppointmentSerializer, Appointment.objects.order_by('id').for_display()),
+        ('records', MedicalRecordSerializer, select_for_serializer(MedicalRecord.objects.order_by('id'), MedicalRecordSerializer())),
+    ]
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def run_benchmark(sizes, repeat):
+    from healthcare.serializers import values_renderer
+
+    create_fixtures(max(sizes))
+
+    print(f"{'list':<13} {'rows':>6} {'serializer s':>13} {'values s':>9} {'speedup':>8}")
+    for name, serializer_class, queryset in endpoints():
+        columns, represent = values_renderer(serializer_class())
+        for size in sizes:
+            page = queryset[:size]
+            serializer_time, expected = best_of(repeat, lambda: serializer_class(page, many=True).data)
+            values_time, rows = best_of(repeat, lambda: [represent(row) for row in page.values_list(*columns)])
+            if rows != expected:
+                raise RuntimeError(f'{name}: values_list() rows render differently')
+            print(f"{name:<13} {size:>6} {serializer_time:>13.4f} {values_time:>9.4f} {serializer_time / values_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Rows per list')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup(os.path.join(directory, 'list_serialization.sqlite3'))
+        run_benchmark(args.sizes, args.repeat)
@@ -5,13 +5,17 @@ from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, timedelta
 
-from .models import Doctor, DoctorSchedule
-from .serializers import DoctorSerializer, DoctorCreateSerializer, DoctorScheduleSerializer
+from .models import Doctor, DoctorSchedule, ScheduleException
+from .serializers import DoctorSerializer, DoctorCreateSerializer, DoctorScheduleSerializer, ScheduleExceptionSerializer
 from appointments.models import Appointment
 from appointments.serializers import AppointmentSerializer
 from healthcare.permissions import IsPatient, IsDoctor, IsPatientOrDoctor, IsAdminUser
-from healthcare.utils import get_cached_data, invalidate_cache_pattern
+from healthcare.serializers import SPARSE_FIELDSET_PARAMS, list_response, select_for_serializer
+from healthcare.utils import cache_response
+from .availability import get_doctor_availability, get_doctor_month_availability, first_available_slots
 
 class DoctorViewSet(viewsets.ModelViewSet):
    
@@ -45,65 +49,65 @@ class DoctorViewSet(viewsets.ModelViewSet):
        
         user = self.request.user
         
-        # Cache key based on user ID and query parameters
-        cache_key = f'doctors_user_{user.id}_{self.request.query_params}'
-        
-        # Define the query function
-        def get_doctors():
-            if hasattr(user, 'doctor'):
-                # User is a doctor, return only their profile
-                return Doctor.objects.filter(user=user)
-            else:
-                # User is not a doctor, return all doctors
-                return Doctor.objects.all()
+        if hasattr(user, 'doctor'):
+            # User is a doctor, return only their profile
+            queryset = Doctor.objects.filter(user=user)
+        else:
+            # User is not a doctor, return all doctors
+            queryset = Doctor.objects.all()
         
-        # Get cached data or execute query
-        return get_cached_data(cache_key, settings.DOCTOR_CACHE_TIMEOUT, get_doctors)
+        # Load only what ?fields= asks for
+        if self.action in ['list', 'retrieve']:
+            return select_for_serializer(queryset, self.get_serializer())
+        return queryset
     
-    def perform_create(self, serializer):
+    def get_cache_namespaces(self):
         
-        doctor = serializer.save()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'doctors_user_{doctor.user.id}_*')
+        # Doctor profiles are shared by every user; the response cache
+        # still keys each entry by the requesting user.
+        return ['doctors']
     
-    def perform_update(self, serializer):
-        
-        doctor = serializer.save()
+    def get_cache_scope(self):
         
-        # Invalidate cache
-        invalidate_cache_pattern(f'doctors_user_{doctor.user.id}_*')
+        # Every user except a doctor sees the same doctors, so their responses
+        # share one cache entry, which the warm_caches command can precompute.
+        user = self.request.user
+        return f'user_{user.pk}' if hasattr(user, 'doctor') else 'shared'
     
-    def perform_destroy(self, instance):
-       
-        # Store ID before deletion for cache invalidation
-        user_id = instance.user.id
-        
-        # Delete the doctor
-        instance.delete()
+    def get_doctor_cache_namespaces(self, prefix, *shared):
         
-        # Invalidate cache
-        invalidate_cache_pattern(f'doctors_user_{user_id}_*')
+        # Namespace of a per-doctor family, from the URL's pk, plus any shared
+        # namespaces the response also depends on. Non-numeric pks bypass the
+        # cache so they cannot mint generation counters.
+        pk = str(self.kwargs.get('pk', ''))
+        return [f'{prefix}_{pk}', *shared] if pk.isdigit() else []
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def list(self, request, *args, **kwargs):
+        return list_response(self, self.filter_queryset(self.get_queryset()), self.get_serializer())
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=True, methods=['get'])
+    @cache_response('DOCTOR_CACHE_TIMEOUT', namespaces=lambda view: view.get_doctor_cache_namespaces('schedules_doctor'))
     def schedules(self, request, pk=None):
        
         doctor = self.get_object()
         
-        # Cache key
-        cache_key = f'schedules_doctor_{doctor.id}'
-        
-        # Define the query function
-        def get_schedules():
-            return DoctorSchedule.objects.filter(doctor=doctor).order_by('day_of_week', 'start_time')
-        
-        # Get cached data or execute query
-        schedules = get_cached_data(cache_key, settings.DOCTOR_CACHE_TIMEOUT, get_schedules)
+        schedules = DoctorSchedule.objects.filter(doctor=doctor).order_by('day_of_week', 'start_time')
         
         serializer = DoctorScheduleSerializer(schedules, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
+    @cache_response(
+        'APPOINTMENT_CACHE_TIMEOUT',
+        namespaces=lambda view: view.get_doctor_cache_namespaces('appointments_doctor', 'patients'),
+        query_params=('date_from', 'date_to', 'status', *SPARSE_FIELDSET_PARAMS),
+        vary_on_date=True
+    )
     def appointments(self, request, pk=None):
         
         doctor = self.get_object()
@@ -120,93 +124,171 @@ class DoctorViewSet(viewsets.ModelViewSet):
         date_to = request.query_params.get('date_to', None)
         status_filter = request.query_params.get('status', None)
         
-        # Cache key
-        cache_key = f'appointments_doctor_{doctor.id}_{date_from}_{date_to}_{status_filter}'
-        
-        # Define the query function
-        def get_appointments():
-            queryset = Appointment.objects.filter(doctor=doctor)
-            
-            # Apply date filter
-            if date_from:
-                queryset = queryset.filter(appointment_date__gte=date_from)
-            if date_to:
-                queryset = queryset.filter(appointment_date__lte=date_to)
-            
-            # Apply status filter
-            if status_filter:
-                queryset = queryset.filter(status=status_filter)
-            
-            return queryset.order_by('appointment_date', 'appointment_time')
+        serializer = AppointmentSerializer(context=self.get_serializer_context())
+        appointments = Appointment.objects.filter(doctor=doctor).for_display(serializer)
         
-        # Get cached data or execute query
-        appointments = get_cached_data(cache_key, settings.APPOINTMENT_CACHE_TIMEOUT, get_appointments)
+        # Apply date filter
+        if date_from:
+            appointments = appointments.filter(appointment_date__gte=date_from)
+        if date_to:
+            appointments = appointments.filter(appointment_date__lte=date_to)
+        
+        # Apply status filter
+        if status_filter:
+            appointments = appointments.filter(status=status_filter)
+        
+        appointments = appointments.order_by('appointment_date', 'appointment_time')
         
         # Paginate and serialize
         page = self.paginate_queryset(appointments)
         if page is not None:
-            serializer = AppointmentSerializer(page, many=True)
+            serializer = AppointmentSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
         
-        serializer = AppointmentSerializer(appointments, many=True)
+        serializer = AppointmentSerializer(appointments, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def available_slots(self, request, pk=None):
         
+        #Free slots of a doctor on `date` (default today), or a calendar of
+        #free slots per day from `start_date` to `end_date`.
+        
         doctor = self.get_object()
         
         # Get query parameters
-        date = request.query_params.get('date', timezone.now().date())
-        
-        # Cache key
-        cache_key = f'available_slots_doctor_{doctor.id}_{date}'
-        
-        # Define the query function
-        def get_available_slots():
-            # Get the day of the week for the given date
-            day_of_week = date.weekday()
-            
-            # Get the doctor's schedule for that day
-            schedule = DoctorSchedule.objects.filter(
-                doctor=doctor,
-                day_of_week=day_of_week,
-                is_available=True
-            ).first()
-            
-            if not schedule:
-                return []
-            
-            # Get all appointments for the doctor on that date
-            appointments = Appointment.objects.filter(
-                doctor=doctor,
-                appointment_date=date
-            ).values_list('appointment_time', flat=True)
-            
-            # Generate available time slots
-            import datetime
-            slots = []
-            current_time = schedule.start_time
-            
-            # Use 30-minute intervals
-            interval = datetime.timedelta(minutes=30)
-            
-            while current_time <= schedule.end_time:
-                # Check if this time slot is already booked
-                if current_time not in appointments:
-                    slots.append(current_time)
-                
-                # Move to the next time slot
-                current_time = (
-                    datetime.datetime.combine(datetime.date.today(), current_time) + interval
-                ).time()
-            
-            return slots
+        try:
+            if 'start_date' in request.query_params:
+                start_date = parse_query_date(request.query_params['start_date'])
+                end_date = parse_query_date(
+                    request.query_params.get('end_date'),
+                    start_date + timedelta(days=settings.AVAILABILITY_DEFAULT_DAYS - 1)
+                )
+            else:
+                start_date = end_date = parse_query_date(request.query_params.get('date'), timezone.now().date())
+        except ValueError:
+            return Response(
+                {'error': 'Dates must be valid and formatted as YYYY-MM-DD.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date or (end_date - start_date).days >= settings.AVAILABILITY_MAX_DAYS:
+            return Response(
+                {'error': f'end_date must be on or after start_date and at most {settings.AVAILABILITY_MAX_DAYS} days later.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Get cached data or execute query
-        available_slots = get_cached_data(cache_key, settings.APPOINTMENT_CACHE_TIMEOUT, get_available_slots)
+        availability = get_doctor_availability(doctor.id, start_date, end_date)
+        
+        if 'start_date' not in request.query_params:
+            return Response({'date': start_date, 'available_slots': availability[start_date]})
+        
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'calendar': [
+                {'date': day, 'available_slots': slots}
+                for day, slots in availability.items()
+            ]
+        })
+    
+    @action(detail=True, methods=['get'], url_path='availability-calendar')
+    def availability_calendar(self, request, pk=None):
+        
+        #Number of free slots per day of `month` (YYYY-MM, default this
+        #month), for a month view.
+        
+        doctor = self.get_object()
+        
+        try:
+            month = parse_query_month(request.query_params.get('month'), timezone.now().date())
+        except ValueError:
+            return Response(
+                {'error': 'month must be formatted as YYYY-MM.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        counts = get_doctor_month_availability(doctor.id, month)
+        
+        return Response({
+            'month': month.strftime('%Y-%m'),
+            'total_free_slots': sum(counts.values()),
+            'days': [
+                {'date': day, 'free_slots': count}
+                for day, count in counts.items()
+            ]
+        })
+    
+    @action(detail=False, methods=['get'], url_path='first-available')
+    def first_available(self, request):
         
-        return Response({'date': date, 'available_slots': available_slots})
+        #Earliest free slots across every doctor, optionally of one specialization.
+        
+        specialization = request.query_params.get('specialization')
+        if specialization and specialization not in dict(Doctor.SPECIALIZATIONS):
+            return Response(
+                {'error': f'Unknown specialization: {specialization}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            within_days = int(request.query_params.get('within_days', settings.AVAILABILITY_DEFAULT_DAYS))
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response(
+                {'error': 'within_days and limit must be integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        within_days = max(1, min(within_days, settings.AVAILABILITY_MAX_DAYS))
+        limit = max(1, min(limit, 100))
+        
+        doctors = Doctor.objects.all()
+        if specialization:
+            doctors = doctors.filter(specialization=specialization)
+        
+        # Slots earlier today can no longer be booked
+        now = timezone.localtime()
+        today = now.date()
+        slots = first_available_slots(
+            doctors.values('id'),
+            today,
+            today + timedelta(days=within_days - 1),
+            limit,
+            not_before=(today, now.time())
+        )
+        
+        doctors_by_id = Doctor.objects.select_related('user').in_bulk({doctor_id for _, _, doctor_id in slots})
+        return Response([
+            {
+                'date': slot_date,
+                'time': slot_time,
+                'doctor': DoctorSerializer(doctors_by_id[doctor_id]).data
+            }
+            for slot_date, slot_time, doctor_id in slots
+        ])
+
+def parse_query_date(value, default=None):
+    
+    # Parse a YYYY-MM-DD query parameter; raises ValueError when it is malformed
+    
+    if not value:
+        if default is None:
+            raise ValueError('Missing date')
+        return default
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f'Invalid date: {value}')
+    return parsed
+
+def parse_query_month(value, default):
+    
+    # Parse a YYYY-MM query parameter into the first day of that month;
+    # raises ValueError when it is malformed
+    
+    if not value:
+        return default.replace(day=1)
+    return datetime.strptime(value, '%Y-%m').date()
 
 class DoctorScheduleViewSet(viewsets.ModelViewSet):
    
@@ -214,6 +296,7 @@ class DoctorScheduleViewSet(viewsets.ModelViewSet):
     serializer_class = DoctorScheduleSerializer
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['day_of_week', 'start_time', 'end_time']
+    cache_query_params = ['doctor_id']
     
     def get_permissions(self):
       
@@ -229,23 +312,32 @@ class DoctorScheduleViewSet(viewsets.ModelViewSet):
        
         user = self.request.user
         
-        # Cache key based on user ID and query parameters
-        cache_key = f'schedules_user_{user.id}_{self.request.query_params}'
-        
-        # Define the query function
-        def get_schedules():
-            if hasattr(user, 'doctor'):
-                # User is a doctor, return their schedules
-                return DoctorSchedule.objects.filter(doctor=user.doctor)
-            else:
-                # User is not a doctor, return schedules for the specified doctor
-                doctor_id = self.request.query_params.get('doctor_id', None)
-                if doctor_id:
-                    return DoctorSchedule.objects.filter(doctor_id=doctor_id)
-                return DoctorSchedule.objects.none()
+        if hasattr(user, 'doctor'):
+            # User is a doctor, return their schedules
+            return DoctorSchedule.objects.filter(doctor=user.doctor)
+        else:
+            # User is not a doctor, return schedules for the specified doctor
+            doctor_id = self.request.query_params.get('doctor_id', '')
+            if doctor_id.isdigit():
+                return DoctorSchedule.objects.filter(doctor_id=doctor_id)
+            return DoctorSchedule.objects.none()
+    
+    def get_cache_namespaces(self):
         
-        # Get cached data or execute query
-        return get_cached_data(cache_key, settings.DOCTOR_CACHE_TIMEOUT, get_schedules)
+        # Responses are scoped to the schedules of a single doctor
+        user = self.request.user
+        if hasattr(user, 'doctor'):
+            return [f'schedules_doctor_{user.doctor.id}']
+        doctor_id = self.request.query_params.get('doctor_id', '')
+        return [f'schedules_doctor_{doctor_id}'] if doctor_id.isdigit() else []
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def perform_create(self, serializer):
         
@@ -255,36 +347,58 @@ class DoctorScheduleViewSet(viewsets.ModelViewSet):
         doctor = get_object_or_404(Doctor, user=self.request.user)
         
         # Save the schedule with the doctor
-        schedule = serializer.save(doctor=doctor)
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'schedules_user_{self.request.user.id}_*')
-        invalidate_cache_pattern(f'schedules_doctor_{doctor.id}')
-        invalidate_cache_pattern(f'available_slots_doctor_{doctor.id}_*')
+        serializer.save(doctor=doctor)
+
+class ScheduleExceptionViewSet(viewsets.ModelViewSet):
+   
+    queryset = ScheduleException.objects.all()
+    serializer_class = ScheduleExceptionSerializer
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['start_date', 'end_date', 'start_time']
+    cache_query_params = ['doctor_id']
     
-    def perform_update(self, serializer):
-        
-        #Update a schedule.
-        
-        schedule = serializer.save()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'schedules_user_{self.request.user.id}_*')
-        invalidate_cache_pattern(f'schedules_doctor_{schedule.doctor.id}')
-        invalidate_cache_pattern(f'available_slots_doctor_{schedule.doctor.id}_*')
+    def get_permissions(self):
+      
+        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+            permission_classes = [IsDoctor]
+        else:
+            permission_classes = [permissions.IsAuthenticated]
+        return [permission() for permission in permission_classes]
     
-    def perform_destroy(self, instance):
+    def get_queryset(self):
+       
+        user = self.request.user
         
-        #Delete a schedule.
+        if hasattr(user, 'doctor'):
+            # User is a doctor, return their exceptions
+            return ScheduleException.objects.filter(doctor=user.doctor)
+        else:
+            # User is not a doctor, return exceptions of the specified doctor
+            doctor_id = self.request.query_params.get('doctor_id', '')
+            if doctor_id.isdigit():
+                return ScheduleException.objects.filter(doctor_id=doctor_id)
+            return ScheduleException.objects.none()
+    
+    def get_cache_namespaces(self):
         
-        # Store ID before deletion for cache invalidation
-        doctor_id = instance.doctor.id
-        user_id = instance.doctor.user.id
+        # Responses are scoped to the exceptions of a single doctor
+        user = self.request.user
+        if hasattr(user, 'doctor'):
+            return [f'schedule_exceptions_doctor_{user.doctor.id}']
+        doctor_id = self.request.query_params.get('doctor_id', '')
+        return [f'schedule_exceptions_doctor_{doctor_id}'] if doctor_id.isdigit() else []
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response('DOCTOR_CACHE_TIMEOUT')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
         
-        # Delete the schedule
-        instance.delete()
+        #Block time off for the authenticated doctor.
         
-        # Invalidate cache
-        invalidate_cache_pattern(f'schedules_user_{user_id}_*')
-        invalidate_cache_pattern(f'schedules_doctor_{doctor_id}')
-        invalidate_cache_pattern(f'available_slots_doctor_{doctor_id}_*')
+        doctor = get_object_or_404(Doctor, user=self.request.user)
+        serializer.save(doctor=doctor)
@@ -0,0 +1,393 @@
+import calendar
+import datetime
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+
+from appointments.models import Appointment
+from healthcare.utils import get_cached_data, versioned_cache_key
+from .intervals import (
+    load_exception_index, merge_intervals, slots_overlapping, slots_within, subtract_intervals, to_minutes
+)
+from .models import MAX_DAY_SLOTS, Doctor, DoctorSchedule, DoctorDaySlots, day_slot_count
+
+# Availability engine. A doctor's working day is a grid of slots of the
+# doctor's slot_minutes from the schedule's start time up to and including its
+# end time. Each day of a date range is an int bitmap over that grid (bit i
+# set = slot i is free), so listing the free slots walks the set bits.
+# Schedules and booked times for any number of doctors and days are loaded
+# with one query each. `doctor_ids` may be a list of ids or a queryset of
+# Doctor ids, which is then applied as a subquery.
+#
+# Schedule exceptions and appointments are applied per day as a set
+# difference: the blocked intervals of the date are removed from the working
+# interval, then the merged appointment intervals from what remains, and only
+# the slots left entirely inside are free. A 60 minute appointment thus takes
+# every slot it overlaps, whether or not it starts on the grid.
+#
+# From today up to AVAILABILITY_HORIZON_DAYS ahead the bitmaps are
+# materialized in DoctorDaySlots and read with a single indexed query. Writes
+# keep them current: booking an appointment clears the bits it overlaps with
+# an UPDATE, cancelling one recomputes its day under a row lock (other
+# appointments may still overlap the slots it frees), and a schedule change
+# rebuilds the future dates of its weekday. The refresh_day_slots task extends
+# the horizon as days pass; readers never materialize, they compute the days
+# beyond what is materialized instead.
+
+def _to_time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+def date_range(start_date, end_date):
+    return [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+def load_day_grids(doctor_ids):
+
+    # {doctor_id: {day_of_week: (first slot in minutes, number of slots, slot length)}}
+
+    grids = defaultdict(dict)
+    schedules = DoctorSchedule.objects.filter(
+        doctor_id__in=doctor_ids,
+        is_available=True
+    ).values_list('doctor_id', 'day_of_week', 'start_time', 'end_time', 'doctor__slot_minutes')
+    for doctor_id, day_of_week, start_time, end_time, length in schedules:
+        # Schedules and slot lengths are validated to fit; the cap only
+        # guards rows saved before that, matching within_schedule
+        if end_time >= start_time:
+            count = min(day_slot_count(start_time, end_time, length), MAX_DAY_SLOTS)
+            grids[doctor_id][day_of_week] = (to_minutes(start_time), count, length)
+    return grids
+
+def load_booked_intervals(doctor_ids, start_date, end_date):
+
+    # {(doctor_id, date): [booked (start, end) intervals in minutes]}
+
+    booked = defaultdict(list)
+    appointments = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        appointment_date__range=(start_date, end_date)
+    ).exclude(status='CANCELLED').values_list('doctor_id', 'appointment_date', 'appointment_time', 'end_time')
+    for doctor_id, appointment_date, appointment_time, end_time in appointments:
+        booked[doctor_id, appointment_date].append((to_minutes(appointment_time), to_minutes(end_time)))
+    return booked
+
+def compute_slot_bitmaps(doctor_ids, start_date, end_date):
+
+    # {doctor_id: {date: (first slot in minutes, slot length, schedule bitmap, free bitmap)}}
+    # from the schedules, exceptions and bookings, for the days each doctor works.
+
+    grids = load_day_grids(doctor_ids)
+    exceptions = load_exception_index(doctor_ids, start_date, end_date)
+    booked = load_booked_intervals(doctor_ids, start_date, end_date)
+    days = date_range(start_date, end_date)
+
+    bitmaps = {}
+    for doctor_id, doctor_grids in grids.items():
+        doctor_bitmaps = {}
+        for day in days:
+            grid = doctor_grids.get(day.weekday())
+            if grid is None:
+                continue
+            start, count, length = grid
+            working = [(start, start + count * length)]
+            blocked = exceptions.blocked(doctor_id, day)
+            if blocked:
+                working = subtract_intervals(working, blocked)
+            slot_mask = bitmap = slots_within(working, start, count, length)
+            appointments = booked.get((doctor_id, day))
+            if appointments:
+                bitmap = slots_within(subtract_intervals(working, merge_intervals(appointments)), start, count, length)
+            doctor_bitmaps[day] = (start, length, slot_mask, bitmap)
+        bitmaps[doctor_id] = doctor_bitmaps
+    return bitmaps
+
+def horizon_end():
+    return timezone.now().date() + datetime.timedelta(days=settings.AVAILABILITY_HORIZON_DAYS - 1)
+
+def materialize_day_slots(doctor_ids, start_date, end_date, weekdays=None, replace=True):
+
+    # Write the DoctorDaySlots rows of a date range, optionally only on some
+    # weekdays. With replace=False existing rows are kept, which is how the
+    # horizon is extended without touching incrementally maintained days.
+
+    bitmaps = compute_slot_bitmaps(doctor_ids, start_date, end_date)
+    rows = [
+        DoctorDaySlots(
+            doctor_id=doctor_id, date=day, start_minute=start, slot_minutes=length,
+            slot_mask=slot_mask, free_mask=free_mask
+        )
+        for doctor_id, days in bitmaps.items()
+        for day, (start, length, slot_mask, free_mask) in days.items()
+        if weekdays is None or day.weekday() in weekdays
+    ]
+    with transaction.atomic():
+        if replace:
+            stale = DoctorDaySlots.objects.filter(doctor_id__in=doctor_ids, date__range=(start_date, end_date))
+            if weekdays is not None:
+                # Django numbers weekdays from Sunday = 1
+                stale = stale.filter(date__week_day__in=[(weekday + 1) % 7 + 1 for weekday in weekdays])
+            stale.delete()
+        DoctorDaySlots.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=not replace)
+    return len(rows)
+
+def day_slots_materialized_until():
+
+    # Last date materialized for every doctor, from one cache read. Should the
+    # marker be gone, it is read back from the table: the earliest of the
+    # doctors' last materialized dates, so a day is never taken as
+    # materialized for one doctor while another's row is still missing.
+
+    materialized_until = cache.get('day_slots_materialized_until')
+    if materialized_until is None:
+        materialized_until = DoctorDaySlots.objects.values('doctor_id').annotate(
+            last=Max('date')
+        ).aggregate(until=Min('last'))['until'] or timezone.now().date() - datetime.timedelta(days=1)
+        cache.add('day_slots_materialized_until', materialized_until, None)
+    return materialized_until
+
+def ensure_day_slots_horizon():
+
+    # Materialize the days that entered the horizon since the last call and
+    # return the last materialized date. Run by the refresh_day_slots task; a
+    # lock key keeps overlapping runs from materializing the same days twice.
+
+    end = horizon_end()
+    materialized_until = day_slots_materialized_until()
+    if materialized_until < end and cache.add('lock:day_slots_horizon', 1, 60 * 10):
+        try:
+            start = max(timezone.now().date(), materialized_until + datetime.timedelta(days=1))
+            materialize_day_slots(Doctor.objects.values('id'), start, end, replace=False)
+            cache.set('day_slots_materialized_until', end, None)
+        finally:
+            cache.delete('lock:day_slots_horizon')
+        return end
+    return materialized_until
+
+def rebuild_schedule_day_slots(doctor_id, weekdays):
+
+    # A schedule changed: rebuild that doctor's materialized future dates of those weekdays
+
+    today = timezone.now().date()
+    return materialize_day_slots([doctor_id], today, horizon_end(), weekdays=set(weekdays))
+
+def rebuild_doctor_day_slots(doctor_id):
+
+    # The doctor's slot length changed: rebuild all their materialized dates
+
+    return materialize_day_slots([doctor_id], timezone.now().date(), horizon_end())
+
+def rebuild_date_range_day_slots(doctor_id, start_date, end_date):
+
+    # An exception changed: rebuild that doctor's materialized dates it covers
+
+    first, last = max(start_date, timezone.now().date()), min(end_date, horizon_end())
+    if first > last:
+        return 0
+    return materialize_day_slots([doctor_id], first, last)
+
+def occupy_slots(bookings):
+
+    # Clear the bits of every materialized slot that the (doctor_id, date,
+    # start time, end time) bookings overlap: one query reads the day rows,
+    # then one UPDATE per doctor and day. The update is relative to the
+    # stored mask, so concurrent bookings of the same day compose; it is
+    # skipped if the day's grid was rebuilt meanwhile.
+
+    booked = defaultdict(list)
+    for doctor_id, day, start_time, end_time in bookings:
+        booked[doctor_id, day].append((to_minutes(start_time), to_minutes(end_time)))
+    if not booked:
+        return
+
+    rows = DoctorDaySlots.objects.filter(
+        doctor_id__in={doctor_id for doctor_id, day in booked},
+        date__in={day for doctor_id, day in booked}
+    ).order_by('id').values_list('id', 'doctor_id', 'date', 'start_minute', 'slot_minutes', 'slot_mask')
+    for row_id, doctor_id, day, start, length, slot_mask in rows:
+        bits = 0
+        for interval in booked.get((doctor_id, day), ()):
+            bits |= slots_overlapping(interval, start, slot_mask.bit_length(), length)
+        if bits:
+            DoctorDaySlots.objects.filter(id=row_id, start_minute=start, slot_minutes=length).update(
+                free_mask=F('free_mask') - F('free_mask').bitand(bits)
+            )
+
+def occupy_slot(doctor_id, day, start_time, end_time):
+    occupy_slots([(doctor_id, day, start_time, end_time)])
+
+def release_slots(bookings):
+
+    # Freed slots may still overlap other appointments, so the days of the
+    # (doctor_id, date, start time, end time) bookings are recomputed, each
+    # once, rather than their bits set. The day rows are locked first and
+    # updated in place: a booking of the same day waits for the lock, then
+    # clears its bits from the recomputed mask (see occupy_slots), and rows
+    # are locked in id order, as occupy_slots updates them.
+
+    days = {(doctor_id, day) for doctor_id, day, start_time, end_time in bookings}
+    if not days:
+        return
+
+    doctor_ids = {doctor_id for doctor_id, day in days}
+    with transaction.atomic():
+        rows = [
+            row for row in DoctorDaySlots.objects.select_for_update().filter(
+                doctor_id__in=doctor_ids,
+                date__in={day for doctor_id, day in days}
+            ).order_by('id')
+            if (row.doctor_id, row.date) in days
+        ]
+        if not rows:
+            return
+
+        bitmaps = compute_slot_bitmaps(doctor_ids, min(row.date for row in rows), max(row.date for row in rows))
+        updated, days_off = [], []
+        for row in rows:
+            bitmap = bitmaps.get(row.doctor_id, {}).get(row.date)
+            if bitmap is None:
+                days_off.append(row.id)
+                continue
+            row.start_minute, row.slot_minutes, row.slot_mask, row.free_mask = bitmap
+            updated.append(row)
+        DoctorDaySlots.objects.bulk_update(updated, ['start_minute', 'slot_minutes', 'slot_mask', 'free_mask'])
+        if days_off:
+            DoctorDaySlots.objects.filter(id__in=days_off).delete()
+
+def release_slot(doctor_id, day, start_time, end_time):
+    release_slots([(doctor_id, day, start_time, end_time)])
+
+def free_slot_bitmaps(doctor_ids, start_date, end_date):
+
+    # {doctor_id: {date: (first slot in minutes, slot length, bitmap of free slots)}} for the
+    # days each doctor works; days off and doctors without a schedule are left
+    # out. Materialized days come from DoctorDaySlots, the others are computed.
+    # Nothing is free any more before today, nor today in slots that have
+    # already started.
+
+    now = timezone.localtime()
+    today = now.date()
+    materialized_end = day_slots_materialized_until()
+
+    bitmaps = defaultdict(dict)
+    first, last = max(start_date, today), min(end_date, materialized_end)
+    if first <= last:
+        rows = DoctorDaySlots.objects.filter(
+            doctor_id__in=doctor_ids,
+            date__range=(first, last)
+        ).values_list('doctor_id', 'date', 'start_minute', 'slot_minutes', 'free_mask')
+        for doctor_id, day, start, length, free_mask in rows:
+            bitmaps[doctor_id][day] = (start, length, free_mask)
+
+    range_start = max(start_date, today, materialized_end + datetime.timedelta(days=1))
+    if range_start <= end_date:
+        for doctor_id, days in compute_slot_bitmaps(doctor_ids, range_start, end_date).items():
+            for day, (start, length, slot_mask, free_mask) in days.items():
+                bitmaps[doctor_id][day] = (start, length, free_mask)
+
+    if start_date <= today <= end_date:
+        minute = now.hour * 60 + now.minute
+        for day_bitmaps in bitmaps.values():
+            if today in day_bitmaps:
+                start, length, free_mask = day_bitmaps[today]
+                started = max(0, (minute - start) // length + 1)
+                day_bitmaps[today] = (start, length, free_mask >> started << started)
+    return bitmaps
+
+def bitmap_to_times(start, length, bitmap):
+    times = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        times.append(_to_time(start + (lowest.bit_length() - 1) * length))
+        bitmap ^= lowest
+    return times
+
+def compute_availability(doctor_ids, start_date, end_date):
+
+    # {doctor_id: {date: [free slot times]}} for every day of the range,
+    # with an empty list on days off.
+
+    bitmaps = free_slot_bitmaps(doctor_ids, start_date, end_date)
+    return {
+        doctor_id: {
+            day: bitmap_to_times(*bitmaps[doctor_id][day]) if day in bitmaps.get(doctor_id, {}) else []
+            for day in date_range(start_date, end_date)
+        }
+        for doctor_id in doctor_ids
+    }
+
+def _free_slots_in_order(doctor_id, day_bitmaps, not_before):
+    for day in sorted(day_bitmaps):
+        for slot_time in bitmap_to_times(*day_bitmaps[day]):
+            if not_before is None or (day, slot_time) > not_before:
+                yield (day, slot_time, doctor_id)
+
+def first_available_slots(doctor_ids, start_date, end_date, limit, not_before=None):
+
+    # The `limit` earliest free slots across all doctors, as sorted
+    # (date, time, doctor_id) tuples. Each doctor's slots are generated lazily
+    # in chronological order and heap-merged, so only the slots up to the
+    # limit are ever materialized. Slots up to `not_before`, a (date, time)
+    # tuple, are skipped.
+
+    bitmaps = free_slot_bitmaps(doctor_ids, start_date, end_date)
+    streams = [
+        _free_slots_in_order(doctor_id, day_bitmaps, not_before)
+        for doctor_id, day_bitmaps in bitmaps.items()
+    ]
+    return list(islice(heapq.merge(*streams), limit))
+
+def compute_doctor_availability(doctor_id, start_date, end_date):
+    return compute_availability([doctor_id], start_date, end_date)[doctor_id]
+
+def get_doctor_availability(doctor_id, start_date, end_date):
+
+    # Cached {date: [free slot times]} of one doctor, invalidated with the
+    # available_slots_doctor_<id> namespace. Keyed by the current date too, as
+    # the days before it are empty; today's started slots may show as free
+    # until the entry expires.
+
+    return get_cached_data(
+        versioned_cache_key(
+            f'available_slots_doctor_{doctor_id}', start_date.isoformat(), end_date.isoformat(),
+            timezone.localdate().isoformat()
+        ),
+        settings.APPOINTMENT_CACHE_TIMEOUT,
+        compute_doctor_availability,
+        doctor_id,
+        start_date,
+        end_date
+    )
+
+def free_slot_counts(doctor_id, start_date, end_date):
+
+    # {date: number of free slots} of one doctor for every day of the range,
+    # counted from the day bitmaps without listing the slots
+
+    bitmaps = free_slot_bitmaps([doctor_id], start_date, end_date).get(doctor_id, {})
+    return {
+        day: bitmaps[day][2].bit_count() if day in bitmaps else 0
+        for day in date_range(start_date, end_date)
+    }
+
+def get_doctor_month_availability(doctor_id, month):
+
+    # Cached free-slot counts per day of the month starting at `month`,
+    # invalidated with the available_slots_doctor_<id> namespace and keyed by
+    # the current date like get_doctor_availability.
+
+    month_end = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+    return get_cached_data(
+        versioned_cache_key(
+            f'available_slots_doctor_{doctor_id}', 'month', month.strftime('%Y-%m'), timezone.localdate().isoformat()
+        ),
+        settings.APPOINTMENT_CACHE_TIMEOUT,
+        free_slot_counts,
+        doctor_id,
+        month,
+        month_end
+    )
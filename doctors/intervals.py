@@ -0,0 +1,168 @@
+import bisect
+import datetime
+from collections import defaultdict
+
+from .models import MAX_DAY_SLOTS, ScheduleException, day_slot_count
+
+# Interval arithmetic for schedule exceptions and appointments. Times of day
+# are minutes after midnight and intervals are half-open (start, end) tuples,
+# so a 30 minute slot at 10:00 is (600, 630) and only overlaps intervals that
+# start before 10:30.
+
+MINUTES_PER_DAY = 24 * 60
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+def add_minutes(value, minutes):
+
+    # The time `minutes` after `value`, or None past the end of the day
+
+    end = to_minutes(value) + minutes
+    if end >= MINUTES_PER_DAY:
+        return None
+    return datetime.time(end // 60, end % 60)
+
+def within_schedule(schedule_start, schedule_end, slot_minutes, start_time, end_time):
+
+    # Whether an appointment from start_time to end_time fits a schedule's
+    # slot grid, which runs from its start time up to and including its end
+    # time: it starts within the schedule and ends by the end of its last slot.
+    # The grid is capped at MAX_DAY_SLOTS like the availability bitmaps.
+
+    first, last = to_minutes(schedule_start), to_minutes(schedule_end)
+    count = min(day_slot_count(schedule_start, schedule_end, slot_minutes), MAX_DAY_SLOTS)
+    grid_end = first + count * slot_minutes
+    return first <= to_minutes(start_time) <= last and to_minutes(end_time) <= grid_end
+
+def merge_intervals(intervals):
+
+    # Sorted, disjoint intervals covering the same minutes
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract_intervals(intervals, removed):
+
+    # Set difference of two lists of sorted, disjoint intervals
+
+    result = []
+    for start, end in intervals:
+        for removed_start, removed_end in removed:
+            if removed_end <= start:
+                continue
+            if removed_start >= end:
+                break
+            if removed_start > start:
+                result.append((start, removed_start))
+            start = removed_end
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+def overlaps(intervals, start, end):
+
+    # Whether any of a sorted, disjoint list of intervals shares a minute with
+    # start to end, with one bisect
+
+    position = bisect.bisect_right(intervals, (start, MINUTES_PER_DAY))
+    if position and intervals[position - 1][1] > start:
+        return True
+    return position < len(intervals) and intervals[position][0] < end
+
+def slots_within(intervals, first, count, length):
+
+    # Bitmap of the `count` slots of `length` minutes starting at `first`
+    # (bit i = the slot at first + i * length) that lie entirely inside the
+    # intervals
+
+    mask = 0
+    for start, end in intervals:
+        low = max(0, -((first - start) // length))
+        high = min(count, (end - first - length) // length + 1)
+        if high > low:
+            mask |= ((1 << (high - low)) - 1) << low
+    return mask
+
+def slots_overlapping(interval, first, count, length):
+
+    # Bitmap of the slots, laid out as in slots_within, that share a minute
+    # with the interval
+
+    start, end = interval
+    low = max(0, (start - first) // length)
+    high = min(count, -((first - end) // length))
+    if high <= low:
+        return 0
+    return ((1 << (high - low)) - 1) << low
+
+class ExceptionIndex:
+
+    # Blocked time intervals per doctor and date. The date ranges of a
+    # doctor's exceptions are cut at every start and end into disjoint
+    # segments, each holding the merged intervals blocked throughout it, so
+    # looking up a date is one bisect over the segment boundaries.
+
+    def __init__(self, exceptions):
+        # `exceptions` are (doctor_id, start_date, end_date, start_minute, end_minute) tuples
+        blocks = defaultdict(list)
+        for doctor_id, start_date, end_date, start, end in exceptions:
+            blocks[doctor_id].append((start_date, end_date + datetime.timedelta(days=1), start, end))
+        self._segments = {doctor_id: self._build(doctor_blocks) for doctor_id, doctor_blocks in blocks.items()}
+
+    @staticmethod
+    def _build(blocks):
+        boundaries = sorted({block[0] for block in blocks} | {block[1] for block in blocks})
+        segments = [
+            merge_intervals((start, end) for first_day, after_last_day, start, end in blocks
+                            if first_day <= boundary < after_last_day)
+            for boundary in boundaries
+        ]
+        return boundaries, segments
+
+    def __bool__(self):
+        return bool(self._segments)
+
+    def blocked(self, doctor_id, day):
+        """Sorted, disjoint intervals of the day blocked for the doctor"""
+        if doctor_id not in self._segments:
+            return []
+        boundaries, segments = self._segments[doctor_id]
+        position = bisect.bisect_right(boundaries, day) - 1
+        return segments[position] if position >= 0 else []
+
+    def blocks(self, doctor_id, day, start, end):
+        """Whether any of the minutes from start to end are blocked"""
+        return overlaps(self.blocked(doctor_id, day), start, end)
+
+def load_exception_index(doctor_ids, start_date, end_date):
+
+    # Index of the exceptions of some doctors that touch a date range, in one
+    # query. Whole-day exceptions block every minute of the day.
+
+    exceptions = ScheduleException.objects.filter(
+        doctor_id__in=doctor_ids,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    ).values_list('doctor_id', 'start_date', 'end_date', 'start_time', 'end_time')
+    return ExceptionIndex(
+        (
+            doctor_id,
+            first_day,
+            last_day,
+            0 if start_time is None else to_minutes(start_time),
+            MINUTES_PER_DAY if end_time is None else to_minutes(end_time),
+        )
+        for doctor_id, first_day, last_day, start_time, end_time in exceptions
+    )
+
+def is_slot_blocked(doctor_id, day, start_time, end_time):
+    """Whether an exception blocks any part of the time from start_time to end_time"""
+    return load_exception_index([doctor_id], day, day).blocks(doctor_id, day, to_minutes(start_time), to_minutes(end_time))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from doctors.models import Doctor
+from doctors.tasks import warm_doctor_directory, warm_doctor_caches, warm_doctor_caches_chunk
+
+class Command(BaseCommand):
+    help = 'Precompute the doctor directory, doctor schedules and upcoming available slots'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CACHE_WARM_DAYS, help='Number of days of available slots to warm')
+        parser.add_argument('--chunk-size', type=int, default=settings.CACHE_WARM_CHUNK_SIZE, help='Doctors per chunk')
+        parser.add_argument('--force', action='store_true', help='Rewarm doctors whose data has not changed since the last run')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Queue the chunks on Celery workers instead of warming in this process')
+    
+    def handle(self, *args, **options):
+        days = options['days']
+        chunk_size = options['chunk_size']
+        force = options['force']
+        
+        if options['run_async']:
+            result = warm_doctor_caches.delay(days, force, chunk_size)
+            self.stdout.write(self.style.SUCCESS(f'Queued cache warming task {result.id}'))
+            return
+        
+        if warm_doctor_directory(force):
+            self.stdout.write('Warmed the doctor directory')
+        
+        doctor_ids = list(Doctor.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(doctor_ids), chunk_size):
+            self.stdout.write(warm_doctor_caches_chunk(doctor_ids[i:i + chunk_size], days, force))
+        
+        self.stdout.write(self.style.SUCCESS(f'Cache warming finished for {len(doctor_ids)} doctors'))
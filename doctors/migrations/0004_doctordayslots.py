@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0003_alter_doctor_years_of_experience'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorDaySlots',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('start_minute', models.IntegerField()),
+                ('slot_mask', models.BigIntegerField()),
+                ('free_mask', models.BigIntegerField()),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_slots', to='doctors.doctor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='doctors_doc_date_6e0153_idx')],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'date'), name='unique_doctor_day_slots')],
+            },
+        ),
+    ]
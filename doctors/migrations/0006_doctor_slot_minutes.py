@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0005_scheduleexception'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(240)]),
+        ),
+        migrations.AddField(
+            model_name='doctordayslots',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=30),
+        ),
+    ]
@@ -1,8 +1,26 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.core.validators import RegexValidator
+from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
 
+# Default length of an appointment slot in minutes, and the most slots a
+# working day may have (day bitmaps are stored as 64-bit integers)
+SLOT_MINUTES = 30
+MAX_DAY_SLOTS = 63
+
+def day_slot_count(start_time, end_time, slot_minutes):
+    """Slots of a working day from start_time up to and including end_time"""
+    minutes = (end_time.hour - start_time.hour) * 60 + end_time.minute - start_time.minute
+    return minutes // slot_minutes + 1
+
+def validate_day_slots(start_time, end_time, slot_minutes):
+    """Validate that a working day fits in a bitmap"""
+    if day_slot_count(start_time, end_time, slot_minutes) > MAX_DAY_SLOTS:
+        raise ValidationError(
+            f'A working day can have at most {MAX_DAY_SLOTS} slots; '
+            f'{start_time:%H:%M}-{end_time:%H:%M} has more in {slot_minutes} minute slots.'
+        )
+
 class Doctor(models.Model):
     SPECIALIZATIONS = [
         ('CARDIO', 'Cardiology'),
@@ -22,9 +40,33 @@ class Doctor(models.Model):
     years_of_experience = models.PositiveIntegerField(default=1)
     consultation_fee = models.DecimalField(max_digits=8, decimal_places=2, default=0)
     bio = models.TextField(blank=True)
+    slot_minutes = models.PositiveSmallIntegerField(
+        default=SLOT_MINUTES,
+        validators=[MinValueValidator(5), MaxValueValidator(240)]
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Slot length as loaded, to rebuild the materialized slots when it changes
+        instance._loaded_slot_minutes = instance.__dict__.get('slot_minutes')
+        return instance
+    
+    def validate_slot_minutes(self, slot_minutes):
+        """Validate that every working day of the doctor fits in a bitmap at this slot length"""
+        if self.pk:
+            for start_time, end_time in self.schedules.values_list('start_time', 'end_time'):
+                validate_day_slots(start_time, end_time, slot_minutes)
+    
+    def clean(self):
+        if self.slot_minutes:
+            try:
+                self.validate_slot_minutes(self.slot_minutes)
+            except ValidationError as exc:
+                raise ValidationError({'slot_minutes': exc.messages})
+    
     def __str__(self):
         return f"Dr. {self.user.first_name} {self.user.last_name} - {self.get_specialization_display()}"
     
@@ -53,9 +95,19 @@ class DoctorSchedule(models.Model):
         ordering = ['day_of_week', 'start_time']
     
     def clean(self):
-        """Validate that end time is after start time"""
+        """Validate that end time is after start time and the day fits in a bitmap"""
         if self.start_time and self.end_time and self.end_time <= self.start_time:
             raise ValidationError('End time must be after start time.')
+        if self.start_time and self.end_time and self.doctor_id:
+            validate_day_slots(self.start_time, self.end_time, self.doctor.slot_minutes)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Weekday as loaded, so that moving a schedule to another day also
+        # rebuilds the materialized slots of the day it left
+        instance._loaded_day_of_week = instance.__dict__.get('day_of_week')
+        return instance
     
     def save(self, *args, **kwargs):
         self.full_clean()
@@ -63,3 +115,80 @@ class DoctorSchedule(models.Model):
     
     def __str__(self):
         return f"{self.doctor} - {self.get_day_of_week_display()} {self.start_time}-{self.end_time}"
+
+class ScheduleException(models.Model):
+    
+    # A block of unavailability on top of the weekly schedule: every date from
+    # start_date to end_date, either the whole day (no times) or only from
+    # start_time to end_time on each of those dates. Covers vacations,
+    # holidays and blocked hours.
+    
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='schedule_exceptions')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['start_date', 'start_time']
+        indexes = [
+            models.Index(fields=['doctor', 'start_date']),
+        ]
+    
+    @property
+    def is_all_day(self):
+        return self.start_time is None and self.end_time is None
+    
+    def clean(self):
+        """Validate the date range and that times are given together, end after start"""
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError('End date must be on or after start date.')
+        if (self.start_time is None) != (self.end_time is None):
+            raise ValidationError('Give both a start and an end time, or neither to block whole days.')
+        if self.start_time and self.end_time and self.end_time <= self.start_time:
+            raise ValidationError('End time must be after start time.')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Dates as loaded, so that moving an exception also rebuilds the
+        # materialized slots of the dates it left
+        instance._loaded_dates = (instance.__dict__.get('start_date'), instance.__dict__.get('end_date'))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        hours = '' if self.is_all_day else f" {self.start_time}-{self.end_time}"
+        return f"{self.doctor} - unavailable {self.start_date} to {self.end_date}{hours}"
+
+class DoctorDaySlots(models.Model):
+    
+    # Materialized availability of a doctor on one working day, maintained
+    # incrementally by doctors.availability. Bit i of the masks is the slot
+    # starting slot_minutes * i minutes after start_minute (minutes after
+    # midnight). slot_mask holds the slots of the schedule, free_mask the ones
+    # not booked. Rows exist for working days from today up to
+    # AVAILABILITY_HORIZON_DAYS ahead.
+    
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='day_slots')
+    date = models.DateField()
+    start_minute = models.IntegerField()
+    slot_minutes = models.PositiveSmallIntegerField(default=SLOT_MINUTES)
+    slot_mask = models.BigIntegerField()
+    free_mask = models.BigIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date'], name='unique_doctor_day_slots'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor} - {self.date}"
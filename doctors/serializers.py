@@ -1,13 +1,15 @@
 from rest_framework import serializers
-from .models import Doctor, DoctorSchedule
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .models import Doctor, DoctorSchedule, ScheduleException, validate_day_slots
 from django.contrib.auth.models import User
+from healthcare.serializers import DynamicFieldsMixin
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
@@ -15,9 +17,15 @@ class DoctorSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'specialization', 'license_number', 
             'phone_number', 'years_of_experience', 'consultation_fee', 
-            'bio', 'created_at', 'updated_at'
+            'bio', 'slot_minutes', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
+    
+    def validate_slot_minutes(self, value):
+        """Ensure the doctor's schedules still fit in a day at the new slot length"""
+        if self.instance is not None:
+            self.instance.validate_slot_minutes(value)
+        return value
 
 class DoctorCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating new doctor profiles"""
@@ -28,7 +36,7 @@ class DoctorCreateSerializer(serializers.ModelSerializer):
         fields = [
             'user', 'specialization', 'license_number', 
             'phone_number', 'years_of_experience', 'consultation_fee', 
-            'bio'
+            'bio', 'slot_minutes'
         ]
     
     def validate_user(self, value):
@@ -47,10 +55,19 @@ class DoctorScheduleSerializer(serializers.ModelSerializer):
         read_only_fields = ['doctor', 'doctor_name', 'day_name']
     
     def validate(self, data):
-        """Validate that end time is after start time"""
-        if data.get('start_time') and data.get('end_time'):
-            if data['end_time'] <= data['start_time']:
+        """Validate that end time is after start time and the day fits in a bitmap"""
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        if start_time and end_time:
+            if end_time <= start_time:
                 raise serializers.ValidationError("End time must be after start time.")
+            
+            doctor = self.instance.doctor if self.instance else getattr(self.context['request'].user, 'doctor', None)
+            if doctor is not None:
+                try:
+                    validate_day_slots(start_time, end_time, doctor.slot_minutes)
+                except DjangoValidationError as exc:
+                    raise serializers.ValidationError({'end_time': exc.messages})
         return data
     
     def create(self, validated_data):
@@ -62,4 +79,26 @@ class DoctorScheduleSerializer(serializers.ModelSerializer):
         except Doctor.DoesNotExist:
             raise serializers.ValidationError("User must have a doctor profile to create schedules.")
         
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class ScheduleExceptionSerializer(serializers.ModelSerializer):
+    doctor_name = serializers.CharField(source='doctor.user.get_full_name', read_only=True)
+    
+    class Meta:
+        model = ScheduleException
+        fields = ['id', 'doctor', 'start_date', 'end_date', 'start_time', 'end_time', 'reason', 'doctor_name', 'created_at']
+        read_only_fields = ['doctor', 'doctor_name', 'created_at']
+    
+    def validate(self, data):
+        """Validate the date range and that times are given together, end after start"""
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError("End date must be on or after start date.")
+        if (start_time is None) != (end_time is None):
+            raise serializers.ValidationError("Give both a start and an end time, or neither to block whole days.")
+        if start_time and end_time and end_time <= start_time:
+            raise serializers.ValidationError("End time must be after start time.")
+        return data
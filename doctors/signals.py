@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from healthcare.utils import register_cache_namespaces
+
+from .availability import rebuild_date_range_day_slots, rebuild_doctor_day_slots, rebuild_schedule_day_slots
+from .models import Doctor, DoctorSchedule, ScheduleException
+
+# Cache namespaces fed by each model; invalidated after commit on every save and delete.
+register_cache_namespaces(Doctor, lambda doctor: ['doctors', f'available_slots_doctor_{doctor.id}'])
+register_cache_namespaces(DoctorSchedule, lambda schedule: [
+    f'schedules_doctor_{schedule.doctor_id}',
+    f'available_slots_doctor_{schedule.doctor_id}',
+])
+register_cache_namespaces(ScheduleException, lambda exception: [
+    f'schedule_exceptions_doctor_{exception.doctor_id}',
+    f'available_slots_doctor_{exception.doctor_id}',
+])
+
+def doctor_user_cache_namespaces(user):
+    
+    #A doctor's name and email are shown with the profile, the appointments
+    #and the schedules; one query finds the doctor behind the user.
+    
+    return [
+        namespace
+        for doctor_id in Doctor.objects.filter(user_id=user.id).values_list('id', flat=True)
+        for namespace in (
+            'doctors',
+            f'appointments_doctor_{doctor_id}',
+            f'schedules_doctor_{doctor_id}',
+            f'schedule_exceptions_doctor_{doctor_id}',
+        )
+    ]
+
+register_cache_namespaces(User, doctor_user_cache_namespaces, fields=['username', 'first_name', 'last_name', 'email'])
+
+@receiver(post_save, sender=Doctor)
+def rebuild_slot_grid(sender, instance, created, **kwargs):
+    
+    #A new slot length changes the grid of every working day.
+    
+    if not created and instance.slot_minutes != getattr(instance, '_loaded_slot_minutes', instance.slot_minutes):
+        rebuild_doctor_day_slots(instance.id)
+    instance._loaded_slot_minutes = instance.slot_minutes
+
+@receiver([post_save, post_delete], sender=DoctorSchedule)
+def rebuild_day_slots(sender, instance, **kwargs):
+    
+    #Rebuild the materialized slots of the weekday the schedule covers,
+    #and of the weekday it covered before if it moved.
+    
+    weekdays = {instance.day_of_week, getattr(instance, '_loaded_day_of_week', instance.day_of_week)}
+    rebuild_schedule_day_slots(instance.doctor_id, weekdays)
+    instance._loaded_day_of_week = instance.day_of_week
+
+@receiver([post_save, post_delete], sender=ScheduleException)
+def rebuild_exception_day_slots(sender, instance, **kwargs):
+    
+    #Rebuild the materialized slots of the dates the exception covers,
+    #and of the dates it covered before if it moved.
+    
+    ranges = {(instance.start_date, instance.end_date), getattr(instance, '_loaded_dates', (None, None))}
+    for start_date, end_date in ranges:
+        if start_date and end_date:
+            rebuild_date_range_day_slots(instance.doctor_id, start_date, end_date)
+    instance._loaded_dates = (instance.start_date, instance.end_date)
@@ -0,0 +1,117 @@
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+import logging
+import math
+from datetime import timedelta
+
+from .models import Doctor, DoctorDaySlots
+from .availability import get_doctor_availability, ensure_day_slots_horizon, materialize_day_slots, horizon_end
+from healthcare.utils import get_cache_generation
+
+logger = logging.getLogger('django')
+
+def _render_shared_response(actions, path, query=None, **kwargs):
+
+    # Run a DoctorViewSet action as a non-doctor user would, which stores its
+    # response under the shared cache scope (see DoctorViewSet.get_cache_scope).
+
+    from .api import DoctorViewSet
+
+    request = APIRequestFactory().get(path, query or {})
+    force_authenticate(request, user=User(username='cache-warmer'))
+    view = DoctorViewSet.as_view(actions, throttle_classes=[], detail='pk' in kwargs, basename='doctor')
+    return view(request, **kwargs)
+
+def _warm(namespace, timeout, warm_function, force=False, version=None):
+
+    # Warm one namespace unless it was already warmed at its current generation.
+    # The marker expires with the warmed entries, so they are rewarmed in time.
+
+    marker_key = f'cache_warm:{namespace}'
+    marker = (get_cache_generation(namespace), version)
+    if not force and cache.get(marker_key) == marker:
+        return False
+    warm_function()
+    cache.set(marker_key, marker, timeout)
+    return True
+
+def warm_doctor_directory(force=False):
+
+    # Every page of the doctor list
+
+    def warm():
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        pages = max(1, math.ceil(Doctor.objects.count() / page_size))
+        for page in range(1, pages + 1):
+            _render_shared_response({'get': 'list'}, reverse('doctor-list'), {'page': page} if page > 1 else None)
+
+    return _warm('doctors', settings.DOCTOR_CACHE_TIMEOUT, warm, force)
+
+def warm_doctor(doctor_id, days, force=False):
+
+    # A doctor's weekly schedule and their free slots for the next `days` days.
+    # Returns the number of namespaces that had to be warmed.
+
+    today = timezone.now().date()
+
+    def warm_schedules():
+        _render_shared_response({'get': 'schedules'}, reverse('doctor-schedules', args=[doctor_id]), pk=doctor_id)
+
+    def warm_slots():
+        # Today's slots, as asked for without parameters, and the calendar
+        # from today, as asked for by a booking view
+        get_doctor_availability(doctor_id, today, today)
+        get_doctor_availability(doctor_id, today, today + timedelta(days=days - 1))
+
+    warmed = _warm(f'schedules_doctor_{doctor_id}', settings.DOCTOR_CACHE_TIMEOUT, warm_schedules, force)
+    warmed += _warm(
+        f'available_slots_doctor_{doctor_id}', settings.APPOINTMENT_CACHE_TIMEOUT, warm_slots, force,
+        version=(today.isoformat(), days)
+    )
+    return warmed
+
+@shared_task
+def warm_doctor_caches_chunk(doctor_ids, days, force=False):
+    """Warm the schedules and open slots of a chunk of doctors"""
+    warmed = 0
+    for doctor_id in doctor_ids:
+        try:
+            warmed += warm_doctor(doctor_id, days, force)
+        except Exception as e:
+            logger.error(f"Failed to warm caches of doctor {doctor_id}: {str(e)}")
+    return f"Warmed {warmed} cache namespaces for {len(doctor_ids)} doctors"
+
+@shared_task
+def warm_doctor_caches(days=None, force=False, chunk_size=None):
+    """Warm the doctor directory, then fan the doctors out to workers in chunks"""
+    days = days or settings.CACHE_WARM_DAYS
+    chunk_size = chunk_size or settings.CACHE_WARM_CHUNK_SIZE
+
+    warm_doctor_directory(force)
+
+    doctor_ids = list(Doctor.objects.order_by('id').values_list('id', flat=True))
+    chunks = [doctor_ids[i:i + chunk_size] for i in range(0, len(doctor_ids), chunk_size)]
+    for chunk in chunks:
+        warm_doctor_caches_chunk.delay(chunk, days, force)
+
+    return f"Queued {len(chunks)} chunks to warm caches of {len(doctor_ids)} doctors"
+
+@shared_task
+def refresh_day_slots():
+    """Drop past materialized availability and materialize the days entering the horizon"""
+    deleted, _ = DoctorDaySlots.objects.filter(date__lt=timezone.now().date()).delete()
+    ensure_day_slots_horizon()
+    return f"Removed {deleted} past day slots, materialized through {horizon_end()}"
+
+@shared_task
+def rebuild_day_slots(doctor_ids=None):
+    """Recompute the materialized availability of some or all doctors from scratch"""
+    doctors = Doctor.objects.filter(id__in=doctor_ids) if doctor_ids else Doctor.objects.all()
+    rows = materialize_day_slots(doctors.values('id'), timezone.now().date(), horizon_end())
+    cache.set('day_slots_materialized_until', horizon_end(), None)
+    return f"Materialized {rows} day slots"
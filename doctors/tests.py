@@ -5,13 +5,26 @@ from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
-from datetime import time, timedelta, date
+from datetime import date, datetime, time, timedelta
 from django.db import IntegrityError
 from django.core.cache import cache
 from unittest.mock import patch, MagicMock
+from io import StringIO
+from django.core.management import call_command
 
-from .models import Doctor, DoctorSchedule
+from .models import Doctor, DoctorSchedule, DoctorDaySlots, ScheduleException
 from .serializers import DoctorSerializer, DoctorCreateSerializer, DoctorScheduleSerializer
+from .availability import (
+    get_doctor_availability, compute_availability, first_available_slots,
+    compute_slot_bitmaps, ensure_day_slots_horizon, horizon_end
+)
+from .intervals import (
+    ExceptionIndex, merge_intervals, subtract_intervals, slots_within, slots_overlapping, within_schedule
+)
+from .tasks import warm_doctor
+from healthcare.utils import clear_local_cache
+from appointments.models import Appointment
+from patients.models import Patient
 
 
 class DoctorModelTests(TestCase):
@@ -161,4 +174,565 @@ class DoctorSerializerTests(TestCase):
         data['user'] = self.user.id  # User already has doctor profile
         serializer = DoctorCreateSerializer(data=data)
         self.assertFalse(serializer.is_valid())
-        self.assertIn('user', serializer.errors)
\ No newline at end of file
+        self.assertIn('user', serializer.errors)
+
+
+class DoctorCacheWarmingTests(APITestCase):
+    """Test precomputing the doctor caches"""
+    
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        
+        self.user = User.objects.create_user(username='testdoctor', password='TestPass123!')
+        self.doctor = Doctor.objects.create(
+            user=self.user,
+            specialization='GENERAL',
+            license_number='DOC123456',
+            phone_number='+1234567890',
+            years_of_experience=5,
+            consultation_fee=100.00
+        )
+        self.schedule = DoctorSchedule.objects.create(
+            doctor=self.doctor,
+            day_of_week=timezone.now().date().weekday(),
+            start_time=time(9, 0),
+            end_time=time(17, 0),
+            is_available=True
+        )
+        self.patient_user = User.objects.create_user(username='testpatient', password='TestPass123!')
+    
+    def test_warm_caches_command(self):
+        """Test that warmed responses and slots are served without recomputation"""
+        call_command('warm_caches', '--days', '2', stdout=StringIO())
+        
+        self.client.force_authenticate(user=self.patient_user)
+        # Only the lookup of the user's doctor profile, for the cache scope
+        with self.assertNumQueries(1):
+            self.client.get(reverse('doctor-list'))
+            self.client.get(reverse('doctor-schedules', args=[self.doctor.id]))
+        today = timezone.now().date()
+        with self.assertNumQueries(0):
+            get_doctor_availability(self.doctor.id, today, today)
+            get_doctor_availability(self.doctor.id, today, today + timedelta(days=1))
+    
+    def test_unchanged_doctor_is_skipped(self):
+        """Test that only doctors whose data changed since the last run are rewarmed"""
+        self.assertEqual(warm_doctor(self.doctor.id, 2), 2)
+        self.assertEqual(warm_doctor(self.doctor.id, 2), 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.end_time = time(16, 0)
+            self.schedule.save()
+        self.assertEqual(warm_doctor(self.doctor.id, 2), 2)
+        self.assertEqual(warm_doctor(self.doctor.id, 2, force=True), 2)
+
+
+class AvailabilityTests(APITestCase):
+    """Test the availability engine and the available_slots endpoint"""
+    
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        
+        self.user = User.objects.create_user(username='testdoctor', password='TestPass123!')
+        self.doctor = Doctor.objects.create(
+            user=self.user,
+            specialization='GENERAL',
+            license_number='DOC123456',
+            phone_number='+1234567890',
+            years_of_experience=5,
+            consultation_fee=100.00
+        )
+        
+        # Next Monday, with a morning schedule on Mondays only
+        today = timezone.now().date()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        DoctorSchedule.objects.create(
+            doctor=self.doctor,
+            day_of_week=0,
+            start_time=time(9, 0),
+            end_time=time(11, 0),
+            is_available=True
+        )
+        
+        self.patient_user = User.objects.create_user(username='testpatient', password='TestPass123!')
+        self.patient = Patient.objects.create(
+            user=self.patient_user,
+            date_of_birth='1990-01-01',
+            gender='M',
+            phone_number='+1234567890',
+            address='123 Test St',
+            emergency_contact_name='Emergency Contact',
+            emergency_contact_phone='+0987654321'
+        )
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.monday,
+            appointment_time=time(10, 0),
+            reason='Checkup'
+        )
+        self.url = reverse('doctor-available-slots', args=[self.doctor.id])
+        self.client.force_authenticate(user=self.patient_user)
+        ensure_day_slots_horizon()
+    
+    def test_compute_availability(self):
+        """Test that booked slots are excluded and days off are empty, in one query"""
+        with self.assertNumQueries(1):
+            availability = compute_availability([self.doctor.id], self.monday, self.monday + timedelta(days=6))
+        
+        calendar = availability[self.doctor.id]
+        self.assertEqual(len(calendar), 7)
+        self.assertEqual(calendar[self.monday], [time(9, 0), time(9, 30), time(10, 30), time(11, 0)])
+        self.assertEqual(calendar[self.monday + timedelta(days=1)], [])
+    
+    def test_single_date_from_query_string(self):
+        """Test that a date passed in the query string is parsed"""
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['available_slots'], ['09:00:00', '09:30:00', '10:30:00', '11:00:00'])
+    
+    def test_calendar_range(self):
+        """Test that a date range returns one entry per day"""
+        response = self.client.get(self.url, {
+            'start_date': self.monday.isoformat(),
+            'end_date': (self.monday + timedelta(days=13)).isoformat(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        calendar = response.json()['calendar']
+        self.assertEqual(len(calendar), 14)
+        self.assertEqual(calendar[7]['date'], (self.monday + timedelta(days=7)).isoformat())
+        self.assertEqual(len(calendar[7]['available_slots']), 5)
+    
+    def test_invalid_dates(self):
+        """Test that malformed dates and reversed or oversized ranges are rejected"""
+        for params in [
+            {'date': 'tomorrow'},
+            {'date': '2025-02-30'},
+            {'start_date': self.monday.isoformat(), 'end_date': (self.monday - timedelta(days=1)).isoformat()},
+            {'start_date': self.monday.isoformat(), 'end_date': (self.monday + timedelta(days=365)).isoformat()},
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+    
+    def test_first_available_slots_merges_doctors(self):
+        """Test that the earliest slots of several doctors are merged in order, in one query"""
+        other_user = User.objects.create_user(username='otherdoctor', password='TestPass123!')
+        other = Doctor.objects.create(
+            user=other_user,
+            specialization='CARDIO',
+            license_number='DOC654321',
+            phone_number='+1234567890',
+            consultation_fee=100.00
+        )
+        DoctorSchedule.objects.create(
+            doctor=other,
+            day_of_week=0,
+            start_time=time(9, 30),
+            end_time=time(10, 0),
+            is_available=True
+        )
+        
+        with self.assertNumQueries(1):
+            slots = first_available_slots(Doctor.objects.values('id'), self.monday, self.monday, 4)
+        self.assertEqual(slots, [
+            (self.monday, time(9, 0), self.doctor.id),
+            (self.monday, time(9, 30), self.doctor.id),
+            (self.monday, time(9, 30), other.id),
+            (self.monday, time(10, 0), other.id),
+        ])
+        
+        response = self.client.get(reverse('doctor-first-available'), {'specialization': 'CARDIO', 'limit': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({slot['doctor']['id'] for slot in response.json()}, {other.id})
+        self.assertEqual(response.json()[0]['time'], '09:30:00')
+        
+        response = self.client.get(reverse('doctor-first-available'), {'specialization': 'UNKNOWN'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def free_mask(self, day):
+        return DoctorDaySlots.objects.get(doctor=self.doctor, date=day).free_mask
+    
+    def test_booking_and_cancelling_flip_one_bit(self):
+        """Test that materialized slots follow bookings and cancellations"""
+        appointment = Appointment.objects.get(doctor=self.doctor)
+        # Slots 09:00 to 11:00; 10:00 is booked
+        self.assertEqual(self.free_mask(self.monday), 0b11011)
+        
+        appointment.status = 'CANCELLED'
+        appointment.save()
+        self.assertEqual(self.free_mask(self.monday), 0b11111)
+        
+        # A cancelled slot can be booked again
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.monday,
+            appointment_time=time(10, 0),
+            reason='Rebooked'
+        )
+        self.assertEqual(self.free_mask(self.monday), 0b11011)
+        
+        Appointment.objects.filter(status='SCHEDULED').get().delete()
+        self.assertEqual(self.free_mask(self.monday), 0b11111)
+        
+        # Status transitions bypass post_save but free the slot all the same
+        rebooked = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.monday,
+            appointment_time=time(10, 0),
+            reason='Rebooked'
+        )
+        self.assertEqual(self.free_mask(self.monday), 0b11011)
+        self.assertTrue(rebooked.transition('CANCELLED'))
+        self.assertEqual(self.free_mask(self.monday), 0b11111)
+    
+    def test_cancelling_recomputes_the_day_in_place(self):
+        """Test that a cancellation updates the day's row rather than replacing it"""
+        row = DoctorDaySlots.objects.get(doctor=self.doctor, date=self.monday)
+        self.assertTrue(Appointment.objects.get(doctor=self.doctor).transition('CANCELLED'))
+        
+        self.assertEqual(DoctorDaySlots.objects.get(doctor=self.doctor, date=self.monday).id, row.id)
+        self.assertEqual(self.free_mask(self.monday), 0b11111)
+    
+    def test_readers_compute_days_not_materialized(self):
+        """Test that without the horizon marker readers compute the days instead of materializing them"""
+        DoctorDaySlots.objects.all().delete()
+        cache.delete('day_slots_materialized_until')
+        
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.json()['available_slots'], ['09:00:00', '09:30:00', '10:30:00', '11:00:00'])
+        self.assertFalse(DoctorDaySlots.objects.exists())
+        
+        # The refresh_day_slots task materializes them
+        self.assertEqual(ensure_day_slots_horizon(), horizon_end())
+        self.assertEqual(self.free_mask(self.monday), 0b11011)
+    
+    def test_schedule_change_rebuilds_weekday(self):
+        """Test that editing a schedule rebuilds the future dates of its weekday"""
+        schedule = DoctorSchedule.objects.get(doctor=self.doctor)
+        schedule.end_time = time(10, 0)
+        schedule.save()
+        self.assertEqual(self.free_mask(self.monday), 0b011)
+        
+        schedule.day_of_week = 1
+        schedule.save()
+        self.assertFalse(DoctorDaySlots.objects.filter(doctor=self.doctor, date=self.monday).exists())
+        self.assertEqual(self.free_mask(self.monday + timedelta(days=1)), 0b111)
+    
+    def test_materialized_matches_computed(self):
+        """Test that the materialized table agrees with computing from scratch"""
+        end = self.monday + timedelta(days=13)
+        computed = {
+            day: (start, free_mask)
+            for day, (start, length, slot_mask, free_mask) in compute_slot_bitmaps([self.doctor.id], self.monday, end)[self.doctor.id].items()
+        }
+        materialized = {
+            row.date: (row.start_minute, row.free_mask)
+            for row in DoctorDaySlots.objects.filter(doctor=self.doctor, date__range=(self.monday, end))
+        }
+        self.assertEqual(materialized, computed)
+    
+    def test_vacation_blocks_whole_days(self):
+        """Test that a vacation empties the days it covers, both materialized and computed"""
+        ScheduleException.objects.create(
+            doctor=self.doctor,
+            start_date=self.monday,
+            end_date=self.monday + timedelta(days=2),
+            reason='Vacation'
+        )
+        self.assertEqual(self.free_mask(self.monday), 0)
+        
+        availability = compute_availability([self.doctor.id], self.monday, self.monday + timedelta(days=7))[self.doctor.id]
+        self.assertEqual(availability[self.monday], [])
+        self.assertEqual(len(availability[self.monday + timedelta(days=7)]), 5)
+        
+        # Cancelling an appointment inside the vacation does not reopen its slot
+        appointment = Appointment.objects.get()
+        appointment.status = 'CANCELLED'
+        appointment.save()
+        self.assertEqual(self.free_mask(self.monday), 0)
+    
+    def test_blocked_hours(self):
+        """Test that blocked hours remove every slot they overlap"""
+        exception = ScheduleException.objects.create(
+            doctor=self.doctor,
+            start_date=self.monday,
+            end_date=self.monday,
+            start_time=time(9, 15),
+            end_time=time(9, 45)
+        )
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.data['available_slots'], [time(10, 30), time(11, 0)])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            exception.delete()
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.data['available_slots'], [time(9, 0), time(9, 30), time(10, 30), time(11, 0)])
+    
+    def test_booking_blocked_time_is_rejected(self):
+        """Test that appointments cannot be booked into an exception"""
+        ScheduleException.objects.create(
+            doctor=self.doctor,
+            start_date=self.monday,
+            end_date=self.monday,
+            start_time=time(10, 30),
+            end_time=time(12, 0),
+            reason='Conference'
+        )
+        with self.assertRaises(ValidationError):
+            Appointment.objects.create(
+                patient=self.patient,
+                doctor=self.doctor,
+                appointment_date=self.monday,
+                appointment_time=time(10, 30),
+                reason='Checkup'
+            )
+        
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.post(reverse('appointment-list'), {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.monday.isoformat(),
+            'appointment_time': '11:00',
+            'reason': 'Checkup'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_doctor_manages_exceptions(self):
+        """Test that doctors create exceptions for themselves through the API"""
+        self.client.force_authenticate(user=self.user)
+        url = reverse('scheduleexception-list')
+        response = self.client.post(url, {
+            'start_date': self.monday.isoformat(),
+            'end_date': self.monday.isoformat(),
+            'start_time': '09:00'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.post(url, {
+            'start_date': self.monday.isoformat(),
+            'end_date': self.monday.isoformat(),
+            'reason': 'Holiday'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['doctor'], self.doctor.id)
+        
+        self.client.force_authenticate(user=self.patient_user)
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.data['available_slots'], [])
+        
+        # Patients list a doctor's exceptions by a numeric doctor_id only
+        response = self.client.get(url, {'doctor_id': self.doctor.id})
+        self.assertEqual(response.data['count'], 1)
+        for list_url in (url, reverse('doctorschedule-list')):
+            response = self.client.get(list_url, {'doctor_id': 'abc'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['count'], 0)
+
+    def test_long_appointment_takes_overlapping_slots(self):
+        """Test that appointments longer than a slot, or off the grid, take every slot they overlap"""
+        consult = Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.monday,
+            appointment_time=time(9, 0),
+            duration_minutes=60,
+            reason='Consult'
+        )
+        self.assertEqual(consult.end_time, time(10, 0))
+        self.assertEqual(self.free_mask(self.monday), 0b11000)
+        
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=self.monday,
+            appointment_time=time(10, 45),
+            duration_minutes=20,
+            reason='Quick question'
+        )
+        self.assertEqual(self.free_mask(self.monday), 0b00000)
+        self.assertEqual(
+            compute_slot_bitmaps([self.doctor.id], self.monday, self.monday)[self.doctor.id][self.monday][3],
+            0b00000
+        )
+        
+        # Cancelling the consult frees its slots but not the 10:00 appointment's
+        consult.status = 'CANCELLED'
+        consult.save()
+        self.assertEqual(self.free_mask(self.monday), 0b00011)
+    
+    def test_overlapping_appointments_are_rejected(self):
+        """Test that conflicts are detected as interval overlap, not equal start times"""
+        with self.assertRaises(ValidationError):
+            Appointment.objects.create(
+                patient=self.patient,
+                doctor=self.doctor,
+                appointment_date=self.monday,
+                appointment_time=time(9, 15),
+                duration_minutes=60,
+                reason='Consult'
+            )
+        
+        url = reverse('appointment-list')
+        data = {
+            'patient': self.patient.id,
+            'doctor': self.doctor.id,
+            'appointment_date': self.monday.isoformat(),
+            'appointment_time': '09:30',
+            'duration_minutes': 60,
+            'reason': 'Consult'
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        data['appointment_time'] = '09:00'
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Appointment.objects.get(appointment_time=time(9, 0)).end_time, time(10, 0))
+    
+    def test_doctor_slot_length(self):
+        """Test that the slot grid follows the doctor's slot length"""
+        self.doctor.slot_minutes = 60
+        self.doctor.save()
+        
+        response = self.client.get(self.url, {'date': self.monday.isoformat()})
+        self.assertEqual(response.data['available_slots'], [time(9, 0), time(11, 0)])
+        self.assertEqual(self.free_mask(self.monday), 0b101)
+
+    def test_working_day_slot_cap(self):
+        """Test that schedules and slot lengths giving a day over MAX_DAY_SLOTS slots are rejected with 400"""
+        self.doctor.slot_minutes = 10
+        self.doctor.save()
+        self.client.force_authenticate(user=self.user)
+        url = reverse('doctorschedule-list')
+        data = {'day_of_week': 1, 'start_time': '08:00:00', 'end_time': '19:00:00', 'is_available': True}
+        
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('end_time', response.data['details'])
+        
+        # 08:00 to 18:20 is exactly MAX_DAY_SLOTS slots of 10 minutes
+        response = self.client.post(url, dict(data, end_time='18:20:00'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        response = self.client.patch(reverse('doctor-detail', args=[self.doctor.id]), {'slot_minutes': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('slot_minutes', response.data['details'])
+        self.doctor.slot_minutes = 5
+        with self.assertRaises(ValidationError):
+            self.doctor.full_clean()
+    
+    def test_availability_calendar(self):
+        """Test free-slot counts per day of a month, cached per doctor and month"""
+        url = reverse('doctor-availability-calendar', args=[self.doctor.id])
+        month = self.monday.strftime('%Y-%m')
+        response = self.client.get(url, {'month': month})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['month'], month)
+        
+        days = {day['date']: day['free_slots'] for day in response.data['days']}
+        self.assertEqual(min(days), self.monday.replace(day=1))
+        self.assertEqual(days[self.monday], 4)
+        # Today's count depends on the time of day (see test_calendar_from_mid_month)
+        today = timezone.now().date()
+        for day, free_slots in days.items():
+            if day not in (self.monday, today):
+                self.assertEqual(free_slots, 5 if day.weekday() == 0 and day > today else 0)
+        self.assertEqual(response.data['total_free_slots'], sum(days.values()))
+        
+        # Only the doctor lookup; the counts come from the cache
+        with self.assertNumQueries(1):
+            self.client.get(url, {'month': month})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.get().delete()
+        response = self.client.get(url, {'month': month})
+        self.assertEqual({day['date']: day['free_slots'] for day in response.data['days']}[self.monday], 5)
+        
+        for invalid in ['2025-13', 'May', '2025-05-01']:
+            response = self.client.get(url, {'month': invalid})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_calendar_from_mid_month(self):
+        """Test that past days and the slots already started today are not reported free"""
+        # A Monday in the middle of a month at least a week ahead, at 10:15
+        today = self.monday + timedelta(days=7)
+        while not 8 <= today.day <= 21:
+            today += timedelta(days=7)
+        now = timezone.make_aware(datetime.combine(today, time(10, 15)))
+        
+        url = reverse('doctor-availability-calendar', args=[self.doctor.id])
+        with patch('django.utils.timezone.now', return_value=now):
+            response = self.client.get(url, {'month': today.strftime('%Y-%m')})
+            day_response = self.client.get(self.url, {'date': today.isoformat()})
+            past_response = self.client.get(self.url, {'date': (today - timedelta(days=7)).isoformat()})
+        
+        days = {day['date']: day['free_slots'] for day in response.data['days']}
+        for day, free_slots in days.items():
+            if day < today:
+                self.assertEqual(free_slots, 0)
+            elif day > today:
+                self.assertEqual(free_slots, 5 if day.weekday() == 0 else 0)
+        # 09:00, 09:30 and 10:00 have started
+        self.assertEqual(days[today], 2)
+        self.assertEqual(day_response.data['available_slots'], [time(10, 30), time(11, 0)])
+        self.assertEqual(past_response.data['available_slots'], [])
+
+class IntervalTests(TestCase):
+    """Test the interval arithmetic behind schedule exceptions"""
+    
+    def test_within_schedule_follows_the_capped_grid(self):
+        """Test that bookings past MAX_DAY_SLOTS slots of a day are outside the schedule, as in the grid"""
+        # 08:00 to 19:00 in 10 minute slots: the grid stops after 18:20
+        self.assertTrue(within_schedule(time(8, 0), time(19, 0), 10, time(18, 20), time(18, 30)))
+        self.assertFalse(within_schedule(time(8, 0), time(19, 0), 10, time(18, 50), time(19, 0)))
+        self.assertTrue(within_schedule(time(9, 0), time(17, 0), 30, time(17, 0), time(17, 30)))
+    
+    def test_merge_and_subtract(self):
+        """Test merging overlapping intervals and removing blocked ones"""
+        self.assertEqual(merge_intervals([(60, 120), (0, 30), (100, 150), (150, 160)]), [(0, 30), (60, 160)])
+        self.assertEqual(
+            subtract_intervals([(0, 100), (200, 300)], [(-10, 10), (50, 60), (90, 210), (290, 400)]),
+            [(10, 50), (60, 90), (210, 290)]
+        )
+        self.assertEqual(subtract_intervals([(0, 100)], [(0, 100)]), [])
+    
+    def test_slots_within(self):
+        """Test that only slots lying entirely inside the intervals are kept"""
+        # Slots at 0, 30, 60, 90 and 120
+        self.assertEqual(slots_within([(0, 150)], 0, 5, 30), 0b11111)
+        self.assertEqual(slots_within([(10, 90), (120, 200)], 0, 5, 30), 0b10110)
+        self.assertEqual(slots_within([], 0, 5, 30), 0)
+    
+    def test_slots_overlapping(self):
+        """Test that every slot sharing a minute with the interval is selected"""
+        self.assertEqual(slots_overlapping((0, 60), 0, 5, 30), 0b00011)
+        self.assertEqual(slots_overlapping((45, 75), 0, 5, 30), 0b00110)
+        self.assertEqual(slots_overlapping((-30, 0), 0, 5, 30), 0)
+        self.assertEqual(slots_overlapping((100, 500), 0, 5, 30), 0b11000)
+    
+    def test_exception_index(self):
+        """Test looking up the merged intervals blocked on a date"""
+        day = date(2030, 1, 1)
+        index = ExceptionIndex([
+            (1, day, day + timedelta(days=9), 600, 660),
+            (1, day + timedelta(days=5), day + timedelta(days=5), 0, 24 * 60),
+            (1, day + timedelta(days=2), day + timedelta(days=3), 630, 720),
+            (2, day, day, 0, 60),
+        ])
+        self.assertEqual(index.blocked(1, day - timedelta(days=1)), [])
+        self.assertEqual(index.blocked(1, day), [(600, 660)])
+        self.assertEqual(index.blocked(1, day + timedelta(days=3)), [(600, 720)])
+        self.assertEqual(index.blocked(1, day + timedelta(days=5)), [(0, 24 * 60)])
+        self.assertEqual(index.blocked(1, day + timedelta(days=9)), [(600, 660)])
+        self.assertEqual(index.blocked(1, day + timedelta(days=10)), [])
+        self.assertEqual(index.blocked(3, day), [])
+        
+        self.assertTrue(index.blocks(1, day, 630, 660))
+        self.assertTrue(index.blocks(1, day, 570, 601))
+        self.assertFalse(index.blocks(1, day, 570, 600))
+        self.assertFalse(index.blocks(1, day, 660, 690))
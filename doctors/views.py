@@ -23,13 +23,13 @@ def dashboard(request):
     today = timezone.now().date()
     
     # Get today's appointments
-    today_appointments = Appointment.objects.filter(
+    today_appointments = Appointment.objects.for_display().filter(
         doctor=doctor,
         appointment_date=today
     ).order_by('appointment_time')
     
     # Get upcoming appointments (excluding today)
-    upcoming_appointments = Appointment.objects.filter(
+    upcoming_appointments = Appointment.objects.for_display().filter(
         doctor=doctor,
         appointment_date__gt=today,
         status__in=['SCHEDULED', 'CONFIRMED']
@@ -195,7 +195,7 @@ def appointments_list(request):
     date_from = request.GET.get('date_from', '')
     date_to = request.GET.get('date_to', '')
     
-    appointments = Appointment.objects.filter(doctor=doctor)
+    appointments = Appointment.objects.for_display().filter(doctor=doctor)
     
     if status_filter:
         appointments = appointments.filter(status=status_filter)
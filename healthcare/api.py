@@ -0,0 +1,14 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from .permissions import IsAdminUser
+from .utils import get_cache_stats
+
+class CacheStatsView(APIView):
+    
+    #Hit rate, recompute cost, payload size and invalidations per cache family.
+    
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(get_cache_stats())
@@ -4,9 +4,10 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
 
-from doctors.api import DoctorViewSet, DoctorScheduleViewSet
+from doctors.api import DoctorViewSet, DoctorScheduleViewSet, ScheduleExceptionViewSet
 from appointments.api import AppointmentViewSet
 from patients.api import PatientViewSet
+from .api import CacheStatsView
 
 # Create a schema view for API documentation
 schema_view = get_schema_view(
@@ -27,6 +28,7 @@ router = DefaultRouter()
 router.register(r'patients', PatientViewSet)
 router.register(r'doctors', DoctorViewSet)
 router.register(r'doctor-schedules', DoctorScheduleViewSet)
+router.register(r'schedule-exceptions', ScheduleExceptionViewSet)
 router.register(r'appointments', AppointmentViewSet)
 
 # The API URLs are now determined automatically by the router
@@ -37,6 +39,7 @@ urlpatterns = [
     
     # API endpoints
     path('', include(router.urls)),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
     
     # Authentication
     path('auth/', include('oauth2_provider.urls', namespace='oauth2_provider')),
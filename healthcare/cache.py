@@ -0,0 +1,74 @@
+import pickle
+import zlib
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.compressors.zlib import ZlibCompressor
+
+# Cache values whose pickle is at least CACHE_COMPRESS_MIN_LENGTH bytes are
+# stored zlib-compressed. Rendered API responses and the analytics payload are
+# repetitive JSON and shrink several times over; small values such as
+# generation counters and locks are stored as they are, so INCR keeps working.
+
+
+def _compress_min_length():
+    return getattr(settings, 'CACHE_COMPRESS_MIN_LENGTH', 1024)
+
+
+def _compress_level():
+    return getattr(settings, 'CACHE_COMPRESS_LEVEL', 6)
+
+
+class ThresholdZlibCompressor(ZlibCompressor):
+
+    # django-redis compressor, configured with OPTIONS['COMPRESSOR']. Values
+    # below the threshold are left alone; django-redis reads them back as they
+    # are when decompression fails.
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.min_length = _compress_min_length()
+        self.preset = _compress_level()
+
+
+class CompressedValue:
+
+    # zlib-compressed pickle of a value stored in a CompressedLocMemCache
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce__(self):
+        return (CompressedValue, (self.data,))
+
+
+def compress_value(value):
+    pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(pickled) < _compress_min_length():
+        return value
+    return CompressedValue(zlib.compress(pickled, _compress_level()))
+
+
+def decompress_value(value):
+    if isinstance(value, CompressedValue):
+        return pickle.loads(zlib.decompress(value.data))
+    return value
+
+
+class CompressedLocMemCache(LocMemCache):
+
+    # LocMemCache that compresses large values the same way
+    # ThresholdZlibCompressor does on Redis, so development and tests exercise
+    # the same trade-off.
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return super().add(key, compress_value(value), timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, compress_value(value), timeout, version)
+
+    def get(self, key, default=None, version=None):
+        return decompress_value(super().get(key, default, version))
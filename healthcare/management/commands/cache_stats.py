@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from healthcare.utils import get_cache_stats, reset_cache_stats
+
+class Command(BaseCommand):
+    help = 'Print cache hit rate, recompute cost, payload size and invalidations per key family'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Clear the collected statistics after printing them')
+    
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        
+        if not stats:
+            self.stdout.write('No cache statistics recorded yet.')
+        else:
+            columns = ['family', 'hits', 'misses', 'hit rate', 'stale', '304', 'avg ms', 'avg bytes', 'invalidations']
+            rows = [
+                [
+                    family,
+                    str(family_stats['hits']),
+                    str(family_stats['misses'] + family_stats['early_refreshes']),
+                    self.format(family_stats['hit_rate'], '{:.1%}'),
+                    str(family_stats['stale_served']),
+                    str(family_stats['not_modified']),
+                    self.format(family_stats['avg_compute_ms'], '{:.1f}'),
+                    self.format(family_stats['avg_bytes'], '{:,}'),
+                    str(family_stats['invalidations']),
+                ]
+                for family, family_stats in stats.items()
+            ]
+            widths = [max(len(row[i]) for row in [columns] + rows) for i in range(len(columns))]
+            
+            self.stdout.write('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+            self.stdout.write('  '.join('-' * width for width in widths))
+            for row in rows:
+                self.stdout.write('  '.join(
+                    value.ljust(width) if i == 0 else value.rjust(width)
+                    for i, (value, width) in enumerate(zip(row, widths))
+                ))
+            
+            self.stdout.write('')
+            self.stdout.write(
+                f'Timeouts: APPOINTMENT_CACHE_TIMEOUT={settings.APPOINTMENT_CACHE_TIMEOUT}s, '
+                f'DOCTOR_CACHE_TIMEOUT={settings.DOCTOR_CACHE_TIMEOUT}s, '
+                f'PATIENT_CACHE_TIMEOUT={settings.PATIENT_CACHE_TIMEOUT}s'
+            )
+        
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Cache statistics reset.'))
+    
+    def format(self, value, spec):
+        return '-' if value is None else spec.format(value)
@@ -0,0 +1,62 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON renderer and parser on orjson, enabled in REST_FRAMEWORK's
+# DEFAULT_RENDERER_CLASSES and DEFAULT_PARSER_CLASSES (see FAST_JSON in
+# settings). orjson encodes dates, times, datetimes and UUIDs natively;
+# everything else it cannot encode, such as Decimal, lazy translations and
+# querysets, goes through DRF's encoder as with JSONRenderer. Output matches
+# JSONRenderer's compact output except that datetimes passed as objects rather
+# than through a serializer field keep their microseconds. Without orjson
+# installed both classes behave as the DRF ones they extend.
+
+_ENCODE_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) if orjson else 0
+_default = JSONEncoder().default
+_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+class ORJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        options = _ENCODE_OPTIONS
+        # orjson only indents by two spaces, whatever indent was asked for
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+
+        ret = orjson.dumps(data, default=_default, option=options)
+
+        # Escaped by JSONRenderer so the output is a strict subset of
+        # JavaScript; searching first spares copying payloads without them
+        for separator, escaped in _SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
+
+class ORJSONParser(JSONParser):
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        try:
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
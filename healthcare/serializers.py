@@ -0,0 +1,281 @@
+from operator import itemgetter
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import permissions, serializers
+from rest_framework.response import Response
+
+# Sparse fieldsets and opt-in expansion. Serializers with DynamicFieldsMixin
+# honour two query parameters of the request in their context:
+#
+#   ?fields=id,appointment_date,patient.full_name  only these fields; dotted
+#                                                  names reach into nested
+#                                                  serializers
+#   ?expand=patient                                render these relations
+#                                                  nested and the others as
+#                                                  primary keys
+#
+# Without ?expand= a serializer expands its default_expand relations, as it
+# always has. ?fields= only prunes on reads: a PUT or PATCH validates every
+# field it sends, so none is dropped for not being listed. On reads
+# select_for_serializer() then joins and loads only what the pruned
+# serializer renders, so unrequested relations are never JOINed and
+# unrequested columns never read.
+
+SPARSE_FIELDSET_PARAMS = ('fields', 'expand')
+
+def parse_field_list(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+def _names_at(paths, path):
+    # The names that dotted `paths` select at the level of a nested serializer
+    # at `path`, and those that reach deeper than that level
+    depth = len(path)
+    names, deeper = set(), set()
+    for dotted in paths:
+        parts = dotted.split('.')
+        if len(parts) > depth and parts[:depth] == path:
+            names.add(parts[depth])
+            if len(parts) > depth + 1:
+                deeper.add(parts[depth])
+    return names, deeper
+
+class DynamicFieldsMixin:
+
+    # expandable_fields maps relation fields to the serializer class that
+    # renders them nested. field_sources lists the model fields computed
+    # fields read, e.g. a SerializerMethodField or a get_FOO_display source,
+    # and field_values the function of those fields' values that computes
+    # them, for values_renderer().
+
+    expandable_fields = {}
+    default_expand = ()
+    field_sources = {}
+    field_values = {}
+
+    def _requested(self, param):
+        request = self.context.get('request')
+        if request is None or param not in request.query_params:
+            return None
+        if param == 'fields' and request.method not in permissions.SAFE_METHODS:
+            return None
+        return parse_field_list(request.query_params[param])
+
+    def _path(self):
+        # Field names from the root serializer down to this one
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return names[::-1]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        path = self._path()
+
+        requested = self._requested('fields')
+        deeper = set()
+        if requested:
+            names, deeper = _names_at(requested, path)
+            if names:
+                fields = {name: field for name, field in fields.items() if name in names}
+
+        expand = self._requested('expand')
+        expanded = set(self.default_expand) if expand is None else _names_at(expand, path)[0]
+        # Asking for fields inside a relation expands it
+        expanded |= deeper
+        for name, serializer_class in self.expandable_fields.items():
+            if name in fields:
+                fields[name] = serializer_class(read_only=True) if name in expanded else serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+def _resolve(model, path):
+
+    # The relations to JOIN and the column to load for a model field path
+    # such as 'patient__user__first_name'. None if the path is not a chain of
+    # forward relations ending in a field.
+
+    parts = path.split('__')
+    related = []
+    for i, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if i == len(parts) - 1:
+            return (related, path) if field.concrete else None
+        if not (field.many_to_one or field.one_to_one) or not field.concrete:
+            return None
+        related.append('__'.join(parts[:i + 1]))
+        model = field.related_model
+
+def query_plan(serializer):
+
+    # The select_related paths and only() columns a model serializer reads,
+    # following nested model serializers; None if some field reads something
+    # the plan cannot tell, in which case nothing should be pruned.
+
+    model = serializer.Meta.model
+    related, columns = [], [model._meta.pk.name]
+    field_sources = getattr(serializer, 'field_sources', {})
+
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.ModelSerializer):
+            nested = query_plan(field)
+            resolved = _resolve(model, field.source.replace('.', '__'))
+            if nested is None or resolved is None:
+                return None
+            source = resolved[1]
+            related += resolved[0] + [source] + [f'{source}__{path}' for path in nested[0]]
+            columns += [source] + [f'{source}__{column}' for column in nested[1]]
+            continue
+
+        if name in field_sources:
+            sources = field_sources[name]
+        elif field.source == '*' or isinstance(field, serializers.BaseSerializer):
+            return None
+        else:
+            sources = [field.source.replace('.', '__')]
+        for source in sources:
+            resolved = _resolve(model, source)
+            if resolved is None:
+                return None
+            related += resolved[0]
+            columns += resolved[0] + [resolved[1]]
+
+    return list(dict.fromkeys(related)), list(dict.fromkeys(columns))
+
+def select_for_serializer(queryset, serializer):
+
+    # Restrict a queryset to the relations and columns the serializer that
+    # renders it reads. Querysets are returned as they are if it cannot tell.
+
+    plan = query_plan(serializer)
+    if plan is None:
+        return queryset
+    related, columns = plan
+    queryset = queryset.select_related(None)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*columns)
+
+# Read-only fast path for list endpoints. A ModelSerializer builds a model
+# instance per row and walks its fields per instance; values_renderer()
+# instead compiles a serializer once into the values_list() columns it reads
+# and one accessor per field, and builds each row's dict straight from the
+# row tuple, in the same JSON shape. Fields whose DRF representation is the
+# database value itself are read as they are; others go through their
+# field's to_representation.
+
+_VERBATIM_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.ChoiceField,
+    serializers.ReadOnlyField,
+)
+
+def _index(columns, path):
+    return columns.setdefault(path, len(columns))
+
+def _value_getter(field, index):
+    if isinstance(field, _VERBATIM_FIELDS) or (
+        isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None
+    ):
+        return itemgetter(index)
+    if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+        # Look the current timezone up once per list rather than per value
+        field.timezone = field.default_timezone()
+    convert = field.to_representation
+    return lambda row: None if row[index] is None else convert(row[index])
+
+def _display_getter(field, choices, index):
+    convert = field.to_representation
+    return lambda row: None if row[index] is None else convert(choices.get(row[index], row[index]))
+
+def _computed_getter(function, indexes):
+    return lambda row: function(*[row[index] for index in indexes])
+
+def _nested_getter(represent, index):
+    return lambda row: None if row[index] is None else represent(row)
+
+def _compile(serializer, prefix, columns):
+
+    # A function building the representation of a row for a model
+    # serializer reached through the relation path `prefix`, registering the
+    # columns it reads; None if some field cannot be read from columns.
+
+    model = serializer.Meta.model
+    field_sources = getattr(serializer, 'field_sources', {})
+    field_values = getattr(serializer, 'field_values', {})
+    getters = []
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if isinstance(field, serializers.ModelSerializer):
+            resolved = _resolve(model, field.source.replace('.', '__'))
+            if resolved is None:
+                return None
+            source = prefix + resolved[1]
+            nested = _compile(field, f'{source}__', columns)
+            if nested is None:
+                return None
+            getters.append((name, _nested_getter(nested, _index(columns, source))))
+            continue
+
+        if name in field_values:
+            sources = field_sources[name]
+            if any(_resolve(model, source) is None for source in sources):
+                return None
+            getter = _computed_getter(field_values[name], [_index(columns, prefix + source) for source in sources])
+        elif field.source.startswith('get_') and field.source.endswith('_display'):
+            # Model.get_FOO_display, from FOO's choices
+            try:
+                model_field = model._meta.get_field(field.source[4:-8])
+            except FieldDoesNotExist:
+                return None
+            if not model_field.choices:
+                return None
+            getter = _display_getter(field, dict(model_field.flatchoices), _index(columns, prefix + model_field.name))
+        elif field.source == '*' or isinstance(field, serializers.BaseSerializer):
+            return None
+        else:
+            resolved = _resolve(model, field.source.replace('.', '__'))
+            if resolved is None:
+                return None
+            getter = _value_getter(field, _index(columns, prefix + resolved[1]))
+        getters.append((name, getter))
+
+    return lambda row: {name: getter(row) for name, getter in getters}
+
+def values_renderer(serializer):
+
+    # The values_list() columns of a model serializer's model, and a function
+    # building the serializer's representation of one row of them; None if
+    # the serializer reads something that is not a column.
+
+    columns = {}
+    represent = _compile(serializer, '', columns)
+    if represent is None:
+        return None
+    return list(columns), represent
+
+def list_response(view, queryset, serializer):
+
+    # The paginated list response of a view as `serializer`, an instance
+    # carrying the view's context, renders it: from values_list() rows when
+    # values_renderer() can compile it, through the serializer otherwise.
+
+    renderer = values_renderer(serializer)
+    if renderer is None:
+        rows, represent = queryset, lambda page: type(serializer)(page, many=True, context=serializer.context).data
+    else:
+        columns, represent_row = renderer
+        rows, represent = queryset.values_list(*columns), lambda page: [represent_row(row) for row in page]
+
+    page = view.paginate_queryset(rows)
+    if page is not None:
+        return view.get_paginated_response(represent(page))
+    return Response(represent(rows))
@@ -7,6 +7,8 @@ Generated by 'django-admin startproject' using Django 5.2.1.
 import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Try to import decouple, but provide fallback if not available
 try:
     from decouple import config
@@ -48,6 +50,7 @@ INSTALLED_APPS = [
     'drf_yasg',
     'oauth2_provider',
     'authenticator',
+    'healthcare',
 ]
 
 MIDDLEWARE = [
@@ -149,8 +152,21 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Render and parse API JSON with orjson (healthcare/renderers.py); falls back
+# to the stdlib json renderer and parser when orjson is not installed
+FAST_JSON = config('FAST_JSON', default=True, cast=bool)
+
 # Django REST Framework
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'healthcare.renderers.ORJSONRenderer' if FAST_JSON else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'healthcare.renderers.ORJSONParser' if FAST_JSON else 'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
         'rest_framework.authentication.SessionAuthentication',
@@ -206,6 +222,14 @@ if REDIS_URL and REDIS_URL != 'redis://localhost:6379/0':
             'task': 'appointments.tasks.send_appointment_reminder',
             'schedule': 3600.0,  # Run every hour
         },
+        'refresh_day_slots': {
+            'task': 'doctors.tasks.refresh_day_slots',
+            'schedule': 3600.0,  # Run every hour; extends the horizon once a day
+        },
+        'warm_doctor_caches': {
+            'task': 'doctors.tasks.warm_doctor_caches',
+            'schedule': 300.0,  # Run every 5 minutes; unchanged doctors are skipped
+        },
     }
 
 # Cache Configuration
@@ -219,6 +243,7 @@ if REDIS_CACHE_URL:
             "LOCATION": REDIS_CACHE_URL,
             "OPTIONS": {
                 "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                "COMPRESSOR": "healthcare.cache.ThresholdZlibCompressor",
             }
         }
     }
@@ -226,7 +251,7 @@ else:
     # Local memory cache for development
     CACHES = {
         'default': {
-            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'BACKEND': 'healthcare.cache.CompressedLocMemCache',
             'LOCATION': 'healthcare-cache',
         }
     }
@@ -234,6 +259,48 @@ else:
 # Cache timeouts in seconds
 CACHE_MIDDLEWARE_SECONDS = 60 * 15  # 15 minutes
 CACHE_MIDDLEWARE_KEY_PREFIX = 'healthcare'
+APPOINTMENT_CACHE_TIMEOUT = config('APPOINTMENT_CACHE_TIMEOUT', default=60 * 5, cast=int)  # 5 minutes
+DOCTOR_CACHE_TIMEOUT = config('DOCTOR_CACHE_TIMEOUT', default=60 * 30, cast=int)  # 30 minutes
+PATIENT_CACHE_TIMEOUT = config('PATIENT_CACHE_TIMEOUT', default=60 * 15, cast=int)  # 15 minutes
+
+# Cache stampede protection (see healthcare.utils.get_cached_data)
+CACHE_LOCK_TIMEOUT = 10  # Seconds a recompute lock is held at most
+CACHE_LOCK_WAIT = 1.0  # Seconds a caller waits for another worker's result
+CACHE_STALE_TTL = 60  # Seconds a stale value is kept for contended callers
+CACHE_EARLY_REFRESH_BETA = 1.0  # XFetch aggressiveness; 0 disables early refresh
+
+# Per-process LRU tier in front of CACHES['default'] for rarely changing cache families.
+# Other processes' invalidations are seen within CACHE_LOCAL_GENERATION_TTL seconds.
+CACHE_LOCAL_FAMILIES = ['doctors', 'schedules_doctor']
+CACHE_LOCAL_MAX_ENTRIES = 1000
+CACHE_LOCAL_TIMEOUT = 60  # Seconds
+CACHE_LOCAL_GENERATION_TTL = 2  # Seconds
+
+# Cached values whose pickle is at least this many bytes are stored zlib-compressed
+# (see healthcare/cache.py and benchmarks/cache_compression.py)
+CACHE_COMPRESS_MIN_LENGTH = config('CACHE_COMPRESS_MIN_LENGTH', default=1024, cast=int)
+CACHE_COMPRESS_LEVEL = config('CACHE_COMPRESS_LEVEL', default=6, cast=int)
+
+# Availability calendar (GET /api/v1/doctors/{id}/available-slots/?start_date=&end_date=)
+AVAILABILITY_DEFAULT_DAYS = 14  # Days returned when only start_date is given
+AVAILABILITY_MAX_DAYS = 62  # Longest range one request may ask for
+AVAILABILITY_HORIZON_DAYS = 90  # Days ahead kept materialized in DoctorDaySlots
+
+# Slot holds (POST /api/v1/appointments/hold/, appointments/holds.py)
+SLOT_HOLD_TIMEOUT = 300  # Seconds a patient's hold on a slot lasts
+BULK_APPOINTMENT_MAX_ITEMS = 1000  # Appointments one bulk_create request may book
+
+# Idempotency-Key replay of appointment-creating requests (see healthcare.utils.idempotent)
+IDEMPOTENCY_KEY_TIMEOUT = config('IDEMPOTENCY_KEY_TIMEOUT', default=60 * 60 * 24, cast=int)  # 24 hours
+IDEMPOTENCY_LOCK_TIMEOUT = 30  # Seconds a retry is answered 409 while the first request runs
+
+# Cache warming (manage.py warm_caches, doctors.tasks.warm_doctor_caches)
+CACHE_WARM_DAYS = config('CACHE_WARM_DAYS', default=AVAILABILITY_DEFAULT_DAYS, cast=int)  # Days of available slots to precompute
+CACHE_WARM_CHUNK_SIZE = 50  # Doctors per Celery task
+
+# Cache statistics per key family (GET /api/v1/cache-stats/, manage.py cache_stats)
+CACHE_STATS_FLUSH_INTERVAL = 10  # Seconds between adding a process's counts to the shared totals
+CACHE_STATS_SIZE_SAMPLE_RATE = 0.1  # Fraction of stored entries pickled to estimate their average size
 
 # Logging Configuration
 LOGGING = {
@@ -303,6 +370,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8080",
 ]
 
+# Let browser clients send Idempotency-Key on retried bookings
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
 # Additional CORS settings for development
 if DEBUG:
     CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL_ORIGINS', default=False, cast=bool)
@@ -0,0 +1,487 @@
+import time
+import uuid
+from datetime import date, time as dt_time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework import serializers, status
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from .utils import (
+    get_cache_generation,
+    versioned_cache_key,
+    invalidate_cache_namespace,
+    invalidate_cache_namespace_on_commit,
+    get_cached_data,
+    get_cache_metrics,
+    get_cache_stats,
+    reset_cache_stats,
+    clear_local_cache,
+    cache_family,
+    LocalCache,
+    canonical_query_params,
+    _CacheEntry,
+    _register_cache_stats_families,
+)
+from .cache import CompressedLocMemCache, CompressedValue, ThresholdZlibCompressor
+from .renderers import ORJSONParser, ORJSONRenderer
+from .serializers import values_renderer
+from appointments.api import AppointmentViewSet
+from appointments.models import Appointment
+from appointments.serializers import AppointmentSerializer
+from doctors.models import Doctor, DoctorSchedule
+from doctors.serializers import DoctorSerializer
+from patients.models import Patient, MedicalRecord
+from patients.serializers import PatientSerializer, MedicalRecordSerializer
+
+
+class CacheNamespaceTests(TestCase):
+    """Test generation-counter cache namespaces"""
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+
+    def test_generation_is_stable_until_invalidated(self):
+        """Test that a namespace keeps its generation between reads"""
+        generation = get_cache_generation('appointments_user_1')
+        self.assertEqual(get_cache_generation('appointments_user_1'), generation)
+
+        invalidate_cache_namespace('appointments_user_1')
+        self.assertEqual(get_cache_generation('appointments_user_1'), generation + 1)
+
+    def test_versioned_key_changes_after_invalidation(self):
+        """Test that invalidation orphans keys built with the old generation"""
+        old_key = versioned_cache_key('schedules_doctor_1', 'page=2')
+        invalidate_cache_namespace('schedules_doctor_1')
+        new_key = versioned_cache_key('schedules_doctor_1', 'page=2')
+
+        self.assertNotEqual(old_key, new_key)
+        self.assertTrue(new_key.startswith('schedules_doctor_1:'))
+        self.assertTrue(new_key.endswith(':page=2'))
+
+    def test_invalidation_is_scoped_to_namespace(self):
+        """Test that invalidating one namespace leaves the others alone"""
+        other_key = versioned_cache_key('appointments_user_2')
+        invalidate_cache_namespace('appointments_user_1')
+        self.assertEqual(versioned_cache_key('appointments_user_2'), other_key)
+
+    def test_invalidating_unknown_namespace(self):
+        """Test that invalidating a namespace that was never read does not fail"""
+        invalidate_cache_namespace('available_slots_doctor_99')
+        self.assertIsNotNone(cache.get('cache_generation:available_slots_doctor_99'))
+
+    def test_get_cached_data_recomputes_after_invalidation(self):
+        """Test that cached data is recomputed once its namespace is invalidated"""
+        calls = []
+
+        def query():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_cached_data(versioned_cache_key('doctors_user_1'), 60, query), 1)
+        self.assertEqual(get_cached_data(versioned_cache_key('doctors_user_1'), 60, query), 1)
+
+        invalidate_cache_namespace('doctors_user_1')
+        self.assertEqual(get_cached_data(versioned_cache_key('doctors_user_1'), 60, query), 2)
+
+    def test_on_commit_invalidations_are_coalesced(self):
+        """Test that a namespace queued several times in a transaction is invalidated once"""
+        generation = get_cache_generation('doctors')
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(5):
+                invalidate_cache_namespace_on_commit('doctors')
+            self.assertEqual(get_cache_generation('doctors'), generation)
+        self.assertEqual(get_cache_generation('doctors'), generation + 1)
+
+
+def count_calls(calls, value='fresh'):
+    def query():
+        calls.append(1)
+        return value
+    return query
+
+
+class CacheStampedeTests(TestCase):
+    """Test single-flight recomputation and early refresh in get_cached_data"""
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+
+    def test_contended_miss_serves_stale_value(self):
+        """Test that callers losing the recompute lock get the stale value"""
+        calls = []
+        query = count_calls(calls)
+        cache.set('slots', _CacheEntry('stale', time.time() - 1, 0.01), 60)
+        cache.add('lock:slots', 1, 10)
+
+        self.assertEqual(get_cached_data('slots', 60, query), 'stale')
+        self.assertEqual(calls, [])
+
+        site = f'{query.__module__}.{query.__qualname__}'
+        self.assertEqual(get_cache_metrics()[site]['contention'], 1)
+        self.assertEqual(get_cache_metrics()[site]['stale_served'], 1)
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_contended_miss_without_value_waits_then_computes(self):
+        """Test that a caller with nothing to serve waits briefly, then computes"""
+        calls = []
+        cache.add('lock:analytics', 1, 10)
+
+        self.assertEqual(get_cached_data('analytics', 60, count_calls(calls)), 'fresh')
+        self.assertEqual(calls, [1])
+
+    def test_expired_entry_is_recomputed_by_lock_holder(self):
+        """Test that the caller acquiring the lock recomputes and releases it"""
+        calls = []
+        cache.set('slots', _CacheEntry('stale', time.time() - 1, 0.01), 60)
+
+        self.assertEqual(get_cached_data('slots', 60, count_calls(calls)), 'fresh')
+        self.assertEqual(calls, [1])
+        self.assertIsNone(cache.get('lock:slots'))
+        self.assertEqual(get_cached_data('slots', 60, count_calls(calls)), 'fresh')
+        self.assertEqual(calls, [1])
+
+    def test_expensive_entry_is_refreshed_before_expiry(self):
+        """Test that an entry close to expiry and costly to compute refreshes early"""
+        calls = []
+        cache.set('analytics', _CacheEntry('old', time.time() + 1, 1000.0), 60)
+
+        self.assertEqual(get_cached_data('analytics', 60, count_calls(calls)), 'fresh')
+        self.assertEqual(calls, [1])
+
+    @override_settings(CACHE_EARLY_REFRESH_BETA=0)
+    def test_early_refresh_can_be_disabled(self):
+        """Test that beta=0 only recomputes after the logical expiry"""
+        calls = []
+        cache.set('analytics', _CacheEntry('old', time.time() + 1, 1000.0), 60)
+
+        self.assertEqual(get_cached_data('analytics', 60, count_calls(calls)), 'old')
+        self.assertEqual(calls, [])
+
+
+class LocalCacheTierTests(TestCase):
+    """Test the per-process tier in front of the shared cache"""
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        local = LocalCache(max_entries=2)
+        local.set('a', 1, 60)
+        local.set('b', 2, 60)
+        local.get('a')
+        local.set('c', 3, 60)
+
+        self.assertEqual(local.get('a'), 1)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(local.get('c'), 3)
+
+    def test_entries_expire(self):
+        """Test that entries are dropped once their TTL has passed"""
+        local = LocalCache(max_entries=10)
+        local.set('a', 1, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(local.get('a'))
+
+    def test_cache_family(self):
+        """Test that ids are stripped from namespaces and keys"""
+        self.assertEqual(cache_family('schedules_doctor_12'), 'schedules_doctor')
+        self.assertEqual(cache_family('schedules_doctor_12:1700000000000:response'), 'schedules_doctor')
+        self.assertEqual(cache_family('doctors'), 'doctors')
+
+    def test_local_family_is_served_without_shared_cache(self):
+        """Test that a local family hit does not need the shared cache"""
+        calls = []
+        key = versioned_cache_key('schedules_doctor_1')
+        get_cached_data(key, 60, count_calls(calls))
+        cache.delete(key)
+
+        self.assertEqual(get_cached_data(key, 60, count_calls(calls)), 'fresh')
+        self.assertEqual(calls, [1])
+
+    def test_shared_family_skips_local_tier(self):
+        """Test that families not listed in CACHE_LOCAL_FAMILIES always use the shared cache"""
+        calls = []
+        key = versioned_cache_key('appointments_user_1')
+        get_cached_data(key, 60, count_calls(calls))
+        cache.delete(key)
+
+        get_cached_data(key, 60, count_calls(calls))
+        self.assertEqual(calls, [1, 1])
+
+    @override_settings(CACHE_LOCAL_GENERATION_TTL=60)
+    def test_invalidation_from_another_process(self):
+        """Test that another process's invalidation is seen once the local generation expires"""
+        key = versioned_cache_key('doctors')
+
+        # Another process bumps the shared counter directly
+        cache.incr('cache_generation:doctors')
+        self.assertEqual(versioned_cache_key('doctors'), key)
+
+        clear_local_cache()
+        self.assertNotEqual(versioned_cache_key('doctors'), key)
+
+    @override_settings(CACHE_LOCAL_GENERATION_TTL=60)
+    def test_own_invalidation_is_seen_immediately(self):
+        """Test that this process's invalidations bypass the local generation"""
+        key = versioned_cache_key('doctors')
+        invalidate_cache_namespace('doctors')
+        self.assertNotEqual(versioned_cache_key('doctors'), key)
+
+
+class CanonicalQueryParamsTests(TestCase):
+    """Test canonical cache keys built from request parameters"""
+
+    def canonical(self, query):
+        request = Request(APIRequestFactory().get('/api/v1/appointments/', query))
+        view = AppointmentViewSet(request=request, format_kwarg=None)
+        return canonical_query_params(view, request)
+
+    def test_unknown_parameters_are_dropped(self):
+        """Test that parameters the view does not honour are ignored"""
+        self.assertEqual(self.canonical({'page': '2', 'junk': 'x', 'cachebuster': '123'}), 'page=2')
+
+    def test_parameter_order_is_irrelevant(self):
+        """Test that the same parameters in another order give the same key"""
+        self.assertEqual(
+            self.canonical({'search': 'test', 'ordering': 'created_at', 'page': '3'}),
+            self.canonical({'page': '3', 'ordering': 'created_at', 'search': 'test'}),
+        )
+
+    def test_values_are_normalized(self):
+        """Test that search terms, ordering and the first page are normalized"""
+        self.assertEqual(self.canonical({'search': '  Test   Patient '}), self.canonical({'search': 'test,patient'}))
+        self.assertEqual(self.canonical({'ordering': 'password,-created_at,-created_at'}), 'ordering=-created_at')
+        self.assertEqual(self.canonical({'page': '1'}), '')
+
+
+@override_settings(CACHE_COMPRESS_MIN_LENGTH=1024)
+class CacheCompressionTests(TestCase):
+    """Test compression of large cache values"""
+
+    def setUp(self):
+        self.cache = CompressedLocMemCache('compression-tests', {})
+        self.cache.clear()
+
+    def stored(self, key):
+        # Value as held by LocMemCache, before decompression
+        return LocMemCache.get(self.cache, key)
+
+    def test_large_values_are_compressed(self):
+        """Test that a value above the threshold is stored compressed and read back intact"""
+        payload = {'results': [{'id': i, 'bio': 'Board certified physician'} for i in range(100)]}
+        self.cache.set('doctors', payload, 60)
+
+        self.assertIsInstance(self.stored('doctors'), CompressedValue)
+        self.assertEqual(self.cache.get('doctors'), payload)
+        self.assertEqual(self.cache.get_many(['doctors']), {'doctors': payload})
+
+    def test_small_values_are_stored_as_is(self):
+        """Test that small values such as counters stay uncompressed and can be incremented"""
+        self.cache.add('cache_generation:doctors', 1)
+        self.cache.set('lock:doctors', 1, 10)
+
+        self.assertEqual(self.stored('lock:doctors'), 1)
+        self.assertEqual(self.cache.incr('cache_generation:doctors'), 2)
+
+    @override_settings(CACHE_COMPRESS_MIN_LENGTH=64, CACHE_COMPRESS_LEVEL=1)
+    def test_redis_compressor_uses_settings(self):
+        """Test that the django-redis compressor honours the threshold and level settings"""
+        compressor = ThresholdZlibCompressor({})
+        self.assertEqual((compressor.min_length, compressor.preset), (64, 1))
+
+        small, large = b'x' * 10, b'x' * 1000
+        self.assertEqual(compressor.compress(small), small)
+        self.assertLess(len(compressor.compress(large)), len(large))
+        self.assertEqual(compressor.decompress(compressor.compress(large)), large)
+
+
+class CacheStatsTests(APITestCase):
+    """Test cache statistics per key family"""
+
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        reset_cache_stats()
+
+    @override_settings(CACHE_STATS_SIZE_SAMPLE_RATE=1)
+    def test_get_cached_data_records_stats(self):
+        """Test that hits, misses, recompute time and size are counted per family"""
+        calls = []
+        for _ in range(3):
+            get_cached_data(versioned_cache_key('available_slots_doctor_1', '2025-06-02'), 60, count_calls(calls))
+        get_cached_data(versioned_cache_key('available_slots_doctor_2', '2025-06-02'), 60, count_calls(calls))
+
+        stats = get_cache_stats()['available_slots_doctor']
+        self.assertEqual((stats['hits'], stats['misses'], stats['computes']), (2, 2, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertGreater(stats['avg_bytes'], 0)
+        self.assertIsNotNone(stats['avg_compute_ms'])
+
+    @override_settings(CACHE_STATS_SIZE_SAMPLE_RATE=0)
+    def test_entry_sizes_are_sampled(self):
+        """Test that entries left out of the size sample are not counted towards the average size"""
+        get_cached_data(versioned_cache_key('available_slots_doctor_1', '2025-06-02'), 60, count_calls([]))
+
+        stats = get_cache_stats()['available_slots_doctor']
+        self.assertEqual((stats['stores'], stats['sized']), (1, 0))
+        self.assertIsNone(stats['avg_bytes'])
+
+    def test_families_of_concurrent_flushes_are_all_kept(self):
+        """Test that families registered by different processes are listed once each"""
+        _register_cache_stats_families({'doctors'})
+        _register_cache_stats_families({'doctors', 'schedules_doctor'})
+
+        self.assertEqual(set(get_cache_stats()), {'doctors', 'schedules_doctor'})
+        self.assertEqual(cache.get('cache_stats:families'), 2)
+        reset_cache_stats()
+        self.assertEqual(get_cache_stats(), {})
+
+    def test_invalidations_are_counted(self):
+        """Test that invalidations are counted against the namespace's family"""
+        invalidate_cache_namespace('schedules_doctor_1', 'schedules_doctor_2')
+        self.assertEqual(get_cache_stats()['schedules_doctor']['invalidations'], 2)
+
+    def test_stats_endpoint_is_staff_only(self):
+        """Test that only staff users can read the cache statistics"""
+        user = User.objects.create_user(username='user', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.assertEqual(self.client.get(reverse('cache-stats')).status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        invalidate_cache_namespace('doctors')
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['doctors']['invalidations'], 1)
+
+    def test_cache_stats_command(self):
+        """Test that the management command prints a row per family and can reset"""
+        invalidate_cache_namespace('doctors')
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+
+        self.assertIn('doctors', out.getvalue())
+        self.assertEqual(get_cache_stats(), {})
+
+
+class ValuesRendererTests(TestCase):
+    """Test rendering list rows straight from values_list()"""
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username='valuesdoctor', first_name='Val', last_name='Doctor'),
+            specialization='CARDIOLOGY',
+            license_number='VAL12345',
+            phone_number='+1234567890',
+            consultation_fee='150.50'
+        )
+        DoctorSchedule.objects.create(doctor=self.doctor, day_of_week=0, start_time='09:00', end_time='17:00')
+        self.patient = Patient.objects.create(
+            user=User.objects.create_user(username='valuespatient', first_name='Val', last_name=''),
+            gender='F',
+            phone_number='+1234567890',
+            address='1 Values Street',
+            emergency_contact_name='Contact',
+            emergency_contact_phone='+1234567890'
+        )
+        Appointment.objects.create(
+            patient=self.patient,
+            doctor=self.doctor,
+            appointment_date=date(2030, 1, 7),
+            appointment_time=dt_time(9, 30),
+            reason='Checkup'
+        )
+        MedicalRecord.objects.create(patient=self.patient, doctor=self.doctor, diagnosis='Healthy')
+
+    def assertRendersLikeSerializer(self, serializer_class, queryset, query=None):
+        request = Request(APIRequestFactory().get('/', query or {}))
+        serializer = serializer_class(context={'request': request})
+        columns, represent = values_renderer(serializer)
+
+        with self.assertNumQueries(1):
+            rows = [represent(row) for row in queryset.values_list(*columns)]
+        self.assertEqual(rows, serializer_class(queryset, many=True, context={'request': request}).data)
+
+    def test_same_representation_as_serializers(self):
+        """Test that rows render as the serializers render the instances"""
+        self.assertRendersLikeSerializer(AppointmentSerializer, Appointment.objects.all())
+        self.assertRendersLikeSerializer(DoctorSerializer, Doctor.objects.all())
+        self.assertRendersLikeSerializer(PatientSerializer, Patient.objects.all())
+        self.assertRendersLikeSerializer(MedicalRecordSerializer, MedicalRecord.objects.all())
+
+    def test_sparse_fieldsets(self):
+        """Test that rows render the fields and expansions a request asks for"""
+        self.assertRendersLikeSerializer(AppointmentSerializer, Appointment.objects.all(), {'fields': 'id,status_display,doctor.user'})
+        self.assertRendersLikeSerializer(AppointmentSerializer, Appointment.objects.all(), {'expand': 'patient'})
+        self.assertRendersLikeSerializer(MedicalRecordSerializer, MedicalRecord.objects.all(), {'expand': 'doctor'})
+
+    def test_method_fields_are_not_compiled(self):
+        """Test that a serializer with a method field of unknown sources is left to DRF"""
+        class SummarySerializer(serializers.ModelSerializer):
+            summary = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Appointment
+                fields = ['id', 'summary']
+
+            def get_summary(self, obj):
+                return f"{obj.patient} with {obj.doctor}"
+
+        self.assertIsNone(values_renderer(SummarySerializer()))
+
+
+class ORJSONTests(TestCase):
+    """Test the orjson renderer and parser against DRF's JSON ones"""
+
+    payload = {
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'consultation_fee': Decimal('120.50'),
+        'appointment_date': date(2030, 1, 7),
+        'appointment_time': dt_time(9, 30),
+        'slots': {1: ['09:00', '09:30']},
+        'notes': 'Line\u2028separator, caf\u00e9',
+        'results': [{'status': 'SCHEDULED', 'fee': None, 'paid': False}],
+    }
+
+    def test_renders_like_json_renderer(self):
+        """Test that the output is byte for byte JSONRenderer's"""
+        self.assertEqual(ORJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_indent(self):
+        """Test that an indent asked for in the Accept header pretty prints"""
+        rendered = ORJSONRenderer().render({'id': 1}, 'application/json; indent=4')
+        self.assertEqual(rendered, b'{\n  "id": 1\n}')
+
+    def test_parses_like_json_parser(self):
+        """Test that request bodies parse as with JSONParser, errors included"""
+        body = JSONRenderer().render(self.payload)
+        self.assertEqual(ORJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        self.assertEqual(
+            ORJSONParser().parse(BytesIO('{"name": "caf\u00e9"}'.encode('utf-16')), parser_context={'encoding': 'utf-16'}),
+            {'name': 'caf\u00e9'}
+        )
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"reason": '))
+
+    def test_falls_back_without_orjson(self):
+        """Test that both classes work as DRF's when orjson is not installed"""
+        with patch('healthcare.renderers.orjson', None):
+            self.assertEqual(ORJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+            self.assertEqual(ORJSONParser().parse(BytesIO(b'{"id": 1}')), {'id': 1})
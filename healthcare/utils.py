@@ -1,6 +1,25 @@
+import hashlib
+import json
 import logging
+import math
+import pickle
+import random
+import re
+import threading
+import time
 import uuid
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from functools import wraps
+from urllib.parse import urlencode
+from django.conf import settings
 from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from rest_framework import status
@@ -65,6 +84,13 @@ def custom_exception_handler(exc, context):
             'message': 'The request method is not allowed for this endpoint.',
             'status_code': response.status_code
         }
+    elif response.status_code == 409:
+        response.data = {
+            'error': 'Conflict',
+            'error_id': error_id,
+            'message': str(exc),
+            'status_code': response.status_code
+        }
     elif response.status_code == 429:
         response.data = {
             'error': 'Too many requests',
@@ -87,23 +113,652 @@ def custom_exception_handler(exc, context):
     
     return response
 
-def get_cached_data(cache_key, timeout, query_function, *args, **kwargs):
+class LocalCache:
+    
+    # Bounded, thread-safe in-process LRU cache with a TTL per entry. It sits
+    # in front of CACHES['default'] for the families listed in
+    # CACHE_LOCAL_FAMILIES, so hot reads of rarely changing data skip the
+    # network round trip. Values are pickled, like LocMemCache does, so
+    # callers can never mutate a cached object in place.
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+        return pickle.loads(pickled)
+    
+    def set(self, key, value, timeout):
+        if not timeout or timeout <= 0:
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, pickled)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+
+local_cache = LocalCache(getattr(settings, 'CACHE_LOCAL_MAX_ENTRIES', 1000))
+_local_generations = LocalCache(getattr(settings, 'CACHE_LOCAL_MAX_ENTRIES', 1000))
+
+def clear_local_cache():
+    
+    # Drop everything this process holds in its local tier.
+    
+    local_cache.clear()
+    _local_generations.clear()
+
+def cache_family(name):
+    
+    # Family of a namespace or cache key: its first segment without the trailing
+    # ids, e.g. 'schedules_doctor_12:1700000000000:...' -> 'schedules_doctor'.
+    
+    return re.sub(r'(_\d+)+$', '', name.split(':', 1)[0])
+
+def _uses_local_tier(name):
+    return cache_family(name) in getattr(settings, 'CACHE_LOCAL_FAMILIES', [])
+
+def _tiered_get(key):
+    
+    # Read through the local tier for local families, falling back to the shared cache.
+    
+    if not _uses_local_tier(key):
+        return cache.get(key)
+    value = local_cache.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is not None:
+            local_cache.set(key, value, getattr(settings, 'CACHE_LOCAL_TIMEOUT', 60))
+    return value
+
+def _tiered_set(key, value, timeout):
+    cache.set(key, value, timeout)
+    if _uses_local_tier(key):
+        local_timeout = getattr(settings, 'CACHE_LOCAL_TIMEOUT', 60)
+        local_cache.set(key, value, local_timeout if timeout is None else min(timeout, local_timeout))
+
+def _generation_key(namespace):
+    return f'cache_generation:{namespace}'
+
+def _new_generation():
+    # Seed counters from the clock so a counter that was evicted never
+    # comes back with a value that an older, still-cached entry was built with.
+    return int(time.time() * 1000)
+
+def get_cache_generations(namespaces):
+    
+    # Return the current generation counters of several cache namespaces in one
+    # round trip, creating the ones that do not exist yet. Counters of local
+    # families are remembered in-process for CACHE_LOCAL_GENERATION_TTL seconds,
+    # which bounds how long another process's invalidation can go unseen.
+    
+    generations = {}
+    keys = {}
+    for namespace in namespaces:
+        generation = _local_generations.get(namespace) if _uses_local_tier(namespace) else None
+        if generation is not None:
+            generations[namespace] = generation
+        else:
+            keys[namespace] = _generation_key(namespace)
+    
+    found = cache.get_many(keys.values()) if keys else {}
+    for namespace, key in keys.items():
+        generation = found.get(key)
+        if generation is None:
+            generation = _new_generation()
+            if not cache.add(key, generation, None):
+                # Another process created the counter first; use its value.
+                generation = cache.get(key, generation)
+        generations[namespace] = generation
+        if _uses_local_tier(namespace):
+            _local_generations.set(namespace, generation, getattr(settings, 'CACHE_LOCAL_GENERATION_TTL', 2))
+    return generations
+
+def get_cache_generation(namespace):
+    
+    # Return the current generation counter of a cache namespace, creating it on first use.
+    
+    return get_cache_generations([namespace])[namespace]
+
+def versioned_cache_key(namespaces, *parts):
+    
+    # Build a cache key inside one or more namespaces. The namespaces' generation
+    # counters are folded into the key, so bumping a counter orphans every key
+    # built with the previous value and they simply age out of the cache.
+    
+    if isinstance(namespaces, str):
+        namespaces = [namespaces]
+    generations = get_cache_generations(namespaces)
+    prefix = [f'{namespace}:{generations[namespace]}' for namespace in namespaces]
+    return ':'.join(prefix + [str(part) for part in parts])
+
+def invalidate_cache_namespace(*namespaces):
+    
+    # Invalidate every key of the given namespaces with one O(1) INCR each,
+    # instead of scanning the keyspace for matching keys.
+    
+    for namespace in namespaces:
+        key = _generation_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Counter was never created or has been evicted; start a fresh one.
+            cache.add(key, _new_generation(), None)
+        # This process sees its own invalidations immediately
+        _local_generations.delete(namespace)
+        _record_cache_stat(namespace, 'invalidations')
+
+_pending_invalidations = threading.local()
+
+def _flush_pending_invalidations(using):
+
+    # Runs once per write after commit; the first run drains every namespace
+    # queued by the transaction, so the rest find nothing left to do.
+
+    pending = getattr(_pending_invalidations, using, None)
+    if pending:
+        setattr(_pending_invalidations, using, set())
+        invalidate_cache_namespace(*sorted(pending))
+
+def invalidate_cache_namespace_on_commit(*namespaces, using=DEFAULT_DB_ALIAS):
+
+    # Queue namespaces for invalidation once the current transaction commits,
+    # so readers never cache rows that are not committed yet. Namespaces
+    # queued by the same transaction are invalidated once. Outside a
+    # transaction the invalidation runs immediately.
+
+    pending = getattr(_pending_invalidations, using, None)
+    if pending is None:
+        pending = set()
+        setattr(_pending_invalidations, using, pending)
+    pending.update(namespaces)
+    transaction.on_commit(lambda: _flush_pending_invalidations(using), using=using)
+
+_cache_invalidation_registry = defaultdict(list)
+
+def _invalidate_instance_namespaces(sender, instance, using, update_fields=None, **kwargs):
+    namespaces = []
+    for get_namespaces, fields in _cache_invalidation_registry[sender]:
+        if fields is None or update_fields is None or not update_fields.isdisjoint(fields):
+            namespaces.extend(get_namespaces(instance))
+    if namespaces:
+        invalidate_cache_namespace_on_commit(*namespaces, using=using)
+
+def register_cache_namespaces(model, get_namespaces, fields=None):
+
+    # Declare which cache namespaces a model's rows feed. get_namespaces
+    # receives the saved or deleted instance and should only read its own
+    # columns (e.g. doctor_id, not doctor.user.id) so that no extra queries
+    # are made on the write path. Invalidation fires on post_save and
+    # post_delete, which covers the API, the template views and the tasks.
+    # With fields, saves limited by update_fields to other columns (such as
+    # a User's last_login) are skipped.
+
+    _cache_invalidation_registry[model].append((get_namespaces, fields))
+    dispatch_uid = f'cache_invalidation_{model._meta.label_lower}'
+    post_save.connect(_invalidate_instance_namespaces, sender=model, dispatch_uid=dispatch_uid)
+    post_delete.connect(_invalidate_instance_namespaces, sender=model, dispatch_uid=dispatch_uid)
+
+class _CacheEntry(namedtuple('_CacheEntry', ['value', 'expires_at', 'compute_time'])):
+    
+    # Value stored by get_cached_data, with its logical expiry and the time it
+    # took to compute, which drives the probabilistic early refresh.
+    
+    __slots__ = ()
+
+_cache_metrics = defaultdict(Counter)
+_cache_metrics_lock = threading.Lock()
+
+def _record_cache_event(call_site, event):
+    with _cache_metrics_lock:
+        _cache_metrics[call_site][event] += 1
+
+def get_cache_metrics():
+    
+    # Per call-site counters of get_cached_data events in this process:
+    # hit, miss, early_refresh, contention, stale_served and wait_timeout.
+    
+    with _cache_metrics_lock:
+        return {call_site: dict(events) for call_site, events in _cache_metrics.items()}
+
+CACHE_STATS = [
+    'hits', 'misses', 'early_refreshes', 'stale_served', 'not_modified',
+    'computes', 'compute_us', 'stores', 'sized', 'bytes', 'invalidations',
+]
+
+_cache_stats = defaultdict(Counter)
+_cache_stats_lock = threading.Lock()
+_cache_stats_flushed_at = time.monotonic()
+
+def _cache_stats_key(family, stat):
+    return f'cache_stats:{family}:{stat}'
+
+def _register_cache_stats_families(families):
+    
+    # Families are listed under numbered keys, cache_stats:families:1 to the
+    # count in cache_stats:families. A family's marker key is claimed with
+    # add() and its number taken with incr(), both atomic, so processes
+    # flushing at the same time never overwrite each other's families.
+    
+    for family in families:
+        if not cache.add(f'cache_stats:family:{family}', True, None):
+            continue
+        cache.add('cache_stats:families', 0, None)
+        number = cache.incr('cache_stats:families')
+        cache.set(f'cache_stats:families:{number}', family, None)
+
+def _cache_stats_families():
+    count = cache.get('cache_stats:families', 0)
+    keys = [f'cache_stats:families:{number}' for number in range(1, count + 1)]
+    return set(cache.get_many(keys).values())
+
+def _record_cache_stat(key, stat, amount=1):
+    
+    # Count a cache statistic against the family of a key or namespace. Counts
+    # are buffered in-process and added to the shared cache every
+    # CACHE_STATS_FLUSH_INTERVAL seconds, so every process contributes to the
+    # same totals without a cache round trip per event.
+    
+    global _cache_stats_flushed_at
+    with _cache_stats_lock:
+        _cache_stats[cache_family(key)][stat] += amount
+        now = time.monotonic()
+        if now - _cache_stats_flushed_at < getattr(settings, 'CACHE_STATS_FLUSH_INTERVAL', 10):
+            return
+        _cache_stats_flushed_at = now
+    flush_cache_stats()
+
+def flush_cache_stats():
+    
+    # Add this process's buffered statistics to the shared totals.
+    
+    with _cache_stats_lock:
+        pending = dict(_cache_stats)
+        _cache_stats.clear()
+    
+    if not pending:
+        return
+    _register_cache_stats_families(pending)
+    
+    for family, stats in pending.items():
+        for stat, amount in stats.items():
+            key = _cache_stats_key(family, stat)
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                if not cache.add(key, amount, None):
+                    cache.incr(key, amount)
+
+def get_cache_stats():
+    
+    # Statistics per cache family, summed over every process: raw counters
+    # plus the hit rate, average recompute time and average stored size.
+    
+    flush_cache_stats()
+    families = sorted(_cache_stats_families())
+    keys = [_cache_stats_key(family, stat) for family in families for stat in CACHE_STATS]
+    values = cache.get_many(keys)
+    
+    result = {}
+    for family in families:
+        stats = {stat: values.get(_cache_stats_key(family, stat), 0) for stat in CACHE_STATS}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        stats['avg_compute_ms'] = stats['compute_us'] / stats['computes'] / 1000 if stats['computes'] else None
+        stats['avg_bytes'] = stats['bytes'] // stats['sized'] if stats['sized'] else None
+        result[family] = stats
+    return result
+
+def reset_cache_stats():
+    
+    # Forget the collected statistics, e.g. after changing a cache timeout.
     
-    # Try to get data from cache
-    data = cache.get(cache_key)
+    with _cache_stats_lock:
+        _cache_stats.clear()
+    families = _cache_stats_families()
+    count = cache.get('cache_stats:families', 0)
+    cache.delete_many(
+        [_cache_stats_key(family, stat) for family in families for stat in CACHE_STATS]
+        + [f'cache_stats:family:{family}' for family in families]
+        + [f'cache_stats:families:{number}' for number in range(1, count + 1)]
+        + ['cache_stats:families']
+    )
+
+def _should_refresh_early(entry, now):
     
-    # If not in cache, execute the query function and cache the result
-    if data is None:
-        data = query_function(*args, **kwargs)
-        cache.set(cache_key, data, timeout)
+    # XFetch: recompute before the entry expires with a probability that grows
+    # as expiry approaches and with how expensive the value is to compute.
     
+    if entry.expires_at is None:
+        return False
+    beta = getattr(settings, 'CACHE_EARLY_REFRESH_BETA', 1.0)
+    return now - entry.compute_time * beta * math.log(1.0 - random.random()) >= entry.expires_at
+
+def _compute_and_store(cache_key, timeout, query_function, args, kwargs):
+    started = time.monotonic()
+    data = query_function(*args, **kwargs)
+    compute_time = time.monotonic() - started
+    
+    if timeout is None:
+        entry = _CacheEntry(data, None, compute_time)
+        _tiered_set(cache_key, entry, None)
+    else:
+        # Keep the entry past its logical expiry so concurrent callers can be
+        # served the stale value while a single worker recomputes it.
+        stale_ttl = getattr(settings, 'CACHE_STALE_TTL', 60)
+        entry = _CacheEntry(data, time.time() + timeout, compute_time)
+        _tiered_set(cache_key, entry, timeout + stale_ttl)
+    
+    _record_cache_stat(cache_key, 'computes')
+    _record_cache_stat(cache_key, 'compute_us', int(compute_time * 1e6))
+    _record_cache_stat(cache_key, 'stores')
+    # The backend pickles the entry again on its own, so only a sample of
+    # entries is measured to estimate the family's average size
+    if random.random() < getattr(settings, 'CACHE_STATS_SIZE_SAMPLE_RATE', 0.1):
+        _record_cache_stat(cache_key, 'sized')
+        _record_cache_stat(cache_key, 'bytes', len(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)))
     return data
 
-def invalidate_cache_pattern(pattern):
-  
-    # This is a simplified version. In a real-world scenario, you would need
-    # to use a more sophisticated approach to find and delete keys matching a pattern.
-    # Redis supports the SCAN command for this purpose.
-    keys = cache.keys(pattern)
-    if keys:
-        cache.delete_many(keys)
+def get_cached_data(cache_key, timeout, query_function, *args, **kwargs):
+    
+    # Return cached data, computing it with query_function on a miss. Only one
+    # worker recomputes an entry at a time (single flight, guarded by a short
+    # lock key); the others get the stale value or wait briefly for the fresh
+    # one. Hot entries are refreshed early, before they expire (XFetch).
+    
+    call_site = f'{query_function.__module__}.{query_function.__qualname__}'
+    entry = _tiered_get(cache_key)
+    
+    if entry is not None and not isinstance(entry, _CacheEntry):
+        # Plain value written by an older version of this helper
+        _record_cache_event(call_site, 'hit')
+        _record_cache_stat(cache_key, 'hits')
+        return entry
+    
+    if entry is not None and not _should_refresh_early(entry, time.time()):
+        _record_cache_event(call_site, 'hit')
+        _record_cache_stat(cache_key, 'hits')
+        return entry.value
+    
+    _record_cache_event(call_site, 'miss' if entry is None else 'early_refresh')
+    _record_cache_stat(cache_key, 'misses' if entry is None else 'early_refreshes')
+    
+    lock_key = f'lock:{cache_key}'
+    if cache.add(lock_key, 1, getattr(settings, 'CACHE_LOCK_TIMEOUT', 10)):
+        try:
+            return _compute_and_store(cache_key, timeout, query_function, args, kwargs)
+        finally:
+            cache.delete(lock_key)
+    
+    # Another worker is already recomputing this entry
+    _record_cache_event(call_site, 'contention')
+    logger.debug(f"Cache recompute contention on {cache_key} ({call_site})")
+    
+    if entry is not None:
+        _record_cache_event(call_site, 'stale_served')
+        _record_cache_stat(cache_key, 'stale_served')
+        return entry.value
+    
+    # Nothing to serve yet: wait briefly for the other worker's result
+    deadline = time.monotonic() + getattr(settings, 'CACHE_LOCK_WAIT', 1.0)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(cache_key)
+        if isinstance(entry, _CacheEntry):
+            return entry.value
+    
+    _record_cache_event(call_site, 'wait_timeout')
+    return _compute_and_store(cache_key, timeout, query_function, args, kwargs)
+
+def canonical_query_params(view, request, extra_params=()):
+    
+    # Canonical form of the query parameters a view actually honours: search,
+    # ordering and pagination from its filter backends and paginator, plus the
+    # view's cache_query_params and any extra_params. Unknown parameters are
+    # dropped and values normalized, so junk or reordered parameters cannot
+    # mint distinct cache entries.
+    
+    query_params = request.query_params
+    params = {}
+    
+    for backend in getattr(view, 'filter_backends', []):
+        search_param = getattr(backend, 'search_param', None)
+        if search_param and getattr(view, 'search_fields', None):
+            # SearchFilter splits terms on whitespace and commas and matches case-insensitively
+            terms = query_params.get(search_param, '').replace(',', ' ').lower().split()
+            if terms:
+                params[search_param] = ' '.join(terms)
+        
+        ordering_param = getattr(backend, 'ordering_param', None)
+        ordering_fields = getattr(view, 'ordering_fields', None)
+        if ordering_param and ordering_fields:
+            terms = []
+            for term in query_params.get(ordering_param, '').split(','):
+                term = term.strip()
+                # OrderingFilter ignores fields that are not orderable
+                valid = ordering_fields == '__all__' or term.lstrip('-') in ordering_fields
+                if term and valid and term not in terms:
+                    terms.append(term)
+            if terms:
+                params[ordering_param] = ','.join(terms)
+    
+    paginator = getattr(view, 'paginator', None)
+    page_param = getattr(paginator, 'page_query_param', None)
+    page_size_param = getattr(paginator, 'page_size_query_param', None)
+    if page_param:
+        page = query_params.get(page_param, '').strip()
+        if page and page != '1':
+            params[page_param] = page
+    if page_size_param:
+        page_size = query_params.get(page_size_param, '').strip()
+        if page_size:
+            params[page_size_param] = page_size
+    
+    for param in list(getattr(view, 'cache_query_params', [])) + list(extra_params):
+        value = query_params.get(param, '').strip()
+        if value:
+            params[param] = value
+    
+    return urlencode(sorted(params.items()))
+
+def response_cache_key(view, request, namespaces, query_params=(), vary_on_date=False):
+    
+    # Build the cache key of a rendered API response. The request path, the
+    # requesting user and the canonical query parameters are hashed, so the key
+    # has a fixed length whatever the client sends. Views whose responses are
+    # the same for many users can share entries by returning a common scope
+    # from get_cache_scope().
+    
+    get_cache_scope = getattr(view, 'get_cache_scope', None)
+    scope = get_cache_scope() if get_cache_scope else f'user_{request.user.pk}'
+    parts = [request.path, scope, canonical_query_params(view, request, query_params)]
+    if vary_on_date:
+        # Responses filtered relative to "today" must not outlive the day.
+        parts.append(timezone.now().date().isoformat())
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return versioned_cache_key(namespaces, 'response', digest)
+
+def response_etag(cache_key):
+    
+    # Strong validator of a cached response. The cache key already changes
+    # whenever one of its namespaces is invalidated, so it doubles as a version.
+    
+    return '"%s"' % hashlib.md5(cache_key.encode()).hexdigest()
+
+def _etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison
+    return etag in [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+
+def cache_response(timeout_setting, namespaces=None, query_params=(), vary_on_date=False):
+    
+    # Cache the rendered JSON body of a DRF view method. A hit costs one cache GET
+    # and returns the stored bytes without any ORM or serializer work.
+    # `namespaces` is a callable taking the view; it defaults to the view's
+    # get_cache_namespaces(). Returning no namespaces bypasses the cache.
+    # `query_params` lists the filter parameters this method reads itself.
+    # Responses carry an ETag, and a request whose If-None-Match still matches
+    # gets a 304 after reading the generation counters only.
+    
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            cache_namespaces = namespaces(self) if namespaces else self.get_cache_namespaces()
+            if not cache_namespaces or request.accepted_renderer.format != 'json':
+                return view_method(self, request, *args, **kwargs)
+            
+            cache_key = response_cache_key(self, request, cache_namespaces, query_params, vary_on_date)
+            etag = response_etag(cache_key)
+            if _etag_matches(request, etag):
+                _record_cache_stat(cache_key, 'not_modified')
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+            
+            content = _tiered_get(cache_key)
+            if content is not None:
+                _record_cache_stat(cache_key, 'hits')
+                response = HttpResponse(content, content_type=request.accepted_media_type)
+            else:
+                _record_cache_stat(cache_key, 'misses')
+                started = time.monotonic()
+                response = view_method(self, request, *args, **kwargs)
+                
+                # Only successful responses are cached, rendered the same way
+                # finalize_response would render them.
+                if not (isinstance(response, Response) and response.status_code == status.HTTP_200_OK):
+                    return response
+                response.accepted_renderer = request.accepted_renderer
+                response.accepted_media_type = request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+                _tiered_set(cache_key, response.content, getattr(settings, timeout_setting))
+                _record_cache_stat(cache_key, 'computes')
+                _record_cache_stat(cache_key, 'compute_us', int((time.monotonic() - started) * 1e6))
+                _record_cache_stat(cache_key, 'stores')
+                _record_cache_stat(cache_key, 'bytes', len(response.content))
+            
+            # Responses are per user; clients must revalidate before reuse
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+
+# Failures a retry would hit again, stored like successes
+IDEMPOTENT_STORED_ERRORS = (status.HTTP_400_BAD_REQUEST, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+def idempotent(timeout_setting):
+    
+    # Make an unsafe DRF view method safe to retry. The first request with an
+    # Idempotency-Key header runs the view and stores its rendered response; a
+    # retry with the same key gets the stored bytes back from one cache GET,
+    # without touching the database. Only successes and validation failures
+    # are stored: a request that raised, failed on the server or hit a
+    # conflict such as a taken slot may succeed later, so its key is released
+    # for the retry. Keys are scoped to the user and the path. A retry arriving
+    # while the first request still runs gets a 409, and a key reused for a
+    # different body a 422. Requests without the header run as usual.
+    
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER, '').strip()
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            
+            scope = hashlib.sha256(f'{request.path}|{request.user.pk}|{key}'.encode()).hexdigest()
+            cache_key = f'idempotency:{scope}'
+            fingerprint = hashlib.sha256(
+                json.dumps(request.data, sort_keys=True, default=str).encode()
+            ).hexdigest()
+            
+            # Claimed by the first request until its response is stored. A claim
+            # that expired between add() and get() is claimed again; should
+            # another request win that race, this one is still in progress
+            for attempt in range(2):
+                if cache.add(cache_key, (fingerprint, None), settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                    stored = None
+                    break
+                stored = cache.get(cache_key)
+                if stored is not None:
+                    break
+            else:
+                stored = (fingerprint, None)
+            
+            if stored is not None:
+                stored_fingerprint, stored_response = stored
+                if stored_fingerprint != fingerprint:
+                    return Response(
+                        {'error': 'Unprocessable Entity',
+                         'message': f'This {IDEMPOTENCY_KEY_HEADER} was used for a different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                if stored_response is None:
+                    return Response(
+                        {'error': 'Conflict',
+                         'message': f'A request with this {IDEMPOTENCY_KEY_HEADER} is still being processed.'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                status_code, content_type, content = stored_response
+                response = HttpResponse(content, status=status_code, content_type=content_type)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except ValidationError as exc:
+                # Rendered by the exception handler here, so a retry of the
+                # same invalid body gets the stored 400 like a returned one
+                response = self.handle_exception(exc)
+            except Exception:
+                # Nothing was committed; a retry may run again
+                cache.delete(cache_key)
+                raise
+            if not isinstance(response, Response) or not (
+                status.is_success(response.status_code) or response.status_code in IDEMPOTENT_STORED_ERRORS
+            ):
+                cache.delete(cache_key)
+                return response
+            
+            # Rendered the way finalize_response would render it
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            cache.set(
+                cache_key,
+                (fingerprint, (response.status_code, response['Content-Type'], response.content)),
+                getattr(settings, timeout_setting)
+            )
+            return response
+        return wrapper
+    return decorator
@@ -3,12 +3,12 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.core.cache import cache
 from django.shortcuts import get_object_or_404
-from django.conf import settings
 
 from .models import Patient, MedicalRecord
 from .serializers import PatientSerializer, PatientCreateSerializer, MedicalRecordSerializer
 from healthcare.permissions import IsPatient, IsDoctor, IsPatientOrDoctor, IsAdminUser
-from healthcare.utils import get_cached_data, invalidate_cache_pattern
+from healthcare.serializers import SPARSE_FIELDSET_PARAMS, list_response, select_for_serializer
+from healthcare.utils import cache_response
 
 class PatientViewSet(viewsets.ModelViewSet):
     
@@ -48,56 +48,50 @@ class PatientViewSet(viewsets.ModelViewSet):
         
         user = self.request.user
         
-        # Cache key based on user ID and query parameters
-        cache_key = f'patients_user_{user.id}_{self.request.query_params}'
-        
-        # Define the query function
-        def get_patients():
-            if hasattr(user, 'patient'):
-                # User is a patient, return only their profile
-                return Patient.objects.filter(user=user)
-            elif hasattr(user, 'doctor') or user.is_staff:
-                # User is a doctor or admin, return all patients
-                return Patient.objects.all()
-            else:
-                # User is neither a patient nor a doctor nor an admin
-                return Patient.objects.none()
+        if hasattr(user, 'patient'):
+            # User is a patient, return only their profile
+            queryset = Patient.objects.filter(user=user)
+        elif hasattr(user, 'doctor') or user.is_staff:
+            # User is a doctor or admin, return all patients
+            queryset = Patient.objects.all()
+        else:
+            # User is neither a patient nor a doctor nor an admin
+            return Patient.objects.none()
         
-        # Get cached data or execute query
-        return get_cached_data(cache_key, settings.PATIENT_CACHE_TIMEOUT, get_patients)
+        # Load only what ?fields= asks for
+        if self.action in ['list', 'retrieve']:
+            return select_for_serializer(queryset, self.get_serializer())
+        return queryset
     
-    def perform_create(self, serializer):
+    def get_cache_namespaces(self):
         
-        #Create a new patient.
+        #Patient profiles share one namespace; the response cache
+        #still keys each entry by the requesting user.
         
-        patient = serializer.save()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'patients_user_{patient.user.id}_*')
+        return ['patients']
     
-    def perform_update(self, serializer):
-        
-        #Update a patient.
+    def get_medical_records_cache_namespaces(self):
         
-        patient = serializer.save()
+        #Records name their doctor, so they follow the doctors namespace too.
+        #Non-numeric pks bypass the cache so they cannot mint generation counters.
         
-        # Invalidate cache
-        invalidate_cache_pattern(f'patients_user_{patient.user.id}_*')
+        pk = str(self.kwargs.get('pk', ''))
+        return [f'medical_records_patient_{pk}', 'doctors'] if pk.isdigit() else []
     
-    def perform_destroy(self, instance):
-        
-        #Delete a patient.
-        
-        # Store ID before deletion for cache invalidation
-        user_id = instance.user.id
-        
-        # Delete the patient
-        instance.delete()
-        
-        # Invalidate cache
-        invalidate_cache_pattern(f'patients_user_{user_id}_*')
+    @cache_response('PATIENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @cache_response('PATIENT_CACHE_TIMEOUT', query_params=SPARSE_FIELDSET_PARAMS)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=True, methods=['get'])
+    @cache_response(
+        'PATIENT_CACHE_TIMEOUT',
+        namespaces=lambda view: view.get_medical_records_cache_namespaces(),
+        query_params=SPARSE_FIELDSET_PARAMS
+    )
     def medical_records(self, request, pk=None):
         
         #Get medical records for a patient.
@@ -111,22 +105,10 @@ class PatientViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Cache key
-        cache_key = f'medical_records_patient_{patient.id}'
-        
-        # Define the query function
-        def get_medical_records():
-            return MedicalRecord.objects.filter(patient=patient).order_by('-created_at')
-        
-        # Get cached data or execute query
-        medical_records = get_cached_data(cache_key, settings.PATIENT_CACHE_TIMEOUT, get_medical_records)
-        
-        # Paginate and serialize
-        page = self.paginate_queryset(medical_records)
-        if page is not None:
-            serializer = MedicalRecordSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = MedicalRecordSerializer(medical_records, many=True)
-        return Response(serializer.data)
+        serializer = MedicalRecordSerializer(context=self.get_serializer_context())
+        medical_records = select_for_serializer(
+            MedicalRecord.objects.filter(patient=patient).order_by('-created_at'),
+            serializer
+        )
+        return list_response(self, medical_records, serializer)
 
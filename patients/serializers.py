@@ -1,16 +1,25 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Patient, MedicalRecord
+from doctors.serializers import DoctorSerializer
+from healthcare.serializers import DynamicFieldsMixin
+
+def user_full_name(first_name, last_name):
+    # User.get_full_name, from its columns
+    return f"{first_name} {last_name}".strip()
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     full_name = serializers.SerializerMethodField()
     
+    field_sources = {'full_name': ['user__first_name', 'user__last_name']}
+    field_values = {'full_name': '{} {}'.format}
+    
     class Meta:
         model = Patient
         fields = '__all__'
@@ -33,10 +42,18 @@ class PatientCreateSerializer(serializers.ModelSerializer):
         patient = Patient.objects.create(user=user, **validated_data)
         return patient
 
-class MedicalRecordSerializer(serializers.ModelSerializer):
+class MedicalRecordSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.user.get_full_name', read_only=True)
     doctor_name = serializers.CharField(source='doctor.user.get_full_name', read_only=True)
     
+    # Patient and doctor are primary keys unless ?expand= asks for them
+    expandable_fields = {'patient': PatientSerializer, 'doctor': DoctorSerializer}
+    field_sources = {
+        'patient_name': ['patient__user__first_name', 'patient__user__last_name'],
+        'doctor_name': ['doctor__user__first_name', 'doctor__user__last_name'],
+    }
+    field_values = {'patient_name': user_full_name, 'doctor_name': user_full_name}
+    
     class Meta:
         model = MedicalRecord
         fields = '__all__'
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+
+from healthcare.utils import register_cache_namespaces
+
+from .models import Patient, MedicalRecord
+
+# Cache namespaces fed by each model; invalidated after commit on every save and delete.
+register_cache_namespaces(Patient, lambda patient: ['patients', f'medical_records_patient_{patient.id}'])
+register_cache_namespaces(MedicalRecord, lambda record: [
+    f'medical_records_patient_{record.patient_id}',
+])
+
+def patient_user_cache_namespaces(user):
+    
+    #A patient's name and email are shown with the profile, the appointments
+    #and the medical records; one query finds the patient behind the user.
+    
+    return [
+        namespace
+        for patient_id in Patient.objects.filter(user_id=user.id).values_list('id', flat=True)
+        for namespace in (
+            'patients',
+            f'appointments_patient_{patient_id}',
+            f'medical_records_patient_{patient_id}',
+        )
+    ]
+
+register_cache_namespaces(User, patient_user_cache_namespaces, fields=['username', 'first_name', 'last_name', 'email'])
@@ -2,6 +2,7 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.core.cache import cache
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
@@ -9,6 +10,7 @@ from datetime import date, timedelta
 
 from .models import Patient, MedicalRecord
 from doctors.models import Doctor
+from doctors.serializers import DoctorSerializer
 from appointments.models import Appointment
 from .serializers import PatientSerializer, MedicalRecordSerializer
 
@@ -55,6 +57,8 @@ class PatientModelTests(TestCase):
 
 class PatientAPITests(APITestCase):
     def setUp(self):
+        cache.clear()
+        
         # Create test user and patient
         self.user = User.objects.create_user(
             username='testpatient',
@@ -101,6 +105,13 @@ class PatientAPITests(APITestCase):
         self.assertEqual(response.data['address'], 'New Address')
         self.assertEqual(response.data['insurance_provider'], 'New Insurance')
 
+    def test_update_ignores_sparse_fieldsets(self):
+        """Test that ?fields= does not drop the fields a PATCH sends"""
+        response = self.client.patch(self.detail_url + '?fields=id', {'address': 'New Address'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.patient.refresh_from_db()
+        self.assertEqual(self.patient.address, 'New Address')
+
     def test_get_medical_records(self):
         """Test retrieving patient's medical records"""
         # Create doctor
@@ -131,6 +142,14 @@ class PatientAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['diagnosis'], 'Test diagnosis')
+        
+        # Relations are primary keys unless expanded
+        self.assertEqual(response.data['results'][0]['doctor'], doctor.id)
+        response = self.client.get(self.medical_records_url, {'fields': 'diagnosis,doctor', 'expand': 'doctor'})
+        self.assertEqual(response.data['results'][0], {
+            'diagnosis': 'Test diagnosis',
+            'doctor': DoctorSerializer(doctor).data
+        })
 
 
       
\ No newline at end of file
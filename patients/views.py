@@ -18,7 +18,7 @@ def dashboard(request):
         return redirect('home')
     
     # Get upcoming appointments
-    upcoming_appointments = Appointment.objects.filter(
+    upcoming_appointments = Appointment.objects.for_display().filter(
         patient=patient,
         appointment_date__gte=timezone.now().date(),
         status__in=['SCHEDULED', 'CONFIRMED']